@@ -0,0 +1,42 @@
+import os
+from flask import Blueprint, jsonify, request, abort
+from app import db
+import db_pool
+import rate_index
+import reference_cache
+import snapshots
+
+admin_bp = Blueprint('admin', __name__)
+
+# When set, admin endpoints require "Authorization: Bearer <ADMIN_TOKEN>".
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+@admin_bp.before_request
+def check_token():
+    if ADMIN_TOKEN and request.headers.get("Authorization") != f"Bearer {ADMIN_TOKEN}":
+        abort(403)
+
+
+@admin_bp.route('/admin/pool', methods=['GET'])
+def pool_status():
+    """Connection pool metrics for this worker process (each gunicorn worker has its own pool)."""
+    return jsonify(db_pool.pool_stats(db.engine))
+
+
+@admin_bp.route('/admin/reference', methods=['GET'])
+def reference_status():
+    """Versions and freshness of this worker's cached template/country_v2."""
+    return jsonify(reference_cache.status())
+
+
+@admin_bp.route('/admin/rate-index', methods=['GET'])
+def rate_index_status():
+    """Versions and size of this worker's in-memory rate index (/rate)."""
+    return jsonify(rate_index.status())
+
+
+@admin_bp.route('/admin/snapshots', methods=['GET'])
+def snapshot_status():
+    """Table snapshot versions on disk and mapped by this worker."""
+    return jsonify(snapshots.status())
@@ -0,0 +1,176 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import text
+from app import db
+from ratesheet_schema import COLUMN_MAPPING, INTERVAL_FIELDS, convert_frame, column_rows, interval_columns, sql_type
+from sheet_reader import iter_sheet_chunks
+from upload_hooks import commit_changes
+
+batch_edit_bp = Blueprint('batch_edit', __name__)
+
+FIELDS = list(COLUMN_MAPPING.values())
+# most patches one POST /data/batch may carry (all of them go into one UPDATE statement)
+BATCH_EDIT_MAX = int(os.getenv("BATCH_EDIT_MAX", "1000"))
+
+
+class PatchError(ValueError):
+    """A batch that can't be applied; `details` is returned to the client."""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or []
+
+
+def patches_from_sheet(file):
+    """
+    Read a spreadsheet of changed rows: an `id` column plus any ratesheet
+    columns, headed either with the Excel headers or the model field names.
+    Every column present is applied, so an empty cell clears the value.
+    """
+    patches = []
+    for chunk in iter_sheet_chunks(file):
+        chunk = chunk.rename(columns=COLUMN_MAPPING)
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        patches.extend(chunk.to_dict("records"))
+    return patches
+
+
+def validate_patches(patches):
+    """
+    Check ids and field names and convert values with the upload schema.
+    Returns (ids, fields, {field: typed values}, {field: bool mask of rows that set it});
+    fields include the normalized columns of any patched charging interval.
+    Raises PatchError listing every problem found.
+    """
+    if not patches:
+        raise PatchError("No patches given")
+    if len(patches) > BATCH_EDIT_MAX:
+        raise PatchError(f"At most {BATCH_EDIT_MAX} patches per batch, got {len(patches)}")
+    problems = []
+    ids = []
+    for i, patch in enumerate(patches):
+        if not isinstance(patch, dict):
+            problems.append({"row": i, "error": "patch must be an object"})
+            continue
+        try:
+            ids.append(int(patch.get("id")))
+        except (TypeError, ValueError):
+            problems.append({"row": i, "field": "id", "value": patch.get("id"), "error": "missing or invalid id"})
+        for field in patch:
+            if field != "id" and field not in COLUMN_MAPPING.values():
+                problems.append({"row": i, "field": field, "error": "unknown field"})
+    if not problems and len(set(ids)) != len(ids):
+        problems.append({"field": "id", "error": "each id may appear only once per batch"})
+    if problems:
+        raise PatchError("Invalid patches", problems)
+
+    fields = [f for f in FIELDS if any(f in p for p in patches)]
+    if not fields:
+        raise PatchError("Patches do not change any field")
+    frame = pd.DataFrame([{f: p.get(f) for f in fields} for p in patches], columns=fields)
+    columns, errors = convert_frame(frame, mapping={f: f for f in fields})
+    if len(errors):
+        raise PatchError("Values failed validation", json.loads(errors.to_json(orient="records", date_format="iso")))
+    masks = {f: np.array([f in p for p in patches]) for f in fields}
+    # a patched charging interval also rewrites its normalized columns
+    for field in fields:
+        if field in INTERVAL_FIELDS:
+            for column in interval_columns(field):
+                masks[column] = masks[field]
+    return ids, list(columns), columns, masks
+
+
+def _values_update_sql(fields, n_rows):
+    """
+    One UPDATE ... FROM (VALUES ...) for n_rows patches. Each field comes with
+    a set_<field> flag, so rows that don't touch a field keep its value.
+    Every placeholder is cast to its column type: VALUES would otherwise infer
+    a column's type from the literals, and fail when e.g. a tax value is 0.15
+    in one patch and "15%" in another.
+    """
+    cols = ["id"] + [c for f in fields for c in (f, f"set_{f}")]
+    types = {"id": "INTEGER", **{f: sql_type(f) for f in fields}, **{f"set_{f}": "BOOLEAN" for f in fields}}
+    rows = ", ".join(
+        "(" + ", ".join(f"CAST(:{c}_{i} AS {types[c]})" for c in cols) + ")" for i in range(n_rows)
+    )
+    assignments = ",\n    ".join(
+        f"{f} = CASE WHEN v.set_{f} THEN v.{f} ELSE r.{f} END" for f in fields
+    )
+    return f"""
+UPDATE ratesheet_v2 AS r SET
+    {assignments},
+    row_hash = NULL
+FROM (VALUES {rows}) AS v({", ".join(cols)})
+WHERE r.id = v.id
+RETURNING r.id;
+"""
+
+
+def apply_patches(session, patches):
+    """
+    Validate and apply a batch of {id, field: value} patches in a single
+    UPDATE statement and transaction. Either every patch is applied or none.
+    Returns the number of records updated.
+    """
+    ids, fields, columns, masks = validate_patches(patches)
+    rows = list(column_rows(columns))
+
+    if session.connection().dialect.name != "postgresql":
+        # no UPDATE ... FROM (VALUES) elsewhere: one statement per patch, same transaction
+        missing = []
+        for i, record_id in enumerate(ids):
+            changed = [f for f in fields if masks[f][i]]
+            values = dict(zip(fields, rows[i]))
+            sql = f"UPDATE ratesheet_v2 SET {', '.join(f'{f} = :{f}' for f in changed)}, row_hash = NULL WHERE id = :id"
+            if not session.execute(text(sql), {"id": record_id, **{f: values[f] for f in changed}}).rowcount:
+                missing.append(record_id)
+        updated = len(ids) - len(missing)
+    else:
+        params = {}
+        for i, record_id in enumerate(ids):
+            params[f"id_{i}"] = record_id
+            for f, value in zip(fields, rows[i]):
+                params[f"{f}_{i}"] = value
+                params[f"set_{f}_{i}"] = bool(masks[f][i])
+        found = {r[0] for r in session.execute(text(_values_update_sql(fields, len(ids))), params)}
+        updated = len(found)
+        missing = [i for i in ids if i not in found]
+
+    if missing:
+        session.rollback()
+        raise PatchError("Some records do not exist; nothing was updated",
+                         [{"id": i, "error": "not found"} for i in missing])
+    commit_changes(session, "ratesheet_v2")
+    return updated
+
+
+@batch_edit_bp.route('/data/batch', methods=['POST'])
+def batch_edit():
+    """
+    Apply many record edits at once. Body: JSON list of {"id": ..., field: value}
+    (or {"patches": [...]}), or a multipart `file` upload of changed rows.
+    """
+    logger = current_app.logger
+    try:
+        file = request.files.get("file")
+        if file:
+            patches = patches_from_sheet(file)
+        else:
+            body = request.get_json(silent=True)
+            patches = body.get("patches") if isinstance(body, dict) else body
+        if not isinstance(patches, list):
+            raise PatchError("Expected a JSON list of patches or a spreadsheet file")
+        updated = apply_patches(db.session, patches)
+    except PatchError as e:
+        db.session.rollback()
+        logger.warning(f"Batch edit rejected: {e}")
+        return jsonify(error=str(e), details=e.details), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Error applying batch edit")
+        return jsonify(error=str(e)), 500
+    logger.info(f"Batch edit updated {updated} records")
+    return jsonify(updated=updated)
@@ -0,0 +1,72 @@
+import os
+
+import click
+import pandas as pd
+from flask import Blueprint, jsonify, request, url_for
+from app import db
+import cdr_costing
+import jobs
+
+cdr_bp = Blueprint('cdr', __name__)
+
+CDR_FORMATS = ("csv", "parquet")
+
+
+def run_cdr_costing_job(job, path, filename, fmt="csv"):
+    """Background job (see jobs.JOB_KINDS): price a saved usage file, then delete it."""
+    try:
+        job.update(phase="loading rates")
+        table = cdr_costing.load_rates(db.session)
+        db.session.rollback()
+        job.update(phase="pricing")
+        output = jobs.job_file_path(f".{fmt}")
+        summary = cdr_costing.price_file(table, path, output, totals_path=jobs.job_file_path(".csv"),
+                                         progress=job.update)
+    finally:
+        os.remove(path)
+    totals = pd.read_csv(summary["totals"], dtype={"tadig_plmn_code": str, "service": str})
+    os.remove(summary["totals"])
+    name = os.path.splitext(os.path.basename(filename or "usage"))[0]
+    return {
+        **{key: summary[key] for key in ("records", "priced", "total", "seconds")},
+        "path": output,
+        "download_name": f"{name}_priced.{fmt}",
+        "partner_totals": totals.astype(object).where(totals.notna(), None).to_dict("records"),
+    }
+
+
+@cdr_bp.route('/cdr/price', methods=['POST'])
+def price_cdrs():
+    """
+    Price an uploaded usage file (CSV or Parquet, cdr_costing.USAGE_COLUMNS)
+    in a background job: ?format=csv|parquet for the priced records. Poll the
+    returned status_url; partner totals come with the result.
+    """
+    file = request.files.get("file")
+    if not file:
+        return jsonify(error="No file provided"), 400
+    fmt = request.args.get("format", "csv")
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    if fmt not in CDR_FORMATS or extension not in (".csv", ".parquet", ".pq"):
+        return jsonify(error="expected a .csv or .parquet usage file and ?format=csv|parquet"), 400
+    path = jobs.job_file_path(extension)
+    file.save(path)
+    job_id = jobs.enqueue("cdr_costing", path=path, filename=file.filename, fmt=fmt)
+    return jsonify(job_id=job_id, status_url=url_for("jobs.job_status", job_id=job_id)), 202
+
+
+@cdr_bp.cli.command("price")
+@click.argument("source")
+@click.argument("output")
+@click.option("--totals", "totals_path", default=None, help="per-partner totals CSV, default <output>_totals.csv")
+@click.option("--workers", type=int, default=cdr_costing.CDR_WORKERS, show_default=True)
+@click.option("--chunk-rows", type=int, default=cdr_costing.CDR_CHUNK_ROWS, show_default=True)
+def price_file(source, output, totals_path, workers, chunk_rows):
+    """Price the usage records of SOURCE (CSV or Parquet) into OUTPUT (CSV or Parquet)."""
+    table = cdr_costing.load_rates(db.session)
+    db.session.rollback()
+    click.echo(f"{table.size} rate periods of {len(table.partners)} partners loaded")
+    summary = cdr_costing.price_file(table, source, output, totals_path=totals_path, workers=workers,
+                                     chunk_rows=chunk_rows)
+    click.echo(f"{summary['records']} records ({summary['priced']} priced, total {summary['total']:.2f}) "
+               f"in {summary['seconds']}s -> {summary['output']}, {summary['totals']}")
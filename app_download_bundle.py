@@ -0,0 +1,99 @@
+import time
+
+import click
+from flask import Blueprint, render_template, current_app, url_for, redirect, flash, request
+from sqlalchemy import text
+from app import db
+import metrics
+import rate_history
+import ratecard_bundle
+from ratecard_export import file_export, EXPORT_FORMATS
+from schema import ensure_schema
+from app_download_ratecards import SQL, VOICE_SOURCE_TABLES
+from app_download_sms_ratecards import SQL_SMS
+from app_download_gprs_ratecards import SQL_GPRS
+from app_download_volte_ratecards import SQL_VOLTE
+
+bundle_bp = Blueprint('bundle', __name__, template_folder='templates')
+
+BUNDLE_FORMATS = ('xlsx', 'zip')
+
+
+def build_bundle(path, fmt='xlsx', files='xlsx', logger=None, as_of=None):
+    """
+    Read ratesheet_v2 once (or the rates in effect on `as_of`), derive the
+    voice, SMS, GPRS and VoLTE ratecards from it and write them to `path`:
+    one workbook with a sheet each (fmt='xlsx') or a zip of one file each
+    (fmt='zip', members in `files`).
+    """
+    start = time.perf_counter()
+    frames = ratecard_bundle.read_frames(db.session, as_of)
+    db.session.rollback()
+    derived = time.perf_counter()
+    if fmt == 'zip':
+        written = ratecard_bundle.write_zip(path, frames, files)
+    else:
+        written = ratecard_bundle.write_workbook(path, frames)
+    metrics.record_encode(fmt, time.perf_counter() - derived)
+    if logger:
+        logger.info(f"Ratecard bundle: {written} rows "
+                    f"({', '.join(f'{name} {len(frame)}' for name, frame in frames.items())}), "
+                    f"derived in {derived - start:.2f}s, written in {time.perf_counter() - derived:.2f}s")
+    return written
+
+
+@bundle_bp.route('/download-bundle', methods=['GET'])
+def download_bundle_page():
+    return render_template('download_bundle.html')
+
+
+@bundle_bp.route('/download-bundle/file', methods=['GET'])
+def download_bundle_file():
+    logger = current_app.logger
+    fmt = request.args.get('format', 'xlsx')
+    if fmt not in BUNDLE_FORMATS:
+        fmt = 'xlsx'
+    # ?format=zip&files=csv zips CSVs instead of one workbook per ratecard
+    files = request.args.get('files', 'xlsx')
+    if files not in EXPORT_FORMATS:
+        files = 'xlsx'
+    try:
+        as_of = rate_history.parse_as_of(request.args.get('as_of'))
+        return file_export(lambda path: build_bundle(path, fmt, files, logger, as_of), 'ratecard_bundle', fmt,
+                           cache_tables=VOICE_SOURCE_TABLES, logger=logger, files=files, as_of=as_of)
+    except Exception as e:
+        logger.exception("Failed to generate ratecard bundle")
+        flash(f"Error generating ratecard bundle: {e}", "error")
+        return redirect(url_for('bundle.download_bundle_page'))
+
+
+def _rows(rows, ordered):
+    rows = [tuple(ratecard_bundle.normalize(v) for v in row) for row in rows]
+    # the SMS/GPRS/VoLTE queries have no ORDER BY, so only compare their contents
+    return rows if ordered else sorted(rows, key=repr)
+
+
+@bundle_bp.cli.command("check")
+def check_bundle():
+    """Check that the bundle's ratecards match the per-endpoint SQL row for row."""
+    ensure_schema(db.engine)
+    frames = ratecard_bundle.read_frames(db.session)
+    failed = False
+    for name, sql, ordered in [
+        ("ratecard_national", SQL, True),
+        ("sms_ratecard", SQL_SMS, False),
+        ("gprs_ratecard", SQL_GPRS, False),
+        ("volte_ratecard", SQL_VOLTE, False),
+    ]:
+        expected = _rows(db.session.execute(text(sql)).fetchall(), ordered)
+        derived = _rows(ratecard_bundle.frame_rows(frames[name]), ordered)
+        mismatch = next((i for i, (a, b) in enumerate(zip(expected, derived)) if a != b), None)
+        if len(expected) != len(derived) or mismatch is not None:
+            failed = True
+            click.echo(f"{name}: {len(derived)} rows vs {len(expected)} from SQL, "
+                       f"first difference at row {mismatch if mismatch is not None else min(len(expected), len(derived))}")
+        else:
+            click.echo(f"{name}: {len(derived)} rows match")
+    db.session.rollback()
+    if failed:
+        raise click.ClickException("bundle differs from the per-endpoint SQL")
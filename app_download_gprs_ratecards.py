@@ -1,8 +1,6 @@
-import io
-import pandas as pd
-from flask import Blueprint, render_template, current_app, url_for, redirect, flash, send_file
-from sqlalchemy import text
-from app import db
+from flask import Blueprint, render_template, current_app, url_for, redirect, flash, request
+import rate_history
+from ratecard_export import stream_export
 
 gprs_ratecard_bp = Blueprint('gprs_ratecard', __name__, template_folder='templates')
 
@@ -11,12 +9,7 @@ select tadig_plmn_code as "Destination",
        tadig_plmn_code as "Area Code", 
        gprs_rate_mb_rate_value as "Rate",
        start_date AS "Valid From",   -- keep as DATE, no to_char
-       CASE 
-           WHEN gprs_rate_mb_charging_interval = '1 KB' THEN '1024/1024'
-           WHEN gprs_rate_mb_charging_interval = '10 KB' THEN '10240/10240'
-           WHEN gprs_rate_mb_charging_interval = '1 MB' THEN '1048576/1048576'
-           ELSE gprs_rate_mb_charging_interval
-       END AS rounding_rules
+       gprs_rate_mb_rounding_rule AS rounding_rules   -- normalized at upload
 from ratesheet_v2;
 """
 
@@ -30,25 +23,14 @@ def download_gprs_ratecard_file():
     logger = current_app.logger
     try:
         logger.info("Running GPRS ratecard SQL…")
-        result = db.session.execute(text(SQL_GPRS))
-        rows = result.fetchall()
-        cols = result.keys()
-        df = pd.DataFrame(rows, columns=cols)
-        logger.debug(f"Fetched {len(df)} rows for gprs ratecard")
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False)  # no sheet_name → defaults to "Sheet1"
-    
-        output.seek(0)
-        logger.info("GPRS Excel generated, sending to client")
-
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name='gprs_ratecard.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # ?as_of=YYYY-MM-DD uses the rates in effect on that date (rate_history)
+        as_of = rate_history.parse_as_of(request.args.get('as_of'))
+        sql, params = (rate_history.as_of_sql(SQL_GPRS), {'as_of': as_of}) if as_of else (SQL_GPRS, None)
+        # stream rows from a server-side cursor; ?format=csv skips Excel encoding
+        response = stream_export(sql, 'gprs_ratecard', fmt=request.args.get('format', 'xlsx'), params=params,
+                                 cache_tables=["ratesheet_v2"], logger=logger)
+        logger.info("GPRS export ready, streaming to client")
+        return response
 
     except Exception as e:
         logger.exception("Failed to generate gprs ratecard Excel")
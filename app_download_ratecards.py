@@ -1,156 +1,69 @@
-import io
-import pandas as pd
-from flask import Blueprint, render_template, current_app, url_for, redirect, flash, send_file
+from flask import Blueprint, render_template, current_app, url_for, redirect, flash, request, jsonify, abort, Response
 from sqlalchemy import text
 from app import db
+import jobs
+import partner_export
+import rate_history
+import voice_engine
+from ratecard_bundle import frame_rows
+from ratecard_export import stream_export, file_export, query_rows, write_xlsx, iter_csv, EXPORT_FORMATS
+from upload_hooks import on_tables_changed
+from voice_ratecard import (
+    SQL, SQL_MATERIALIZED, VOICE_COLUMNS, VOICE_RATECARD_TABLE, VOICE_SOURCE_TABLES,
+    ensure_current, rebuild_voice_ratecard,
+)
 
 ratecard_bp = Blueprint('ratecard', __name__, template_folder='templates')
 
-SQL = """ 
-SELECT *
-FROM (
-    -- 1. Local Calls
-    SELECT 
-        t.destination,
-        t.area_code,
-        a.moc_call_local_call_rate_value AS rate,
-        'CELC_IR_VOICE_TARIFF_' || a.tadig_plmn_code || '_20250701' AS tariff_name,
-        t."date"::DATE AS date,
-        CASE 
-            WHEN a.moc_call_local_call_charging_interval = '1 second' THEN '1/1'
-            WHEN a.moc_call_local_call_charging_interval = '60 seconds' THEN '60/60'
-            ELSE a.moc_call_local_call_charging_interval
-        END AS rounding_rules,
-        t.destination_type,
-        t.setup_rate,
-        t.calls_type,
-        CASE WHEN t.remarks = 'NaN' THEN NULL ELSE t.remarks END AS remarks,
-        1 AS source_order
-    FROM ratesheet_v2 a
-    CROSS JOIN "template" t
-    JOIN country_v2 b ON LEFT(a.tadig_plmn_code, 3) = b.alpha_3
-    WHERE t.destination = 'National'
-
-    UNION ALL
-
-    -- 2. Call Back Home
-    SELECT 
-        t.destination,
-        t.area_code,
-        a.moc_call_call_back_home_rate_value AS rate,
-        'CELC_IR_VOICE_TARIFF_' || a.tadig_plmn_code || '_20250701' AS tariff_name,
-        t."date"::DATE AS date,
-        CASE 
-            WHEN a.moc_call_call_back_home_charging_interval = '1 second' THEN '1/1'
-            WHEN a.moc_call_call_back_home_charging_interval = '60 seconds' THEN '60/60'
-            ELSE a.moc_call_call_back_home_charging_interval
-        END AS rounding_rules,
-        t.destination_type,
-        t.setup_rate,
-        t.calls_type,
-        CASE WHEN t.remarks = 'NaN' THEN NULL ELSE t.remarks END AS remarks,
-        2 AS source_order
-    FROM ratesheet_v2 a
-    CROSS JOIN "template" t
-    JOIN country_v2 b ON LEFT(a.tadig_plmn_code, 3) = b.alpha_3
-    WHERE t.destination = b.custom_name
-
-    UNION ALL
-
-    -- 3. ROW
-    SELECT 
-        t.destination,
-        t.area_code,
-        a.moc_call_rest_of_the_world_rate_value AS rate,
-        'CELC_IR_VOICE_TARIFF_' || a.tadig_plmn_code || '_20250701' AS tariff_name,
-        t."date"::DATE AS date,
-        CASE 
-            WHEN a.moc_call_rest_of_the_world_charging_interval = '1 second' THEN '1/1'
-            WHEN a.moc_call_rest_of_the_world_charging_interval = '60 seconds' THEN '60/60'
-            ELSE a.moc_call_rest_of_the_world_charging_interval
-        END AS rounding_rules,
-        t.destination_type,
-        t.setup_rate,
-        t.calls_type,
-        CASE WHEN t.remarks = 'NaN' THEN NULL ELSE t.remarks END AS remarks,
-        3 AS source_order
-    FROM ratesheet_v2 a
-    CROSS JOIN "template" t
-    JOIN country_v2 b ON LEFT(a.tadig_plmn_code, 3) = b.alpha_3
-    WHERE t.destination <> b.custom_name
-      AND t.calls_type = 'ROW'
-
-    UNION ALL
-
-    -- 4. MTC CALLS
-    SELECT 
-        t.destination,
-        t.area_code,
-        a.mtc_call_rate_value AS rate,
-        'CELC_IR_VOICE_TARIFF_' || a.tadig_plmn_code || '_20250701' AS tariff_name,
-        t."date"::DATE AS date,
-        CASE 
-            WHEN a.mtc_call_charging_interval = '1 second' THEN '1/1'
-            WHEN a.mtc_call_charging_interval = '60 seconds' THEN '60/60'
-            ELSE a.mtc_call_charging_interval
-        END AS rounding_rules,
-        t.destination_type,
-        t.setup_rate,
-        t.calls_type,
-        CASE WHEN t.remarks = 'NaN' THEN NULL ELSE t.remarks END AS remarks,
-        4 AS source_order
-    FROM ratesheet_v2 a
-    CROSS JOIN "template" t
-    JOIN country_v2 b ON LEFT(a.tadig_plmn_code, 3) = b.alpha_3
-    WHERE t.calls_type = 'MTC CALLS'
-
-    UNION ALL
-
-    -- 5. Special/Miscellaneous Calls from Template Table
-    SELECT 
-        t.destination,
-        t.area_code,
-        t.rate AS rate,
-        'CELC_IR_VOICE_TARIFF_' || a.tadig_plmn_code || '_20250701' AS tariff_name,
-        t."date"::DATE AS date,
-        CASE 
-            WHEN t.rounding_rules = '1 second' THEN '1/1'
-            WHEN t.rounding_rules = '60 seconds' THEN '60/60'
-            ELSE t.rounding_rules
-        END AS rounding_rules,
-        t.destination_type,
-        t.setup_rate,
-        t.calls_type,
-        CASE WHEN t.remarks = 'NaN' THEN NULL ELSE t.remarks END AS remarks,
-        5 AS source_order
-    FROM ratesheet_v2 a
-    CROSS JOIN "template" t
-    JOIN country_v2 b ON LEFT(a.tadig_plmn_code, 3) = b.alpha_3
-    WHERE t.calls_type IN (
-        'Customer Care',
-        'directory calls',
-        'emergency calls',
-        'Satellite',
-        'Local Short Code',
-        'Premium',
-        'Toll Free'
-    )
-) final_output
-
-ORDER BY 
-    tariff_name,
-    source_order,
-    -- For ROW block (source_order 3)
-    CASE WHEN source_order = 3 THEN destination ELSE NULL END,
-    -- For Local/Call-Back-Home (1 and 2)
-    CASE WHEN source_order IN (1, 2) THEN calls_type ELSE NULL END,
-    -- For MTC CALLS (4)
-    CASE WHEN source_order = 4 THEN destination ELSE NULL END,
-    -- For Misc block (5)
-    CASE WHEN source_order = 5 THEN calls_type ELSE NULL END,
-    CASE WHEN source_order = 5 THEN destination ELSE NULL END;
+PARTNER_SQL = partner_export.batch_sql(VOICE_COLUMNS, VOICE_RATECARD_TABLE)
+
+PARTNER_TARIFFS_SQL = f"""
+SELECT DISTINCT tariff_name FROM {VOICE_RATECARD_TABLE} ORDER BY tariff_name;
 """
 
+@on_tables_changed
+def refresh_voice_ratecard(tables):
+    if not tables & VOICE_SOURCE_TABLES:
+        return
+    logger = current_app.logger
+    try:
+        written = rebuild_voice_ratecard(db.session)
+    except Exception:
+        db.session.rollback()
+        raise
+    if written is not None:
+        logger.info(f"voice_ratecard rebuilt after upload of {sorted(tables)}: {written} rows")
+
+def run_voice_ratecard_job(job, fmt='xlsx'):
+    """Background job (see jobs.JOB_KINDS): write the voice ratecard to a result file."""
+    job.update(phase="checking")
+    ensure_current(db.session)
+    job.update(phase="writing")
+    columns, rows = query_rows(SQL_MATERIALIZED)
+    path = jobs.job_file_path(f'.{fmt}')
+    if fmt == 'csv':
+        with open(path, 'wb') as fh:
+            for chunk in iter_csv(columns, job.track(rows)):
+                fh.write(chunk)
+    else:
+        write_xlsx(path, columns, job.track(rows), sheet_name='Ratecard')
+    return {"path": path, "download_name": f'ratecard_national.{fmt}'}
+
+
+def write_engine_ratecard(path, fmt, logger=None, as_of=None):
+    """Generate the voice ratecard with voice_engine and write it to `path`."""
+    frame = voice_engine.voice_ratecard(db.session, as_of)
+    db.session.rollback()
+    if fmt == 'csv':
+        with open(path, 'wb') as fh:
+            for chunk in iter_csv(list(frame.columns), frame_rows(frame)):
+                fh.write(chunk)
+    else:
+        write_xlsx(path, list(frame.columns), frame_rows(frame), sheet_name='Ratecard')
+    if logger:
+        logger.info(f"voice_engine ratecard: {len(frame)} rows")
+
+
 @ratecard_bp.route('/download-ratecard', methods=['GET'])
 def download_ratecard_page():
     return render_template('download_ratecard.html')
@@ -158,30 +71,115 @@ def download_ratecard_page():
 @ratecard_bp.route('/download-ratecard/file', methods=['GET'])
 def download_ratecard_file():
     logger = current_app.logger
+    fmt = request.args.get('format', 'xlsx')
+    # ?async=1 generates the file in a background job; poll the returned status_url
+    if request.args.get("async"):
+        job_id = jobs.enqueue("voice_ratecard", fmt=fmt if fmt in EXPORT_FORMATS else 'xlsx')
+        return jsonify(job_id=job_id, status_url=url_for('jobs.job_status', job_id=job_id)), 202
     try:
-        logger.info("Running ratecard SQL…")
-        # execute via session, not engine
-        result = db.session.execute(text(SQL))
-        rows = result.fetchall()
-        cols = result.keys()
-        df = pd.DataFrame(rows, columns=cols)
-        logger.debug(f"Fetched {len(df)} rows for ratecard")
-
-        # Write Excel to memory
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Ratecard')
-        output.seek(0)
-        logger.info("Excel generated, sending to client")
-
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name='ratecard_national.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # ?as_of=YYYY-MM-DD builds the card from the rates in effect on that date
+        as_of = rate_history.parse_as_of(request.args.get("as_of"))
+        # ?engine=numpy generates the rows in-process instead of in SQL (for comparison)
+        if request.args.get("engine") == "numpy":
+            fmt = fmt if fmt in EXPORT_FORMATS else 'xlsx'
+            return file_export(lambda path: write_engine_ratecard(path, fmt, logger, as_of), 'ratecard_national',
+                               fmt, cache_tables=VOICE_SOURCE_TABLES, logger=logger, engine="numpy", as_of=as_of)
+        params = None
+        if as_of:
+            logger.info(f"Running ratecard SQL as of {as_of}…")
+            sql, cache_tables, params = rate_history.as_of_sql(SQL), VOICE_SOURCE_TABLES, {"as_of": as_of}
+        # ?live=1 bypasses the precomputed table and runs the full query
+        elif request.args.get("live"):
+            logger.info("Running ratecard SQL…")
+            sql, cache_tables = SQL, VOICE_SOURCE_TABLES
+        else:
+            _ensure_voice_ratecard(logger)
+            logger.info("Reading precomputed voice_ratecard…")
+            sql, cache_tables = SQL_MATERIALIZED, [VOICE_RATECARD_TABLE]
+
+        # stream rows from a server-side cursor; ?format=csv skips Excel encoding
+        response = stream_export(sql, 'ratecard_national', fmt=fmt, params=params,
+                                 sheet_name='Ratecard', cache_tables=cache_tables, logger=logger)
+        logger.info("Ratecard export ready, streaming to client")
+        return response
 
     except Exception as e:
         logger.exception("Failed to generate ratecard Excel")
         flash(f"Error generating ratecard: {e}", "error")
         return redirect(url_for('ratecard.download_ratecard_page'))
+
+
+def _ensure_voice_ratecard(logger):
+    # a rebuild after an upload can fail or lose a race; never serve rows built from other versions
+    written = ensure_current(db.session)
+    if written is not None:
+        logger.info(f"voice_ratecard was stale, rebuilt: {written} rows")
+
+
+def _requested_tadigs():
+    """TADIG codes from ?tadig=AAA01,BBB02 (repeatable), or None for all partners."""
+    tadigs = [t.strip() for value in request.args.getlist('tadig') for t in value.split(',') if t.strip()]
+    bad = [t for t in tadigs if not partner_export.TADIG_RE.match(t)]
+    if bad:
+        abort(400, f"Invalid TADIG codes: {', '.join(bad)}")
+    return sorted(set(tadigs)) or None
+
+
+@ratecard_bp.route('/download-ratecard/partner/<tadig>', methods=['GET'])
+def download_partner_ratecard(tadig):
+    """One partner's voice ratecard, read from voice_ratecard by index without building the others."""
+    logger = current_app.logger
+    if not partner_export.TADIG_RE.match(tadig):
+        abort(400, "Invalid TADIG code")
+    _ensure_voice_ratecard(logger)
+    params = {"patterns": [partner_export.tariff_pattern(tadig)]}
+    found = db.session.execute(text(
+        f"SELECT 1 FROM {VOICE_RATECARD_TABLE} WHERE tariff_name LIKE ANY(:patterns) LIMIT 1;"
+    ), params).first()
+    if found is None:
+        abort(404, f"No voice ratecard for {tadig}")
+    return stream_export(PARTNER_SQL, f'ratecard_{tadig}', fmt=request.args.get('format', 'xlsx'), params=params,
+                         sheet_name='Ratecard', cache_tables=[VOICE_RATECARD_TABLE], logger=logger)
+
+
+@ratecard_bp.route('/download-ratecard/partners', methods=['GET'])
+def download_partner_ratecards():
+    """
+    Zip of one voice ratecard per partner (?tadig=... for a subset), built
+    in a process pool and streamed as each batch finishes.
+    """
+    logger = current_app.logger
+    fmt = request.args.get('format', 'xlsx')
+    if fmt not in EXPORT_FORMATS:
+        fmt = 'xlsx'
+    requested = _requested_tadigs()
+    _ensure_voice_ratecard(logger)
+
+    # Hold one REPEATABLE READ transaction open while the zip streams and let
+    # every worker import its snapshot, so a rebuild mid-export can't mix versions.
+    conn = db.engine.connect()
+    snapshot = None
+    try:
+        if db.engine.dialect.name == "postgresql":
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+            conn.begin()
+            snapshot = conn.execute(text("SELECT pg_export_snapshot();")).scalar()
+        available = list(dict.fromkeys(
+            partner_export.tadig_of(name) for (name,) in conn.execute(text(PARTNER_TARIFFS_SQL))
+        ))
+    except Exception:
+        conn.close()
+        raise
+    tadigs = [t for t in available if requested is None or t in requested]
+    if not tadigs:
+        conn.close()
+        abort(404, "No voice ratecards for the requested partners")
+    logger.info(f"Exporting {len(tadigs)} partner ratecards as {fmt}")
+    response = Response(
+        partner_export.iter_partner_zip(tadigs, fmt, snapshot=snapshot, on_close=conn.close),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="partner_ratecards.zip"'},
+    )
+    # also release the snapshot when the body is never iterated
+    response.call_on_close(conn.close)
+    return response
@@ -1,8 +1,6 @@
-import io
-import pandas as pd
-from flask import Blueprint, render_template, current_app, url_for, redirect, flash, send_file
-from sqlalchemy import text
-from app import db
+from flask import Blueprint, render_template, current_app, url_for, redirect, flash, request
+import rate_history
+from ratecard_export import stream_export
 
 sms_ratecard_bp = Blueprint('sms_ratecard', __name__, template_folder='templates')
 
@@ -29,29 +27,14 @@ def download_sms_ratecard_file():
     logger = current_app.logger
     try:
         logger.info("Running SMS ratecard SQL…")
-        result = db.session.execute(text(SQL_SMS))
-        rows = result.fetchall()
-        cols = result.keys()
-        df = pd.DataFrame(rows, columns=cols)
-        logger.debug(f"Fetched {len(df)} rows for sms ratecard")
-
-        # If the start_date column is a date object, you may want to format it as dd-MMM-YYYY
-        # Uncomment the following lines if needed:
-        # if 'Valid From (dd-mmm-yyyy)' in df.columns:
-        #     df['Valid From (dd-mmm-yyyy)'] = pd.to_datetime(df['Valid From (dd-mmm-yyyy)']).dt.strftime('%d-%b-%Y')
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False)  # no sheet_name → defaults to "Sheet1"    
-        output.seek(0)
-        logger.info("SMS Excel generated, sending to client")
-
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name='sms_ratecard.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # ?as_of=YYYY-MM-DD uses the rates in effect on that date (rate_history)
+        as_of = rate_history.parse_as_of(request.args.get('as_of'))
+        sql, params = (rate_history.as_of_sql(SQL_SMS), {'as_of': as_of}) if as_of else (SQL_SMS, None)
+        # stream rows from a server-side cursor; ?format=csv skips Excel encoding
+        response = stream_export(sql, 'sms_ratecard', fmt=request.args.get('format', 'xlsx'), params=params,
+                                 cache_tables=["ratesheet_v2"], logger=logger)
+        logger.info("SMS export ready, streaming to client")
+        return response
 
     except Exception as e:
         logger.exception("Failed to generate sms ratecard Excel")
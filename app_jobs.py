@@ -0,0 +1,38 @@
+import os
+from flask import Blueprint, jsonify, send_file, url_for, abort
+import jobs
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Polling endpoint: status, phase, rows processed and result of a background job."""
+    job = jobs.get_job(job_id)
+    if job is None:
+        abort(404)
+    result = job["result"] or {}
+    payload = {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "phase": job["phase"],
+        "rows_processed": job["rows_processed"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "result": {k: v for k, v in result.items() if k != "path"},
+    }
+    if job["status"] == "done" and "path" in result:
+        payload["file_url"] = url_for('jobs.job_file', job_id=job_id)
+    return jsonify(payload)
+
+
+@jobs_bp.route('/jobs/<job_id>/file', methods=['GET'])
+def job_file(job_id):
+    """Download the file produced by a finished job."""
+    job = jobs.get_job(job_id)
+    result = (job or {}).get("result") or {}
+    if job is None or job["status"] != "done" or not os.path.exists(result.get("path", "")):
+        abort(404)
+    return send_file(result["path"], as_attachment=True, download_name=result.get("download_name"))
@@ -0,0 +1,148 @@
+import os
+import time
+from datetime import date
+
+import click
+from flask import Blueprint, jsonify, request
+from sqlalchemy import text
+from app import db
+import rate_history
+import rate_index
+from partner_export import tadig_of
+from ratecard_bundle import normalize
+from schema import ensure_schema
+from app_download_ratecards import SQL
+from app_download_sms_ratecards import SQL_SMS
+from app_download_gprs_ratecards import SQL_GPRS
+from app_download_volte_ratecards import SQL_VOLTE
+
+rate_bp = Blueprint('rate', __name__)
+
+# most lookups one POST /rate/batch may carry
+RATE_BATCH_MAX = int(os.getenv("RATE_BATCH_MAX", "10000"))
+LOOKUP_FIELDS = ("tadig_plmn_code", "service", "destination", "calls_type", "area_code", "as_of")
+
+
+def lookup(index, args):
+    """One lookup from query args or a batch item; as_of defaults to today."""
+    # batch items are JSON: a number here would raise TypeError further down
+    wrong = [field for field in LOOKUP_FIELDS if args.get(field) is not None and not isinstance(args[field], str)]
+    if wrong:
+        raise ValueError(f"expected strings for {', '.join(wrong)}")
+    tadig = args.get("tadig_plmn_code")
+    if not tadig:
+        raise ValueError("tadig_plmn_code is required")
+    as_of = rate_history.parse_as_of(args.get("as_of")) or date.today()
+    return index.lookup(tadig, args.get("service"), as_of, destination=args.get("destination"),
+                        calls_type=args.get("calls_type"), area_code=args.get("area_code"))
+
+
+@rate_bp.route('/rate', methods=['GET'])
+def rate():
+    """
+    Price one event from memory:
+    ?tadig_plmn_code=&service=voice|sms|gprs|volte[&destination=][&calls_type=][&area_code=][&as_of=YYYY-MM-DD]
+    """
+    try:
+        return jsonify(lookup(rate_index.get(db.session), request.args))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except LookupError as e:
+        return jsonify(error=str(e)), 404
+
+
+@rate_bp.route('/rate/batch', methods=['POST'])
+def rate_batch():
+    """
+    Price many events against one index: {"lookups": [{<the /rate fields>}, ...]}.
+    Results come back in order; a failed lookup is {"error": ...} in its place.
+    """
+    payload = request.get_json(silent=True) or {}
+    lookups = payload.get("lookups") if isinstance(payload, dict) else None
+    if not isinstance(lookups, list):
+        return jsonify(error='expected a JSON body {"lookups": [...]}'), 400
+    if len(lookups) > RATE_BATCH_MAX:
+        return jsonify(error=f"at most {RATE_BATCH_MAX} lookups per batch, got {len(lookups)}"), 400
+    index = rate_index.get(db.session)
+    results = []
+    for item in lookups:
+        try:
+            if not isinstance(item, dict):
+                raise ValueError(f"each lookup is an object with {', '.join(LOOKUP_FIELDS)}")
+            results.append(lookup(index, item))
+        except (ValueError, LookupError) as e:
+            results.append({"error": str(e)})
+    return jsonify(results=results)
+
+
+def _check_rows(sql, as_of):
+    return db.session.execute(text(rate_history.as_of_sql(sql)), {"as_of": as_of}).mappings().fetchall()
+
+
+@rate_bp.cli.command("check")
+@click.option("--as-of", "as_of", default=None, help="YYYY-MM-DD, default today")
+def check_rates(as_of):
+    """
+    Check the rate index against the ratecard SQL as of a date: the first
+    voice row per partner, destination and calls_type, and every SMS, GPRS
+    and VoLTE row. Every other partner of the index must have no voice rate
+    for any template destination and calls_type.
+    """
+    as_of = rate_history.parse_as_of(as_of) or date.today()
+    ensure_schema(db.engine)
+    index = rate_index.get(db.session)
+    # (lookup args, expected result fields)
+    cases, seen = [], set()
+    for row in _check_rows(SQL, as_of):
+        key = (row["tariff_name"], row["destination"], row["calls_type"])
+        if key in seen or row["destination"] is None or row["calls_type"] is None:
+            continue
+        seen.add(key)
+        cases.append((
+            ("voice", tadig_of(row["tariff_name"]), row["destination"], row["calls_type"]),
+            {"tariff_name": row["tariff_name"], "rate": row["rate"], "setup_rate": row["setup_rate"],
+             "rounding_rule": row["rounding_rules"], "source_order": row["source_order"],
+             "area_code": row["area_code"]},
+        ))
+    for row in _check_rows(SQL_SMS, as_of):
+        if row["Destination"] and row["Destination"].endswith("-NAT"):
+            cases.append((("sms", row["Destination"][:-4], None, None),
+                          {"rate": row["Rate"], "setup_rate": row["Setup Rate"]}))
+    for service, sql in (("gprs", SQL_GPRS), ("volte", SQL_VOLTE)):
+        for row in _check_rows(sql, as_of):
+            if row["Destination"]:
+                cases.append(((service, row["Destination"], None, None),
+                              {"rate": row["Rate"], "rounding_rule": row["rounding_rules"]}))
+    db.session.rollback()
+    # partners in effect without voice rows in the SQL (expected None: no voice rate)
+    voice_partners = {tadig for (service, tadig, _, _), _ in cases if service == "voice"}
+    for tadig in index.periods:
+        if tadig not in voice_partners and index.period(tadig, as_of) is not None:
+            cases.extend((("voice", tadig, destination, calls_type), None)
+                         for destination, calls_type in index.voice.by_key
+                         if destination is not None or calls_type is not None)
+
+    mismatches = []
+    start = time.perf_counter()
+    for (service, tadig, destination, calls_type), expected in cases:
+        try:
+            result = index.lookup(tadig, service, as_of, destination=destination, calls_type=calls_type)
+        except LookupError as e:
+            if expected is not None:
+                mismatches.append(f"{service} {tadig} {destination}/{calls_type}: {e}")
+            continue
+        if expected is None:
+            mismatches.append(f"{service} {tadig} {destination}/{calls_type}: "
+                              f"the index has a rate, the SQL has no ratecard for {tadig}")
+            continue
+        differing = {name: (normalize(value), result[name]) for name, value in expected.items()
+                     if normalize(value) != normalize(result[name])}
+        if differing:
+            mismatches.append(f"{service} {tadig} {destination}/{calls_type}: {differing} (SQL, index)")
+    elapsed = time.perf_counter() - start
+    for mismatch in mismatches[:20]:
+        click.echo(mismatch)
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} of {len(cases)} lookups differ from the SQL as of {as_of}")
+    click.echo(f"rate index matches SQL as of {as_of}: {len(cases)} lookups "
+               f"in {elapsed * 1000:.1f}ms ({elapsed / max(len(cases), 1) * 1e6:.1f}us each)")
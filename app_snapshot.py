@@ -0,0 +1,50 @@
+import click
+from flask import Blueprint, current_app
+from app import db
+import snapshots
+from upload_hooks import commit_changes, on_tables_changed
+
+snapshot_bp = Blueprint('snapshot', __name__)
+
+
+@on_tables_changed
+def write_snapshots(tables):
+    # written by snapshots' writer thread, off the request that committed
+    snapshots.schedule(db.engine, tables)
+
+
+@snapshot_bp.cli.command("write")
+@click.argument("tables", nargs=-1)
+def write_tables(tables):
+    """Snapshot TABLES (default: all of snapshots.SNAPSHOT_TABLES) at their current versions."""
+    for table in tables or snapshots.SNAPSHOT_TABLES:
+        if table not in snapshots.SNAPSHOT_TABLES:
+            raise click.BadParameter(f"one of {', '.join(snapshots.SNAPSHOT_TABLES)}", param_hint="TABLES")
+        version = snapshots.write(db.session, table)
+        click.echo(f"{table}: " + (f"wrote v{version}" if version is not None else "up to date"))
+    db.session.rollback()
+
+
+@snapshot_bp.cli.command("list")
+def list_snapshots():
+    """Snapshot versions on disk per table."""
+    for table, versions in snapshots.status()["on_disk"].items():
+        click.echo(f"{table}: {', '.join(f'v{version}' for version in versions) or 'none'}")
+
+
+@snapshot_bp.cli.command("restore")
+@click.argument("table", type=click.Choice(snapshots.SNAPSHOT_TABLES))
+@click.option("--version", type=int, default=None, help="snapshot version, default the newest on disk")
+def restore_table(table, version):
+    """Replace TABLE with a snapshot, loaded with COPY and committed as an upload."""
+    try:
+        version, rows = snapshots.restore(db.session, table, version)
+        commit_changes(db.session, table)
+    except LookupError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    except Exception:
+        db.session.rollback()
+        raise
+    current_app.logger.info(f"Restored {table} from snapshot v{version}: {rows} rows")
+    click.echo(f"{table}: restored {rows} rows from snapshot v{version}")
@@ -1,7 +1,12 @@
 import pandas as pd
 from flask import Blueprint, request, render_template, flash, redirect, url_for, current_app
-from sqlalchemy import text
 from app import db  # import your SQLAlchemy db instance
+from bulk_load import bulk_insert
+from log_config import UploadLog
+from sheet_reader import iter_sheet_chunks
+from staging_swap import create_staging, swap_in
+from upload_hooks import commit_changes
+from upsert_load import NATURAL_KEYS, check_unique_keys, diff_load, with_row_hash
 
 # Create a Blueprint
 country_bp = Blueprint(
@@ -10,6 +15,27 @@ country_bp = Blueprint(
     template_folder='templates'
 )
 
+# (column in country_v2, header in the sheet, clean_cell options)
+COUNTRY_COLUMNS = [
+    # max_len=100 for name, custom_name
+    ("name",                     "name",                     dict(max_len=100)),
+    ("alpha_2",                  "alpha-2",                  dict(max_len=2, upper=True)),
+    ("alpha_3",                  "alpha-3",                  dict(max_len=3, upper=True)),
+    ("country_code",             "country-code",             dict(max_len=10)),
+    ("iso_3166_2",               "iso_3166-2",               dict(max_len=20)),
+    ("region",                   "region",                   dict(max_len=50)),
+    ("sub_region",               "sub-region",               dict(max_len=50)),
+    ("intermediate_region",      "intermediate-region",      dict(max_len=50)),
+    ("region_code",              "region-code",              dict(max_len=10)),
+    ("sub_region_code",          "sub-region-code",          dict(max_len=10)),
+    ("intermediate_region_code", "intermediate-region-code", dict(max_len=10)),
+    ("custom_name",              "custom-name",              dict(max_len=100)),
+]
+
+COUNTRY_FIELDS = [col for col, _, _ in COUNTRY_COLUMNS]
+# natural key for diff-mode uploads
+COUNTRY_KEY = NATURAL_KEYS["country_v2"]
+
 # in app_upload_country.py, near the top:
 def clean_cell(val, max_len=None, upper=False):
     """
@@ -30,6 +56,15 @@ def clean_cell(val, max_len=None, upper=False):
         s = s[:max_len]
     return s
 
+def country_chunks(chunks):
+    """Clean each sheet chunk into a list of row tuples ordered like COUNTRY_FIELDS."""
+    for chunk in chunks:
+        cleaned = [
+            [clean_cell(v, **opts) for v in chunk[header].tolist()]
+            for _, header, opts in COUNTRY_COLUMNS
+        ]
+        yield list(zip(*cleaned))
+
 @country_bp.route('/upload-country', methods=['GET','POST'])
 def upload_country():
     logger = current_app.logger
@@ -41,51 +76,38 @@ def upload_country():
             logger.error("upload-country: no file received")
             return redirect(request.url)
 
+        # mode=diff applies only the changed countries instead of reloading the table
+        mode = "diff" if request.values.get("mode") == "diff" else "full"
         try:
-            df = pd.read_excel(file)
-            logger.info(f"Country sheet shape: {df.shape}")
-
-            # Truncate
-            db.session.execute(text("TRUNCATE TABLE country_v2 RESTART IDENTITY;"))
-            db.session.commit()
-            logger.debug("country_v2 truncated")
-
-            for i, row in df.iterrows():
-                params = {
-                    # max_len=100 for name, custom_name
-                    "name":                    clean_cell(row["name"], max_len=100),
-                    "alpha_2":                 clean_cell(row["alpha-2"], max_len=2, upper=True),
-                    "alpha_3":                 clean_cell(row["alpha-3"], max_len=3, upper=True),
-                    "country_code":            clean_cell(row["country-code"], max_len=10),
-                    "iso_3166_2":              clean_cell(row["iso_3166-2"], max_len=20),
-                    "region":                  clean_cell(row["region"], max_len=50),
-                    "sub_region":              clean_cell(row["sub-region"], max_len=50),
-                    "intermediate_region":     clean_cell(row["intermediate-region"], max_len=50),
-                    "region_code":             clean_cell(row["region-code"], max_len=10),
-                    "sub_region_code":         clean_cell(row["sub-region-code"], max_len=10),
-                    "intermediate_region_code":clean_cell(row["intermediate-region-code"], max_len=10),
-                    "custom_name":             clean_cell(row["custom-name"], max_len=100),
-                }
-
-                db.session.execute(text("""
-                    INSERT INTO country_v2 (
-                      name, alpha_2, alpha_3, country_code, iso_3166_2,
-                      region, sub_region, intermediate_region,
-                      region_code, sub_region_code, intermediate_region_code,
-                      custom_name
-                    ) VALUES (
-                      :name, :alpha_2, :alpha_3, :country_code, :iso_3166_2,
-                      :region, :sub_region, :intermediate_region,
-                      :region_code, :sub_region_code, :intermediate_region_code,
-                      :custom_name
-                    )
-                """), params)
-
-                logger.debug(f"Inserted row {i}: {params['name']}")
+            upload_log = UploadLog(logger, "country_v2", mode=mode, file=file.filename)
+            if mode == "diff":
+                with upload_log.phase("diff"):
+                    summary = diff_load(db.session, "country_v2", COUNTRY_FIELDS, COUNTRY_KEY,
+                                        country_chunks(iter_sheet_chunks(file)))
+                rows = summary["inserted"] + summary["updated"] + summary["unchanged"]
+            else:
+                # load into a staging copy and swap it in, so readers never see an empty table
+                staging = create_staging(db.session, "country_v2")
+                inserted = 0
+                with upload_log.phase("load"):
+                    for chunk_rows in country_chunks(iter_sheet_chunks(file)):
+                        inserted += bulk_insert(db.session, staging, COUNTRY_FIELDS + ["row_hash"],
+                                                with_row_hash(chunk_rows))
+                        logger.debug("Inserted %d country rows so far", inserted)
+                with upload_log.phase("swap"):
+                    check_unique_keys(db.session, "country_v2", staging, COUNTRY_KEY)
+                    swap_in(db.session, "country_v2")
+                summary = {"inserted": inserted}
+                rows = inserted
 
-            db.session.commit()
-            flash("Country data loaded successfully", "success")
-            logger.info("All country rows committed")
+            with upload_log.phase("commit"):
+                if mode == "full" or any(summary.values()):
+                    commit_changes(db.session, "country_v2")
+                else:
+                    db.session.commit()
+            upload_log.finish(rows=rows, **summary)
+            flash("Country data loaded successfully (" + ", ".join(f"{n} {k}" for k, n in summary.items()) + ")",
+                  "success")
             return redirect(url_for('country.upload_country'))
 
         except Exception as e:
@@ -1,7 +1,11 @@
-import pandas as pd
 from flask import Blueprint, render_template, request, flash, redirect, url_for
-from sqlalchemy import text
 from app import db, logger  # import your app’s db & logger
+from bulk_load import bulk_insert
+from charging_interval import SECONDS, rule
+from log_config import UploadLog
+from sheet_reader import iter_sheet_chunks
+from staging_swap import create_staging, swap_in
+from upload_hooks import commit_changes
 
 bp = Blueprint('upload_template', __name__, template_folder='templates')
 
@@ -21,6 +25,35 @@ bp = Blueprint('upload_template', __name__, template_folder='templates')
 #   Remarks TEXT
 # );
 
+# (column in template, header in the sheet)
+TEMPLATE_COLUMNS = [
+    ("destination",      "Destination"),
+    ("area_code",        "Area Code"),
+    ("rate",             "Rate"),
+    ("tariff_name",      "TARIFF_NAME"),
+    ("date",             "Date"),
+    ("rounding_rules",   "Rounding Rules"),
+    ("destination_type", "Destination Type"),
+    ("setup_rate",       "Setup Rate"),
+    ("calls_type",       "calls based on number types"),
+    ("remarks",          "remarks"),
+]
+
+
+def template_rows(chunk):
+    """Row tuples (NaN → None) for one sheet chunk, ordered like TEMPLATE_COLUMNS."""
+    cols = []
+    for _, header in TEMPLATE_COLUMNS:
+        if header not in chunk.columns:
+            cols.append([None] * len(chunk))
+            continue
+        values = chunk[header].astype(object)
+        values = values.where(values.notna(), None)
+        if header == "Rounding Rules":
+            # stored normalized ("60 seconds" -> "60/60"), so ratecards read it as is
+            values = values.map(lambda value: rule(value, SECONDS))
+        cols.append(values.tolist())
+    return zip(*cols)
 
 
 @bp.route('/upload-template', methods=['GET','POST'])
@@ -33,38 +66,22 @@ def upload_template():
             logger.error("upload-template: no file provided")
             return redirect(request.url)
         try:
-            df = pd.read_excel(file)
-            logger.info(f"Template upload: read Excel {df.shape}")
-            
-            # empty out existing data
-            db.session.execute(text("TRUNCATE TABLE template RESTART IDENTITY;"))
-            db.session.commit()
-            logger.debug("Template table truncated")
+            upload_log = UploadLog(logger, "template", mode="full", file=file.filename)
+            # load into a staging copy; the live table keeps serving reads until the swap
+            staging = create_staging(db.session, "template")
 
-            # insert each row
-            for i,row in df.iterrows():
-                db.session.execute(text("""
-                  INSERT INTO template (
-                    Destination, Area_Code, Rate, TARIFF_NAME, Date,
-                    Rounding_Rules, Destination_Type, Setup_Rate, Calls_Type, Remarks
-                  ) VALUES (
-                    :Destination, :Area_Code, :Rate, :TARIFF_NAME, :Date,
-                    :Rounding_Rules, :Destination_Type, :Setup_Rate, :Calls_Type, :Remarks
-                  )
-                """), {
-                  "Destination":    row.get("Destination"),
-                  "Area_Code":      row.get("Area Code"),
-                  "Rate":           row.get("Rate"),
-                  "TARIFF_NAME":    row.get("TARIFF_NAME"),
-                  "Date":           row.get("Date"),
-                  "Rounding_Rules": row.get("Rounding Rules"),
-                  "Destination_Type": row.get("Destination Type"),
-                  "Setup_Rate":     row.get("Setup Rate"),
-                  "Calls_Type":     row.get("calls based on number types"),
-                  "Remarks":        row.get("remarks"),
-                })
-                logger.debug(f"Inserted template row {i}")
-            db.session.commit()
+            # stream the sheet in chunks and bulk-insert each one
+            columns = [col for col, _ in TEMPLATE_COLUMNS]
+            inserted = 0
+            with upload_log.phase("load"):
+                for chunk in iter_sheet_chunks(file):
+                    inserted += bulk_insert(db.session, staging, columns, template_rows(chunk))
+                    logger.debug("Inserted %d template rows so far", inserted)
+            with upload_log.phase("swap"):
+                swap_in(db.session, "template")
+            with upload_log.phase("commit"):
+                commit_changes(db.session, "template")
+            upload_log.finish(rows=inserted, inserted=inserted)
             flash("Template uploaded successfully", "success")
             #logger.info("All template rows committed")
             #return redirect(url_for('upload_template'))
@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ratesheet_schema import COLUMN_MAPPING, ERROR_COLUMNS, column_rows, convert_frame
+from sheet_reader import iter_sheet_chunks, sheet_names
+
+# Ratesheet uploads of several files: workbooks, CSVs and zips of them.
+# Every sheet of every file is parsed and converted (convert_frame) in a
+# process pool, since openpyxl parsing is CPU-bound and holds the GIL. The
+# workers write the converted rows to files in the upload's work directory
+# instead of sending them back through the pool; the caller streams them from
+# there, in upload order, as one upload. A file or sheet that cannot be read,
+# or whose worker fails, is reported and left out instead of failing the batch.
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", min(4, os.cpu_count() or 1)))
+SHEET_EXTENSIONS = (".xlsx", ".xlsm", ".csv", ".gz")
+
+
+def _is_archive(path, filename):
+    # workbooks are zips too; only .zip uploads are unpacked
+    return filename.lower().endswith(".zip") and zipfile.is_zipfile(path)
+
+
+def expand_uploads(files, workdir):
+    """
+    The sheet files of an upload: `files` are (path, filename) pairs; zips
+    are unpacked into `workdir` and stand for their workbooks and CSVs,
+    named "<zip>/<member>". Returns ([(path, name)], [report entries of
+    files that could not be used]).
+    """
+    sources, failed = [], []
+    for path, filename in files:
+        filename = filename or os.path.basename(path)
+        if not _is_archive(path, filename):
+            sources.append((path, filename))
+            continue
+        try:
+            with zipfile.ZipFile(path) as archive:
+                for i, member in enumerate(archive.infolist()):
+                    base = os.path.basename(member.filename)
+                    if member.is_dir() or not base or base.startswith(".") or "__MACOSX/" in member.filename:
+                        continue
+                    name = f"{filename}/{member.filename}"
+                    if not base.lower().endswith(SHEET_EXTENSIONS):
+                        failed.append({"file": name, "sheet": None, "error": "not a workbook or CSV"})
+                        continue
+                    # only the base name is used on disk, so member paths can't escape workdir
+                    target = os.path.join(workdir, f"{len(sources)}_{i}_{base}")
+                    with archive.open(member) as src, open(target, "wb") as dst:
+                        while True:
+                            block = src.read(1024 * 1024)
+                            if not block:
+                                break
+                            dst.write(block)
+                    sources.append((target, name))
+        except (zipfile.BadZipFile, OSError) as e:
+            failed.append({"file": filename, "sheet": None, "error": f"could not unpack: {e}"})
+    return sources, failed
+
+
+def parse_sheet(path, name, sheet, workdir):
+    """
+    Pool entry point: read and convert one sheet (None: a CSV) into
+    insert-ready row tuples, written chunk by chunk to a file in `workdir`.
+    Returns a report entry with "rows" (the row count), "rows_path" (read it
+    with iter_row_chunks) and "errors" (rejected cells), "skipped" for a
+    sheet without ratesheet columns, or "error" when it could not be read.
+    """
+    entry = {"file": name, "sheet": sheet}
+    fd, rows_path = tempfile.mkstemp(suffix=".rows", dir=workdir)
+    try:
+        count, rejected = 0, []
+        with os.fdopen(fd, "wb") as out:
+            for i, chunk in enumerate(iter_sheet_chunks(path, filename=name, sheet=sheet or 0)):
+                # e.g. a notes or contacts tab next to the rates
+                if i == 0 and not any(header in COLUMN_MAPPING for header in chunk.columns):
+                    os.remove(rows_path)
+                    return {**entry, "skipped": "no ratesheet columns"}
+                columns, errors = convert_frame(chunk)
+                rows = list(column_rows(columns))
+                pickle.dump(rows, out, protocol=pickle.HIGHEST_PROTOCOL)
+                count += len(rows)
+                if len(errors):
+                    rejected.append(errors)
+    except Exception as e:
+        if os.path.exists(rows_path):
+            os.remove(rows_path)
+        return {**entry, "error": f"{type(e).__name__}: {e}"}
+    errors = pd.concat(rejected, ignore_index=True) if rejected else pd.DataFrame(columns=ERROR_COLUMNS)
+    return {**entry, "rows": count, "rows_path": rows_path, "errors": errors}
+
+
+def iter_row_chunks(rows_paths):
+    """The row chunks parse_sheet wrote to each of `rows_paths`, in order."""
+    for rows_path in rows_paths:
+        with open(rows_path, "rb") as fh:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    break
+
+
+def _result(future, path, name, sheet):
+    # a worker that died (BrokenProcessPool) or an error parse_sheet did not catch fails this sheet only
+    try:
+        return future.result()
+    except Exception as e:
+        return {"file": name, "sheet": sheet, "error": f"{type(e).__name__}: {e}"}
+
+
+def parse_uploads(sources, workdir):
+    """
+    parse_sheet results for every sheet of every source (path, name), in
+    upload and tab order, with their rows in files under `workdir`; a source
+    whose sheets can't be listed gets an "error" entry in its place. A single
+    sheet, or UPLOAD_WORKERS <= 1, is parsed in this process.
+    """
+    tasks = []
+    for path, name in sources:
+        try:
+            tasks.extend((path, name, sheet) for sheet in sheet_names(path, name))
+        except Exception as e:
+            tasks.append({"file": name, "sheet": None, "error": f"could not open: {type(e).__name__}: {e}"})
+    sheets = [task for task in tasks if not isinstance(task, dict)]
+    if UPLOAD_WORKERS <= 1 or len(sheets) <= 1:
+        return [task if isinstance(task, dict) else parse_sheet(*task, workdir) for task in tasks]
+    # a pool per batch, not kept around: uploads are rare and may run inside a job process
+    # spawn, not fork: workers must not inherit the web worker's DB connections
+    with ProcessPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(sheets)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = [task if isinstance(task, dict) else (task, pool.submit(parse_sheet, *task, workdir))
+                   for task in tasks]
+        return [item if isinstance(item, dict) else _result(item[1], *item[0]) for item in pending]
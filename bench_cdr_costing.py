@@ -0,0 +1,77 @@
+"""
+Benchmark: CDR costing throughput in process vs. with a process pool.
+
+Usage:
+    python bench_cdr_costing.py --partners 1000 --records 2000000 --workers 1 4
+
+Writes a synthetic usage CSV and prices it against synthetic rate periods
+(two per partner, so records straddle a rate change), so no database is
+needed, and reports records per minute per worker count. The priced output
+of every run is compared with the first. Against real rates use
+`flask --app app cdr price USAGE.csv PRICED.csv --workers N`.
+"""
+import argparse
+import datetime
+import filecmp
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cdr_costing import RATE_COLUMNS, SERVICES, RateTable, price_file
+
+START = datetime.date(2025, 1, 1)
+CHANGE = datetime.date(2025, 7, 1)
+
+
+def make_periods(partners, rng):
+    periods = []
+    for i in range(partners):
+        tadig = f"P{i:04d}"
+        for history_id, (start, end) in enumerate([(START, CHANGE - datetime.timedelta(days=1)), (CHANGE, None)]):
+            # 60/60 charging intervals, per-unit rates between 0.01 and 1
+            period = {column: 60.0 if column.endswith(("_initial", "_step")) else float(rng.uniform(0.01, 1.0))
+                      for column in RATE_COLUMNS}
+            period.update(history_id=i * 2 + history_id, tadig_plmn_code=tadig, start_date=start, end_date=end,
+                          tax_applicable_yes_no=("Yes", "No")[i % 2], tax_applicable_tax_value="15%",
+                          tax_included_in_the_rate_yes_no=("No", "Yes")[i % 3 == 0])
+            periods.append(period)
+    return periods
+
+
+def make_usage(path, partners, records, rng):
+    pd.DataFrame({
+        "tadig_plmn_code": [f"P{i:04d}" for i in rng.integers(0, partners, records)],
+        "service": rng.choice(list(SERVICES), records),
+        "duration": rng.integers(0, 600, records),
+        "bytes": rng.integers(0, 50 * 1024 * 1024, records),
+        "event_time": pd.Timestamp(START) + pd.to_timedelta(rng.integers(0, 365 * 86400, records), unit="s"),
+    }).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--partners", type=int, default=1000)
+    parser.add_argument("--records", type=int, default=2000000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--chunk-rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    table = RateTable(make_periods(args.partners, rng))
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "usage.csv")
+        make_usage(source, args.partners, args.records, rng)
+        first = None
+        for workers in args.workers:
+            output = os.path.join(tmp, f"priced_{workers}.csv")
+            summary = price_file(table, source, output, workers=workers, chunk_rows=args.chunk_rows)
+            same = "" if first is None else f", output {'identical' if filecmp.cmp(first, output, False) else 'DIFFERS'}"
+            first = first or output
+            print(f"{workers:>2} workers: {summary['records']} records ({summary['priced']} priced) in "
+                  f"{summary['seconds']:.2f}s = {summary['records'] / summary['seconds'] * 60:,.0f} per minute{same}")
+
+
+if __name__ == "__main__":
+    main()
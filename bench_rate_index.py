@@ -0,0 +1,91 @@
+"""
+Benchmark: /rate lookups against the in-memory rate_index.
+
+Usage:
+    python bench_rate_index.py --partners 1000 10000 --template 300 --lookups 100000
+
+Builds the index from synthetic partners/template/country (bench_voice_engine),
+so no database is needed, times index builds and single lookups, and checks
+every voice answer against the first matching row of voice_engine.expand.
+Against real tables use `flask --app app rate check`.
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+# import the app first so rate_index and voice_engine resolve their imports; no tables are touched
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_ingest.db")
+
+import app  # noqa: E402,F401
+from bench_voice_engine import make_country, make_partners, make_template, timed  # noqa: E402
+from charging_interval import SECONDS, parse  # noqa: E402
+from partner_export import tadig_of  # noqa: E402
+from rate_index import PARTNER_BRANCHES, PERIOD_COLUMNS, RateIndex  # noqa: E402
+from ratecard_bundle import normalize  # noqa: E402
+from reference_cache import Reference  # noqa: E402
+from voice_engine import expand, for_reference  # noqa: E402
+
+AS_OF = datetime.date(2026, 1, 1)
+
+
+def make_periods(partners):
+    """Partner frame rows as rate_index periods, with intervals derived from the rules."""
+    periods = []
+    for history_id, row in enumerate(partners.to_dict("records"), 1):
+        period = dict.fromkeys(PERIOD_COLUMNS)
+        period.update({column: value for column, value in row.items() if column in period})
+        period.update(history_id=history_id, mo_sms_rate_value=0.05, gprs_rate_mb_rate_value=0.01)
+        for _, _, (rule, initial, step) in PARTNER_BRANCHES:
+            period[initial], period[step] = parse(period[rule], SECONDS) or (None, None)
+        periods.append(period)
+    return periods
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--partners", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--template", type=int, default=300)
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+
+    country = make_country()
+    template = make_template(country, args.template)
+    reference = Reference({"template": 1, "country_v2": 1}, template, country)
+    keys = sorted({(d, c) for d, c in zip(template.destination, template.calls_type)})
+    rng = random.Random(4)
+    for n in args.partners:
+        partners = make_partners(country, n)
+        periods = make_periods(partners)
+        index, build_time = timed(lambda: RateIndex({"ratesheet_v2": 1}, periods, reference))
+        tadigs = list(partners.tadig_plmn_code)
+        lookups = [(rng.choice(tadigs), *rng.choice(keys)) for _ in range(args.lookups)]
+
+        start = time.perf_counter()
+        found = 0
+        for tadig, destination, calls_type in lookups:
+            try:
+                index.lookup(tadig, "voice", AS_OF, destination=destination, calls_type=calls_type)
+                found += 1
+            except LookupError:
+                pass
+        lookup_time = time.perf_counter() - start
+
+        # every (partner, destination, calls_type) against the first expanded row
+        expanded = expand(partners, for_reference(reference))
+        expanded = expanded.drop_duplicates(["tariff_name", "destination", "calls_type"])
+        differing = 0
+        for row in expanded.itertuples(index=False):
+            result = index.lookup(tadig_of(row.tariff_name), "voice", AS_OF,
+                                  destination=row.destination, calls_type=row.calls_type)
+            expected = (normalize(row.rate), row.rounding_rules, row.source_order, row.tariff_name)
+            got = (normalize(result["rate"]), result["rounding_rule"], result["source_order"], result["tariff_name"])
+            differing += expected != got
+        print(f"{n:>7} partners: index built in {build_time * 1000:7.1f}ms, {args.lookups} lookups "
+              f"({found} found) in {lookup_time:.2f}s = {lookup_time / args.lookups * 1e6:5.1f}us each, "
+              f"{len(expanded)} checked against expand: {differing} differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark: voice ratecard generation with voice_engine (NumPy).
+
+Usage:
+    python bench_voice_engine.py --partners 1000 10000 --template 300
+
+Runs on synthetic partners/template/country frames, so no database is
+needed. tests/test_voice_engine.py pins the rows and order; against real
+tables compare /download-ratecard/file?live=1 with ?engine=numpy.
+"""
+import argparse
+import datetime
+import os
+import random
+import string
+import time
+
+import numpy as np
+import pandas as pd
+
+# import the app first so ratecard_bundle and voice_engine resolve their imports; no tables are touched
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_ingest.db")
+
+import app  # noqa: E402,F401
+from voice_engine import MISC_CALL_TYPES, VOICE_BRANCHES, ReferenceData, expand  # noqa: E402
+
+
+def make_country(n=250):
+    rng = random.Random(1)
+    codes = sorted({"".join(rng.choices(string.ascii_uppercase, k=3)) for _ in range(n * 2)})[:n]
+    return pd.DataFrame({"alpha_3": codes, "custom_name": [f"Country {code}" for code in codes]})
+
+
+def make_template(country, rows):
+    rng = random.Random(2)
+    calls_types = ["ROW", "MTC CALLS", "Home"] + MISC_CALL_TYPES
+    destinations = ["National"] + list(country.custom_name)
+    records = []
+    for i in range(rows):
+        records.append({
+            "destination": rng.choice(destinations),
+            "area_code": str(rng.randint(1, 999)),
+            "rate": round(rng.random(), 4),
+            "date": datetime.date(2025, 7, 1),
+            "rounding_rules": rng.choice(["1/1", "60/60", "30/30"]),
+            "destination_type": "Fixed",
+            "setup_rate": 0.0,
+            "calls_type": calls_types[i % len(calls_types)],
+            "remarks": None,
+        })
+    return pd.DataFrame.from_records(records)
+
+
+def make_partners(country, n):
+    rng = np.random.default_rng(3)
+    alpha = country.alpha_3.to_numpy()[rng.integers(0, len(country), n)]
+    partners = {
+        "tadig_plmn_code": [f"{a}{i:02d}"[:16] for i, a in enumerate(alpha)],
+        "start_date": [datetime.date(2025, 1 + i % 12, 1) for i in range(n)],
+    }
+    for _, rate, rule in VOICE_BRANCHES[:4]:
+        partners[rate] = rng.random(n).round(4)
+        partners[rule] = rng.choice(["1/1", "60/60"], n)
+    return pd.DataFrame(partners)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--partners", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--template", type=int, default=300)
+    args = parser.parse_args()
+
+    country = make_country()
+    template = make_template(country, args.template)
+    reference, ref_time = timed(lambda: ReferenceData(template, country))
+    print(f"reference data: {args.template} template rows, {len(country)} countries in {ref_time * 1000:.1f}ms")
+    for n in args.partners:
+        partners = make_partners(country, n)
+        frame, elapsed = timed(lambda: expand(partners, reference))
+        print(f"{n:>7} partners: {len(frame):>9} rows in {elapsed:7.2f}s "
+              f"({len(frame) / elapsed / 1e6:5.2f}M rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import csv
+import io
+import logging
+
+from sqlalchemy import table, column
+
+logger = logging.getLogger(__name__)
+
+# Rows are streamed to the server in chunks of this size so the CSV buffer
+# never holds the whole sheet at once.
+COPY_CHUNK_ROWS = 20000
+
+# psycopg2 reads NULLs as this marker; plain empty strings stay empty strings.
+NULL_MARKER = "\\N"
+
+
+def bulk_insert(session, table_name, columns, rows, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Insert an iterable of row tuples (ordered like `columns`) into `table_name`
+    using the session's current connection/transaction.
+
+    PostgreSQL gets COPY FROM STDIN; any other backend falls back to an
+    executemany of a single INSERT statement. Returns the number of rows written.
+    """
+    conn = session.connection()
+    if conn.dialect.name == "postgresql":
+        return _copy_rows(conn, table_name, columns, rows, chunk_rows)
+    return _insert_rows(conn, table_name, columns, rows, chunk_rows)
+
+
+def _copy_rows(conn, table_name, columns, rows, chunk_rows):
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(
+        table_name, ", ".join(columns), NULL_MARKER
+    )
+    cursor = conn.connection.cursor()
+    total = 0
+    try:
+        for chunk in _chunks(rows, chunk_rows):
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for row in chunk:
+                writer.writerow([NULL_MARKER if v is None else v for v in row])
+            buf.seek(0)
+            cursor.copy_expert(sql, buf)
+            total += len(chunk)
+            logger.debug("COPY %s: %d rows streamed", table_name, total)
+    finally:
+        cursor.close()
+    return total
+
+
+def _insert_rows(conn, table_name, columns, rows, chunk_rows):
+    target = table(table_name, *[column(c) for c in columns])
+    total = 0
+    for chunk in _chunks(rows, chunk_rows):
+        conn.execute(target.insert(), [dict(zip(columns, row)) for row in chunk])
+        total += len(chunk)
+        logger.debug("INSERT %s: %d rows written", table_name, total)
+    return total
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
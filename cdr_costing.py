@@ -0,0 +1,361 @@
+import datetime
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from rate_history import current_periods_sql
+from ratesheet_schema import interval_columns
+
+logger = logging.getLogger(__name__)
+
+# Batch costing of usage records (CDRs) against the effective-dated partner
+# rates of ratesheet_history. The input is read in chunks; each chunk is
+# priced in a worker process with NumPy: the period in effect on each event's
+# day (chosen like RATES_AS_OF_SQL, for all records at once), the
+# charging interval rounding, the rate and the tax flags. Workers also encode
+# the CSV output, so the main process only reads, writes and adds up totals.
+CDR_WORKERS = int(os.getenv("CDR_WORKERS", min(4, os.cpu_count() or 1)))
+CDR_CHUNK_ROWS = int(os.getenv("CDR_CHUNK_ROWS", 200000))
+
+# required input columns: duration in seconds (voice), bytes (data), event_time any pandas-readable timestamp
+USAGE_COLUMNS = ["tadig_plmn_code", "service", "duration", "bytes", "event_time"]
+PRICED_COLUMNS = ["valid_from", "billed", "rate", "charge", "tax", "total", "status"]
+TOTAL_COLUMNS = ["records", "priced", "billed", "charge", "tax", "total"]
+
+SECONDS_PER_MINUTE = 60
+BYTES_PER_MB = 1024 * 1024
+# service -> (rate column, charging interval field, usage column, usage units the rate is quoted per).
+# Voice rates are per minute of rounded duration, data rates per MB of rounded volume, SMS per message.
+SERVICES = {
+    "moc_local": ("moc_call_local_call_rate_value", "moc_call_local_call_charging_interval",
+                  "duration", SECONDS_PER_MINUTE),
+    "moc_home": ("moc_call_call_back_home_rate_value", "moc_call_call_back_home_charging_interval",
+                 "duration", SECONDS_PER_MINUTE),
+    "moc_row": ("moc_call_rest_of_the_world_rate_value", "moc_call_rest_of_the_world_charging_interval",
+                "duration", SECONDS_PER_MINUTE),
+    "moc_premium": ("moc_call_premium_numbers_rate_value", "moc_call_premium_numbers_charging_interval",
+                    "duration", SECONDS_PER_MINUTE),
+    "moc_special": ("moc_call_special_numbers_rate_value", "moc_call_special_numbers_charging_interval",
+                    "duration", SECONDS_PER_MINUTE),
+    "moc_satellite": ("moc_call_satellite_rate_value", "moc_call_satellite_charging_interval",
+                      "duration", SECONDS_PER_MINUTE),
+    "mtc": ("mtc_call_rate_value", "mtc_call_charging_interval", "duration", SECONDS_PER_MINUTE),
+    "sms": ("mo_sms_rate_value", None, None, 1),
+    "gprs": ("gprs_rate_mb_rate_value", "gprs_rate_mb_charging_interval", "bytes", BYTES_PER_MB),
+    "volte": ("volte_rate_mb_rate_value", "volte_rate_mb_charging_interval", "bytes", BYTES_PER_MB),
+}
+TAX_COLUMNS = ["tax_applicable_yes_no", "tax_applicable_tax_value", "tax_included_in_the_rate_yes_no"]
+
+RATE_COLUMNS = [
+    column for rate, field, _, _ in SERVICES.values()
+    for column in (rate, *(interval_columns(field)[1:] if field else ()))
+]
+# the current version of every period (rate_history.RATES_AS_OF_SQL)
+RATES_SQL = f"""
+SELECT history_id, tadig_plmn_code, start_date, end_date, {", ".join(RATE_COLUMNS + TAX_COLUMNS)}
+FROM ({current_periods_sql("tadig_plmn_code IS NOT NULL")}) current_periods;
+"""
+
+# end_date of a period that is open-ended, start_date of one without a start_date
+OPEN_END = datetime.date(9999, 12, 31)
+OPEN_START = datetime.date.min
+TAX_VALUE_RE = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*(%?)\s*$")
+
+# the RateTable of this worker process (set by _init_worker)
+_table = None
+
+
+def is_yes(value):
+    return isinstance(value, str) and value.strip().lower() in ("yes", "y", "true", "1")
+
+
+def tax_rate(value):
+    """
+    Tax Value as a fraction: "15%" and "15" read as 15%, values below 1
+    ("0.15") as fractions already. A bare "1" is therefore 1%, not 100%.
+    """
+    match = TAX_VALUE_RE.match(str(value)) if value is not None else None
+    if not match:
+        return 0.0
+    number = float(match.group(1).replace(",", "."))
+    return number / 100 if match.group(2) or number >= 1 else number
+
+
+class RateTable:
+    """
+    Rate periods as NumPy columns (one row per period, NaN where unset) plus
+    the period dates per partner, latest first, for picking the period in
+    effect on each event's day.
+    """
+
+    def __init__(self, periods):
+        # a trailing sentinel row (no rates, no tax) answers row -1
+        self.columns = {
+            column: np.array([period[column] for period in periods] + [None], dtype="float64")
+            for column in RATE_COLUMNS
+        }
+        # tax is charged when applicable, and then either added or already part of the rate
+        self.tax_rate = np.array([
+            tax_rate(period["tax_applicable_tax_value"]) if is_yes(period["tax_applicable_yes_no"]) else 0.0
+            for period in periods
+        ] + [0.0], dtype="float64")
+        self.tax_included = np.array(
+            [is_yes(period["tax_included_in_the_rate_yes_no"]) for period in periods] + [False], dtype=bool
+        )
+        self.valid_from = pd.to_datetime([period["start_date"] for period in periods] + [None]).to_numpy()
+        # periods by partner, then latest start_date and upload first (RATES_AS_OF_SQL)
+        order = sorted(range(len(periods)), key=lambda row: (
+            periods[row]["tadig_plmn_code"], -(periods[row]["start_date"] or OPEN_START).toordinal(),
+            -periods[row]["history_id"]
+        ))
+        self.order = np.array(order, dtype=np.int64)
+        self.start = np.array([periods[row]["start_date"] or OPEN_START for row in order], dtype="datetime64[D]")
+        self.end = np.array([periods[row]["end_date"] or OPEN_END for row in order], dtype="datetime64[D]")
+        partners, self.first, self.count = np.unique(
+            np.array([periods[row]["tadig_plmn_code"] for row in order], dtype=object),
+            return_index=True, return_counts=True,
+        )
+        self.partners = pd.Index(partners)
+        self.size = len(periods)
+
+    def rows(self, tadigs, event_times):
+        """
+        Row of the period in effect on each record's day (-1: none): the first
+        of the partner's periods, latest first, that covers it. Tries every
+        partner's k-th period at once, for the records still unresolved.
+        """
+        if event_times.dt.tz is not None:
+            event_times = event_times.dt.tz_localize(None)
+        day = event_times.to_numpy().astype("datetime64[D]")
+        partner = self.partners.get_indexer(tadigs)
+        resolved = np.full(len(day), -1, dtype=np.int64)
+        pending = np.flatnonzero((partner >= 0) & ~np.isnat(day))
+        k = 0
+        while len(pending):
+            at = self.first[partner[pending]] + k
+            hit = (self.start[at] <= day[pending]) & (day[pending] <= self.end[at])
+            resolved[pending[hit]] = self.order[at[hit]]
+            pending = pending[~hit & (k + 1 < self.count[partner[pending]])]
+            k += 1
+        return resolved
+
+
+def load_rates(session):
+    """Every rate period of ratesheet_history as a RateTable."""
+    return RateTable([dict(row) for row in session.execute(text(RATES_SQL)).mappings()])
+
+
+def billed_units(usage, initial, step):
+    """
+    Usage rounded up to the charging interval: at least `initial`, then
+    whole `step`s beyond it (60/60 bills 61s as 120s, 30/6 bills 31s as
+    36s). Zero usage bills nothing; without an interval usage bills as is.
+    """
+    usage = np.ceil(usage)
+    has_interval = (step > 0) & (initial >= 0)
+    initial = np.where(has_interval, initial, 0.0)
+    step = np.where(has_interval, step, 1.0)
+    billed = initial + np.ceil(np.maximum(usage - initial, 0.0) / step) * step
+    return np.where(usage > 0, billed, np.where(usage == 0, 0.0, np.nan))
+
+
+def price_frame(chunk, table):
+    """chunk (USAGE_COLUMNS and any others) with PRICED_COLUMNS appended."""
+    n = len(chunk)
+    service = chunk["service"].astype(object).to_numpy()
+    event_time = pd.to_datetime(chunk["event_time"], errors="coerce")
+    row = table.rows(chunk["tadig_plmn_code"].astype(object), event_time)
+    has_rates = row >= 0
+    billed, rate, units = np.full(n, np.nan), np.full(n, np.nan), np.ones(n)
+    known = np.zeros(n, dtype=bool)
+    for name, (rate_column, field, usage_column, per) in SERVICES.items():
+        selected = service == name
+        known |= selected
+        selected &= has_rates
+        if not selected.any():
+            continue
+        rows = row[selected]
+        if usage_column is None:
+            billed[selected] = 1.0
+        else:
+            usage = pd.to_numeric(chunk[usage_column], errors="coerce").to_numpy(dtype="float64")[selected]
+            _, initial, step = interval_columns(field)
+            billed[selected] = billed_units(usage, table.columns[initial][rows], table.columns[step][rows])
+        rate[selected] = table.columns[rate_column][rows]
+        units[selected] = per
+
+    charge = billed / units * rate
+    tax_rate, included = table.tax_rate[row], table.tax_included[row]
+    # tax included in the rate: the charge already is the total and tax its share
+    tax = np.where(included, charge - charge / (1 + tax_rate), charge * tax_rate)
+    total = np.where(included, charge, charge + tax)
+    status = np.select(
+        [~known, ~has_rates, np.isnan(rate), np.isnan(billed)],
+        ["unknown service", "no rates in effect", "no rate for service", "invalid usage"],
+        "priced",
+    )
+    return chunk.assign(valid_from=table.valid_from[row], billed=billed, rate=rate, charge=charge,
+                        tax=tax, total=total, status=status)
+
+
+def partner_totals(priced):
+    """Per partner and service: records, priced records and the sums of billed, charge, tax and total over these."""
+    ok = priced.status == "priced"
+    return priced.assign(records=1, priced=ok.astype(int), billed=priced.billed.where(ok)).groupby(
+        ["tadig_plmn_code", "service"], dropna=False
+    )[TOTAL_COLUMNS].sum()
+
+
+def _init_worker(table):
+    global _table
+    _table = table
+
+
+def price_chunk(chunk, fmt, header=False):
+    """
+    Pool entry point: price one chunk with this worker's RateTable. Returns
+    (output: CSV text for fmt='csv', else the DataFrame; partner totals).
+    """
+    priced = price_frame(chunk, _table)
+    totals = partner_totals(priced)
+    if fmt == "csv":
+        return priced.to_csv(index=False, header=header), totals
+    return priced, totals
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet input or output needs pyarrow (pip install pyarrow)") from None
+    return pyarrow, pyarrow.parquet
+
+
+def file_format(path):
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def read_chunks(path, chunk_rows=CDR_CHUNK_ROWS):
+    """DataFrames of at most chunk_rows usage records from a CSV or Parquet file."""
+    if file_format(path) == "parquet":
+        _, parquet = _parquet()
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={"tadig_plmn_code": str, "service": str})
+
+
+class _Writer:
+    """Appends priced chunks to a CSV (text from the workers) or Parquet file."""
+
+    def __init__(self, path):
+        self.path, self.fmt = path, file_format(path)
+        self.fh = self.parquet_writer = None
+
+    def write(self, output):
+        if self.fmt == "csv":
+            if self.fh is None:
+                self.fh = open(self.path, "w", newline="")
+            self.fh.write(output)
+            return
+        pyarrow, parquet = _parquet()
+        if self.parquet_writer is None:
+            table = pyarrow.Table.from_pandas(output, preserve_index=False)
+            self.parquet_writer = parquet.ParquetWriter(self.path, table.schema)
+        else:
+            # later chunks may infer other types for sparse columns; keep the first chunk's schema
+            table = pyarrow.Table.from_pandas(output, schema=self.parquet_writer.schema, preserve_index=False)
+        self.parquet_writer.write_table(table)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        self.fh = self.parquet_writer = None
+
+
+def price_file(table, source, output, totals_path=None, workers=CDR_WORKERS, chunk_rows=CDR_CHUNK_ROWS,
+               progress=None):
+    """
+    Price the usage records in `source` (CSV or Parquet) against `table`
+    (load_rates) and write them, in input order, to `output` (CSV or
+    Parquet), plus per-partner totals as CSV to `totals_path` (default:
+    <output>_totals.csv). workers <= 1 prices in this process. progress, if
+    given, is called as progress(rows=...) after every chunk. Returns a
+    summary dict.
+    """
+    start = time.perf_counter()
+    fmt = file_format(output)
+    totals_path = totals_path or f"{os.path.splitext(output)[0]}_totals.csv"
+    writer = _Writer(output)
+    totals, records = [], 0
+
+    def collect(result):
+        nonlocal records
+        out, chunk_totals = result
+        writer.write(out)
+        totals.append(chunk_totals)
+        records += int(chunk_totals["records"].sum())
+        if progress:
+            progress(rows=records)
+
+    def chunks():
+        for i, chunk in enumerate(read_chunks(source, chunk_rows)):
+            missing = [column for column in USAGE_COLUMNS if column not in chunk.columns]
+            if missing:
+                raise ValueError(f"{source} is missing usage columns: {', '.join(missing)}")
+            yield chunk, fmt, i == 0
+
+    try:
+        if workers <= 1:
+            _init_worker(table)
+            for args in chunks():
+                collect(price_chunk(*args))
+        else:
+            # spawn, not fork: workers must not inherit the parent's DB connections
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(table,)) as pool:
+                # results are written in input order; at most two chunks per worker are in flight
+                pending = deque()
+                for args in chunks():
+                    pending.append(pool.submit(price_chunk, *args))
+                    if len(pending) >= workers * 2:
+                        collect(pending.popleft().result())
+                while pending:
+                    collect(pending.popleft().result())
+    except BaseException:
+        # no partial output: it would look like a priced file
+        writer.close()
+        if os.path.exists(output):
+            os.remove(output)
+        raise
+    finally:
+        writer.close()
+
+    if totals:
+        summary = pd.concat(totals).groupby(level=[0, 1], dropna=False).sum().reset_index()
+    else:
+        summary = pd.DataFrame(columns=["tadig_plmn_code", "service"] + TOTAL_COLUMNS)
+    summary.to_csv(totals_path, index=False)
+    elapsed = time.perf_counter() - start
+    result = {
+        "records": records,
+        "priced": int(summary["priced"].sum()),
+        "total": float(summary["total"].sum()),
+        "seconds": round(elapsed, 2),
+        "output": output,
+        "totals": totals_path,
+    }
+    logger.info(f"Priced {records} usage records ({result['priced']} priced) from {source} in {elapsed:.1f}s "
+                f"({records / elapsed * 60 if elapsed else 0:,.0f} per minute) -> {output}, {totals_path}")
+    return result
@@ -0,0 +1,90 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Charging intervals ("60 seconds", "1 KB", "30/30", ...) normalized to
+# integer (initial, step) increments in seconds or bytes, plus the rounding
+# rule string "initial/step" the ratecards carry. KNOWN_INTERVALS is the
+# lookup table the export SQL used to spell out as CASE chains; anything else
+# goes through the parser. Values neither can read are kept as they are
+# (uploads list them with the cells they could not convert).
+
+SECONDS = "seconds"
+BYTES = "bytes"
+
+# unit word (lowercase) -> (kind, multiplier)
+UNITS = {
+    "s": (SECONDS, 1), "sec": (SECONDS, 1), "secs": (SECONDS, 1), "second": (SECONDS, 1), "seconds": (SECONDS, 1),
+    "min": (SECONDS, 60), "mins": (SECONDS, 60), "minute": (SECONDS, 60), "minutes": (SECONDS, 60),
+    "b": (BYTES, 1), "byte": (BYTES, 1), "bytes": (BYTES, 1),
+    "kb": (BYTES, 1024), "mb": (BYTES, 1024 ** 2), "gb": (BYTES, 1024 ** 3),
+}
+
+KNOWN_INTERVALS = {
+    "1 second": (SECONDS, 1, 1),
+    "60 seconds": (SECONDS, 60, 60),
+    "1 KB": (BYTES, 1024, 1024),
+    "10 KB": (BYTES, 10240, 10240),
+    "1 MB": (BYTES, 1048576, 1048576),
+}
+
+# "30 seconds", "100 KB", "60/60", "30/6 s", "30 s + 6 s", "1 min/1 s"
+_AMOUNT = r"(\d+)\s*([a-z]+)?"
+INTERVAL_RE = re.compile(rf"^\s*{_AMOUNT}\s*(?:[/+]\s*{_AMOUNT}\s*)?$", re.IGNORECASE)
+
+
+def parse(value, kind):
+    """
+    (initial, step) for one interval in units of `kind` (SECONDS or BYTES),
+    or None when it can't be read, is given in the other kind's units or has
+    a zero increment ("0 seconds" can't be billed). A bare number ("60/60")
+    is taken to be in `kind`'s base unit already.
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    text = str(value).strip()
+    known = KNOWN_INTERVALS.get(text)
+    if known:
+        return known[1:] if known[0] == kind else None
+    match = INTERVAL_RE.match(text)
+    if not match:
+        return None
+    first, first_unit, second, second_unit = match.groups()
+    # "30/6 seconds": a trailing unit applies to both amounts
+    first_unit = first_unit or second_unit
+    amounts = []
+    for amount, unit in ((first, first_unit), (second or first, second_unit or first_unit)):
+        unit_kind, multiplier = UNITS.get(unit.lower(), (None, None)) if unit else (kind, 1)
+        if unit_kind != kind:
+            return None
+        amounts.append(int(amount) * multiplier)
+    if not all(amounts):
+        return None
+    return tuple(amounts)
+
+
+def rule(value, kind):
+    """The rounding rule for one interval, or the value unchanged when it can't be parsed."""
+    parsed = parse(value, kind)
+    return f"{parsed[0]}/{parsed[1]}" if parsed else value
+
+
+def normalize(values, kind):
+    """
+    Normalize an array of raw intervals. Each distinct value is parsed once.
+    Returns object arrays (rules, initial, step) with None where the value
+    could not be parsed (rules then keep the raw value).
+    """
+    values = pd.Series(values, dtype=object)
+    parsed = {value: parse(value, kind) for value in values.dropna().unique()}
+    parsed = {value: amounts for value, amounts in parsed.items() if amounts}
+    rules = values.map({value: f"{initial}/{step}" for value, (initial, step) in parsed.items()})
+    rules = rules.where(rules.notna(), values)
+    initial = values.map({value: amounts[0] for value, amounts in parsed.items()}).astype("Int64")
+    step = values.map({value: amounts[1] for value, amounts in parsed.items()}).astype("Int64")
+    return tuple(
+        column.astype(object).where(column.notna(), None).to_numpy(dtype=object)
+        for column in (rules, initial, step)
+    )
+
@@ -59,3 +59,152 @@ CREATE TABLE ratesheet_v2 (
   tax_included_in_the_rate_yes_no VARCHAR(10),
   bearer_service_included_in_special_iot_yes_no VARCHAR(10)
 );
+
+-- Precomputed voice ratecard (voice_ratecard.VOICE_RATECARD_TABLE).
+-- Rebuilt by the app after every upload and whenever it is found stale.
+CREATE TABLE IF NOT EXISTS voice_ratecard (
+  row_no BIGINT PRIMARY KEY,
+  destination VARCHAR(100),
+  area_code VARCHAR(20),
+  rate DOUBLE PRECISION,
+  tariff_name VARCHAR(150),
+  date DATE,
+  rounding_rules VARCHAR(50),
+  destination_type VARCHAR(50),
+  setup_rate DOUBLE PRECISION,
+  calls_type VARCHAR(100),
+  remarks TEXT,
+  source_order INTEGER
+);
+
+-- Per-partner lookups on the precomputed ratecard (voice_ratecard.VOICE_RATECARD_INDEXES).
+CREATE INDEX IF NOT EXISTS voice_ratecard_tariff_idx ON voice_ratecard (tariff_name text_pattern_ops, row_no);
+
+-- Source table versions voice_ratecard was last built from (voice_ratecard.VOICE_SOURCES_TABLE).
+CREATE TABLE IF NOT EXISTS voice_ratecard_sources (
+  table_name VARCHAR(63) PRIMARY KEY,
+  version BIGINT NOT NULL
+);
+
+-- Indexes backing the single-pass voice generator
+-- (voice_ratecard.VOICE_INDEXES, also created on startup by schema.py).
+CREATE INDEX IF NOT EXISTS ratesheet_v2_tadig_prefix_idx ON ratesheet_v2 ((LEFT(tadig_plmn_code, 3)));
+CREATE INDEX IF NOT EXISTS country_v2_alpha_3_idx ON country_v2 ((alpha_3::text));
+CREATE INDEX IF NOT EXISTS country_v2_custom_name_idx ON country_v2 (custom_name);
+CREATE INDEX IF NOT EXISTS template_calls_type_idx ON "template" (calls_type);
+CREATE INDEX IF NOT EXISTS template_destination_idx ON "template" (destination);
+
+-- Per-table version counters (table_versions.py), bumped on every committed upload/edit.
+CREATE TABLE IF NOT EXISTS table_versions (
+  table_name VARCHAR(63) PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Indexes for the paginated /data view and /api/ratesheet filters.
+CREATE INDEX IF NOT EXISTS ratesheet_v2_tadig_upper_idx ON ratesheet_v2 (upper(tadig_plmn_code) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ratesheet_v2_bu_upper_idx ON ratesheet_v2 (upper(bu_plmn_code) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ratesheet_v2_start_date_idx ON ratesheet_v2 (start_date, id);
+
+-- Content hashes for diff-mode uploads (also added on startup by schema.py).
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS row_hash VARCHAR(16);
+ALTER TABLE country_v2 ADD COLUMN IF NOT EXISTS row_hash VARCHAR(16);
+-- Natural keys for INSERT ... ON CONFLICT (upsert_load.NATURAL_KEYS); on existing
+-- databases schema.py creates them on startup when the stored rows have no duplicates.
+CREATE UNIQUE INDEX IF NOT EXISTS ratesheet_v2_natural_key_idx ON ratesheet_v2 (tadig_plmn_code, start_date);
+CREATE UNIQUE INDEX IF NOT EXISTS country_v2_natural_key_idx ON country_v2 (alpha_3);
+
+-- Charging intervals normalized at upload (ratesheet_schema.interval_columns, also added on startup by schema.py).
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_local_call_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_local_call_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_local_call_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_call_back_home_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_call_back_home_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_call_back_home_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_rest_of_the_world_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_rest_of_the_world_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_rest_of_the_world_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_premium_numbers_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_premium_numbers_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_premium_numbers_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_special_numbers_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_special_numbers_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_special_numbers_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_satellite_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_satellite_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS moc_call_satellite_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS mtc_call_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS mtc_call_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS mtc_call_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS gprs_rate_mb_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS gprs_rate_mb_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS gprs_rate_mb_interval_step INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS volte_rate_mb_rounding_rule VARCHAR;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS volte_rate_mb_interval_initial INTEGER;
+ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS volte_rate_mb_interval_step INTEGER;
+
+-- Effective-dated history of ratesheet_v2 (rate_history.py, also created on startup by schema.py).
+CREATE TABLE IF NOT EXISTS ratesheet_history (
+  history_id BIGSERIAL PRIMARY KEY,
+  recorded_version BIGINT NOT NULL,
+  recorded_at TIMESTAMP NOT NULL DEFAULT now(),
+  content_hash CHAR(32) NOT NULL,
+  deleted BOOLEAN NOT NULL DEFAULT false,
+  bu_plmn_code VARCHAR,
+  tadig_plmn_code VARCHAR,
+  start_date DATE,
+  end_date DATE,
+  currency VARCHAR,
+  moc_call_local_call_rate_value DOUBLE PRECISION,
+  moc_call_local_call_charging_interval VARCHAR,
+  moc_call_call_back_home_rate_value DOUBLE PRECISION,
+  moc_call_call_back_home_charging_interval VARCHAR,
+  moc_call_rest_of_the_world_rate_value DOUBLE PRECISION,
+  moc_call_rest_of_the_world_charging_interval VARCHAR,
+  moc_call_premium_numbers_rate_value DOUBLE PRECISION,
+  moc_call_premium_numbers_charging_interval VARCHAR,
+  moc_call_special_numbers_rate_value DOUBLE PRECISION,
+  moc_call_special_numbers_charging_interval VARCHAR,
+  moc_call_satellite_rate_value DOUBLE PRECISION,
+  moc_call_satellite_charging_interval VARCHAR,
+  mtc_call_rate_value DOUBLE PRECISION,
+  mtc_call_charging_interval VARCHAR,
+  mo_sms_rate_value DOUBLE PRECISION,
+  gprs_rate_mb_rate_value DOUBLE PRECISION,
+  gprs_rate_per_kb_rate_value DOUBLE PRECISION,
+  gprs_rate_mb_charging_interval VARCHAR,
+  volte_rate_mb_rate_value DOUBLE PRECISION,
+  volte_rate_mb_charging_interval VARCHAR,
+  tax_applicable_yes_no VARCHAR,
+  tax_applicable_tax_value VARCHAR,
+  tax_included_in_the_rate_yes_no VARCHAR,
+  bearer_service_included_in_special_iot_yes_no VARCHAR,
+  moc_call_local_call_rounding_rule VARCHAR,
+  moc_call_local_call_interval_initial INTEGER,
+  moc_call_local_call_interval_step INTEGER,
+  moc_call_call_back_home_rounding_rule VARCHAR,
+  moc_call_call_back_home_interval_initial INTEGER,
+  moc_call_call_back_home_interval_step INTEGER,
+  moc_call_rest_of_the_world_rounding_rule VARCHAR,
+  moc_call_rest_of_the_world_interval_initial INTEGER,
+  moc_call_rest_of_the_world_interval_step INTEGER,
+  moc_call_premium_numbers_rounding_rule VARCHAR,
+  moc_call_premium_numbers_interval_initial INTEGER,
+  moc_call_premium_numbers_interval_step INTEGER,
+  moc_call_special_numbers_rounding_rule VARCHAR,
+  moc_call_special_numbers_interval_initial INTEGER,
+  moc_call_special_numbers_interval_step INTEGER,
+  moc_call_satellite_rounding_rule VARCHAR,
+  moc_call_satellite_interval_initial INTEGER,
+  moc_call_satellite_interval_step INTEGER,
+  mtc_call_rounding_rule VARCHAR,
+  mtc_call_interval_initial INTEGER,
+  mtc_call_interval_step INTEGER,
+  gprs_rate_mb_rounding_rule VARCHAR,
+  gprs_rate_mb_interval_initial INTEGER,
+  gprs_rate_mb_interval_step INTEGER,
+  volte_rate_mb_rounding_rule VARCHAR,
+  volte_rate_mb_interval_initial INTEGER,
+  volte_rate_mb_interval_step INTEGER
+);
+CREATE INDEX IF NOT EXISTS ratesheet_history_as_of_idx ON ratesheet_history (tadig_plmn_code, start_date, history_id);
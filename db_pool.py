@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Engine/pool settings, read from the environment. Every gunicorn worker
+# process gets its own engine and pool, so the database sees up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# hosted Postgres drops idle connections; recycle before it does
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no")
+# 0 disables; applies to every statement, including uploads and background jobs
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# checkouts slower than this count as a wait for a free connection
+WAIT_THRESHOLD = 0.005
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts that had to wait for a connection, and how long."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                if elapsed > WAIT_THRESHOLD:
+                    self.waits += 1
+                    self.wait_seconds += elapsed
+                    self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+
+    def recreate(self):
+        # dispose() swaps in a fresh pool; keep the counters across it
+        new_pool = super().recreate()
+        for name in ("checkouts", "waits", "wait_seconds", "max_wait_seconds", "timeouts", "connects", "invalidations"):
+            setattr(new_pool, name, getattr(self, name))
+        return new_pool
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for `database_uri` built from the DB_* environment variables."""
+    if not database_uri.startswith("postgres"):
+        return {}
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+    if STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def instrument(engine):
+    """Count new and invalidated (e.g. failed pre-ping) connections on the engine's pool."""
+    def on_connect(dbapi_connection, connection_record):
+        pool = engine.pool
+        if isinstance(pool, InstrumentedQueuePool):
+            with pool.stats_lock:
+                pool.connects += 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool = engine.pool
+        if isinstance(pool, InstrumentedQueuePool):
+            with pool.stats_lock:
+                pool.invalidations += 1
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "invalidate", on_invalidate)
+
+
+def pool_stats(engine):
+    """Current pool occupancy plus the InstrumentedQueuePool counters, as a dict."""
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__, "pid": os.getpid()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool.stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "waits": pool.waits,
+                "wait_seconds": round(pool.wait_seconds, 4),
+                "max_wait_seconds": round(pool.max_wait_seconds, 4),
+                "timeouts": pool.timeouts,
+                "connects": pool.connects,
+                "invalidations": pool.invalidations,
+            })
+    return stats
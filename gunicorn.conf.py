@@ -0,0 +1,35 @@
+# gunicorn settings, used by the Procfile (gunicorn -c gunicorn.conf.py app:app).
+#
+# Ratecard downloads spend most of their time waiting on Postgres and the
+# client, so each worker runs several threads. Keep GUNICORN_THREADS at or
+# below DB_POOL_SIZE + DB_MAX_OVERFLOW, or requests queue for a connection
+# (visible as "waits" on /admin/pool).
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# large xlsx exports can take a while to build
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
+# recycle workers now and then to cap memory growth from pandas/openpyxl
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = 100
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        # psycopg2 blocks the whole worker unless it yields to the gevent hub
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("gevent worker without psycogreen: database calls will block the worker")
+    if preload_app:
+        # connections opened in the master before fork must not be shared by workers
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
@@ -0,0 +1,383 @@
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from schema import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Background jobs are queued in a small SQLite file that every gunicorn
+# worker (and the job processes) can read. Each web worker runs a dispatcher
+# thread that claims queued jobs and runs them in its local process pool, so
+# a job does not depend on the worker that accepted it: when workers are
+# recycled, queued jobs are picked up by the next one. A claimed job holds a
+# lease that its process renews while it runs; a running job whose lease
+# expired lost its process and is marked failed.
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(tempfile.gettempdir(), "ratesheet-jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Uploaded files and generated results handed between requests and jobs.
+JOB_FILES_DIR = os.getenv("JOB_FILES_DIR", os.path.join(tempfile.gettempdir(), "ratesheet-jobs"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+# finished jobs, their result files and leftover files are deleted after this long
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 24 * 3600))
+JOB_SWEEP_SECONDS = 600
+
+# job kind -> "module:function". The function is called as fn(job, **params)
+# inside an app context and returns a JSON-serialisable result.
+JOB_KINDS = {
+    "ratesheet_upload": "app:run_ratesheet_upload_job",
+    "ratesheet_batch_upload": "app:run_ratesheet_batch_upload_job",
+    "voice_ratecard": "app_download_ratecards:run_voice_ratecard_job",
+    "cdr_costing": "app_cdr:run_cdr_costing_job",
+}
+
+CREATE_JOBS = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    phase TEXT,
+    rows_processed INTEGER NOT NULL DEFAULT 0,
+    params TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    worker TEXT,
+    lease_until REAL
+);
+"""
+# columns added to job databases created before the queue was claimed from
+JOB_COLUMNS = {"worker": "TEXT", "lease_until": "REAL"}
+CREATE_JOBS_INDEX = "CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, created_at);"
+
+_executor = None
+_executor_lock = threading.Lock()
+_migrated = False
+
+_dispatcher = {"pid": None}
+_dispatcher_lock = threading.Lock()
+_wake = threading.Event()
+# jobs this process has handed to its pool and not seen finish
+_running = set()
+
+
+def _connect():
+    global _migrated
+    conn = sqlite3.connect(JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(CREATE_JOBS)
+    if not _migrated:
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in JOB_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        conn.execute(CREATE_JOBS_INDEX)
+        conn.commit()
+        _migrated = True
+    return conn
+
+
+def _update(job_id, **fields):
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with _connect() as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+
+def _decode(row):
+    job = dict(row)
+    for field in ("params", "result"):
+        job[field] = json.loads(job[field]) if job[field] else None
+    return job
+
+
+def get_job(job_id):
+    """Return the job as a dict, or None if the id is unknown."""
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return None if row is None else _decode(row)
+
+
+def job_file_path(suffix):
+    """A fresh path under JOB_FILES_DIR for an upload or a generated result."""
+    os.makedirs(JOB_FILES_DIR, exist_ok=True)
+    return os.path.join(JOB_FILES_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+
+def _job_files(job):
+    """Files under JOB_FILES_DIR a job refers to: its uploaded inputs and its result file."""
+    params, result = job["params"] or {}, job["result"] or {}
+    paths = [params.get("path"), *params.get("paths", []), result.get("path")]
+    root = os.path.abspath(JOB_FILES_DIR) + os.sep
+    return [path for path in paths if isinstance(path, str) and os.path.abspath(path).startswith(root)]
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not delete job file {path}: {e}")
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: job processes must not inherit the web worker's DB connections
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _reset_executor(broken):
+    """Drop a pool that lost a process (BrokenProcessPool); the next _get_executor starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is not broken:
+            return
+        _executor = None
+    logger.warning("Job process pool is broken, starting a new one")
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def enqueue(kind, **params):
+    """Record a queued job of `kind` and return its id; a dispatcher picks it up."""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, phase, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, "queued", "queued", json.dumps(params), now, now),
+        )
+    logger.info(f"Job {job_id} ({kind}) queued")
+    start_dispatcher()
+    _wake.set()
+    return job_id
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_job():
+    """Mark the oldest queued job running under a fresh lease for this process. Returns it, or None."""
+    conn = _connect()
+    try:
+        if conn.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone() is None:
+            return None
+        # IMMEDIATE: two dispatchers can't both read the same queued row before either updates it
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = 'running', phase = 'starting', worker = ?, lease_until = ?, updated_at = ? "
+            "WHERE id = ?",
+            (_worker_id(), now + JOB_LEASE_SECONDS, now, row["id"]),
+        )
+        conn.commit()
+        return _decode(row)
+    finally:
+        conn.close()
+
+
+def reap_expired():
+    """Fail running jobs whose lease expired (their process is gone) and delete their inputs. Returns them."""
+    now = time.time()
+    conn = _connect()
+    try:
+        expired = "status = 'running' AND (lease_until IS NULL OR lease_until < ?)"
+        if conn.execute(f"SELECT 1 FROM jobs WHERE {expired} LIMIT 1", (now,)).fetchone() is None:
+            return []
+        # IMMEDIATE: a job that finishes meanwhile must not be failed and have its files deleted
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"SELECT * FROM jobs WHERE {expired}", (now,)).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+            [(f"job process lost (worker {row['worker'] or 'unknown'} stopped renewing its lease)", now, row["id"])
+             for row in rows],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    for row in rows:
+        job = _decode(row)
+        logger.error(f"Job {job['id']} ({job['kind']}) lost its process, marked failed")
+        _remove_files(_job_files(job))
+    return rows
+
+
+def purge_finished(retention=JOB_RETENTION_SECONDS):
+    """
+    Delete jobs that finished more than `retention` seconds ago with their
+    result files, then any file in JOB_FILES_DIR that old which no remaining
+    job refers to (e.g. the partial output of a killed job). Returns the
+    number of jobs deleted.
+    """
+    cutoff = time.time() - retention
+    with _connect() as conn:
+        expired = [_decode(row) for row in conn.execute(
+            "SELECT * FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+        )]
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(job["id"],) for job in expired])
+        kept = {path for row in conn.execute("SELECT * FROM jobs") for path in _job_files(_decode(row))}
+    _remove_files(path for job in expired for path in _job_files(job))
+    try:
+        names = os.listdir(JOB_FILES_DIR)
+    except FileNotFoundError:
+        names = []
+    stale = []
+    for name in names:
+        path = os.path.join(JOB_FILES_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff and path not in kept and os.path.isfile(path):
+                stale.append(path)
+        except FileNotFoundError:
+            pass
+    _remove_files(stale)
+    if expired or stale:
+        logger.info(f"Purged {len(expired)} finished jobs and {len(stale)} leftover job files")
+    return len(expired)
+
+
+def _submit(job):
+    job_id = job["id"]
+    _running.add(job_id)
+    try:
+        executor = _get_executor()
+        try:
+            future = executor.submit(run_job, job_id, job["kind"], job["params"] or {})
+        except BrokenProcessPool:
+            # a job process died since the last submit; retry once on a fresh pool
+            _reset_executor(executor)
+            executor = _get_executor()
+            future = executor.submit(run_job, job_id, job["kind"], job["params"] or {})
+    except Exception as e:
+        _running.discard(job_id)
+        logger.exception(f"Job {job_id} could not be started")
+        _update(job_id, status="failed", error=f"could not start: {e}")
+        return
+    future.add_done_callback(lambda f: _on_done(job_id, f, executor))
+
+
+def _dispatch():
+    """Dispatcher thread: claim queued jobs while this process has free job workers."""
+    last_reap = last_sweep = 0.0
+    while True:
+        try:
+            now = time.time()
+            if now - last_reap >= JOB_LEASE_SECONDS / 2:
+                reap_expired()
+                last_reap = now
+            if now - last_sweep >= JOB_SWEEP_SECONDS:
+                purge_finished()
+                last_sweep = now
+            while len(_running) < JOB_WORKERS:
+                job = claim_job()
+                if job is None:
+                    break
+                logger.info(f"Job {job['id']} ({job['kind']}) claimed by {_worker_id()}")
+                _submit(job)
+        except Exception:
+            logger.exception("Job dispatcher failed, retrying")
+        _wake.wait(JOB_POLL_SECONDS)
+        _wake.clear()
+
+
+def start_dispatcher():
+    """Start this process's dispatcher thread, once per process (threads do not survive a fork)."""
+    with _dispatcher_lock:
+        if _dispatcher["pid"] == os.getpid():
+            return
+        _dispatcher["pid"] = os.getpid()
+        _running.clear()
+    threading.Thread(target=_dispatch, name="job-dispatcher", daemon=True).start()
+
+
+def _on_done(job_id, future, executor):
+    _running.discard(job_id)
+    # run_job records its own failures; this only catches a crashed worker process
+    exc = future.exception()
+    if isinstance(exc, BrokenProcessPool):
+        _reset_executor(executor)
+    _wake.set()
+    if exc is not None:
+        logger.error(f"Job {job_id} worker failed: {exc}")
+        _update(job_id, status="failed", error=str(exc))
+
+
+class JobProgress:
+    """Handed to job functions so they can report their phase and row count."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def update(self, phase=None, rows=None):
+        fields = {}
+        if phase is not None:
+            fields["phase"] = phase
+        if rows is not None:
+            fields["rows_processed"] = rows
+        if fields:
+            _update(self.job_id, **fields)
+
+    def track(self, rows, every=10000):
+        """Pass an iterable through, reporting the running count every `every` items."""
+        count = 0
+        for count, row in enumerate(rows, start=1):
+            if count % every == 0:
+                self.update(rows=count)
+            yield row
+        self.update(rows=count)
+
+
+def _heartbeat(job_id, stop):
+    # renew the lease while the job runs, from its own process: a recycled web worker doesn't stop it
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            _update(job_id, lease_until=time.time() + JOB_LEASE_SECONDS)
+        except Exception:
+            logger.exception(f"Job {job_id} could not renew its lease")
+
+
+def run_job(job_id, kind, params):
+    """Entry point inside the pool process."""
+    # import the app first so blueprint modules resolve their `from app import db`
+    app_module = importlib.import_module("app")
+    app = app_module.app
+    module_name, func_name = JOB_KINDS[kind].split(":")
+    func = getattr(importlib.import_module(module_name), func_name)
+
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop), name="job-heartbeat", daemon=True).start()
+    _update(job_id, phase="starting", lease_until=time.time() + JOB_LEASE_SECONDS)
+    try:
+        with app.app_context():
+            ensure_schema(app_module.db.engine)
+            result = func(JobProgress(job_id), **params)
+    except Exception as e:
+        app.logger.exception(f"Job {job_id} ({kind}) failed")
+        _update(job_id, status="failed", error=str(e))
+        return
+    finally:
+        stop.set()
+    _update(job_id, status="done", phase="done", result=json.dumps(result, default=str))
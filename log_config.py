@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+# Logging is configured from the environment:
+#   LOG_LEVEL    root level (default INFO; DEBUG adds per-chunk progress)
+#   LOG_LEVELS   per-logger overrides, e.g. "bulk_load=DEBUG,werkzeug=WARNING"
+#   LOG_FORMAT   "text" (default) or "json" for one JSON object per line
+#   LOG_ROW_SAMPLES  per-row diagnostics logged per upload before the rest are only counted
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+ROW_SAMPLE_LIMIT = int(os.getenv("LOG_ROW_SAMPLES", "5"))
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+# attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any fields passed with `extra=`."""
+
+    def format(self, record):
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS})
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging():
+    """Set up the root handler and levels from LOG_LEVEL, LOG_LEVELS and LOG_FORMAT."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[handler], force=True)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+class RowSampler:
+    """
+    Per-row diagnostics for one upload: the first `limit` are logged, the
+    rest only counted, so a bad sheet can't flood the log.
+    """
+
+    def __init__(self, logger, limit=ROW_SAMPLE_LIMIT, level=logging.WARNING):
+        self.logger = logger
+        self.limit = limit
+        self.level = level
+        self.seen = 0
+
+    @property
+    def full(self):
+        """True once nothing more would be logged; callers can skip building messages."""
+        return self.seen >= self.limit or not self.logger.isEnabledFor(self.level)
+
+    def log(self, msg, *args):
+        self.seen += 1
+        if self.seen <= self.limit:
+            self.logger.log(self.level, msg, *args)
+
+    def skip(self, n):
+        """Count `n` diagnostics that were not built because the sampler was full."""
+        self.seen += n
+
+    @property
+    def suppressed(self):
+        return max(self.seen - self.limit, 0)
+
+
+class UploadLog:
+    """
+    Timings and counts for one upload, emitted as a single summary record
+    ("<kind> upload finished ...") with the numbers also under extra["upload"].
+    """
+
+    def __init__(self, logger, kind, **fields):
+        self.logger = logger
+        self.kind = kind
+        self.fields = fields
+        self.phases = {}
+        self.start = time.perf_counter()
+        self.rows = RowSampler(logger)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, **counts):
+        elapsed = time.perf_counter() - self.start
+        summary = {**self.fields, **counts, "seconds": round(elapsed, 3)}
+        summary.update({f"{name}_seconds": round(seconds, 3) for name, seconds in self.phases.items()})
+        rows = counts.get("rows")
+        if rows and elapsed > 0:
+            summary["rows_per_second"] = round(rows / elapsed)
+        if self.rows.suppressed:
+            summary["diagnostics_suppressed"] = self.rows.suppressed
+        self.logger.info("%s upload finished: %s", self.kind,
+                         " ".join(f"{k}={v}" for k, v in summary.items()), extra={"upload": summary})
+        return summary
@@ -0,0 +1,232 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+import db_pool
+
+# Per-request instrumentation, exported in Prometheus text format on /metrics.
+# Metrics live in the worker process that served the request; with several
+# gunicorn workers each scrape sees the worker that answered it.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+# X-Profile reports are only returned when this is set (they expose code paths)
+PROFILING_ENABLED = os.getenv("ALLOW_PROFILING", "0") == "1"
+PROFILE_LINES = 60
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label tuple."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label_values, value):
+        counts, total = self.series.get(label_values, ([0] * len(self.buckets), [0.0, 0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        total[0] += value
+        total[1] += 1
+        self.series[label_values] = (counts, total)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, (total, count)) in sorted(self.series.items()):
+            labels = _labels(self.labels, label_values)
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value:g}")
+        return lines
+
+
+def _labels(names, values):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, escaped))
+
+
+_lock = threading.Lock()
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency, including streamed bodies.",
+                            ("endpoint", "method", "status"), LATENCY_BUCKETS)
+SQL_SECONDS = Histogram("http_request_sql_seconds", "Time spent executing SQL per request.",
+                        ("endpoint",), LATENCY_BUCKETS)
+SQL_STATEMENTS = Counter("http_request_sql_statements_total", "SQL statements executed.", ("endpoint",))
+ROWS_FETCHED = Counter("http_request_rows_fetched_total", "Rows read from the database.", ("endpoint",))
+ENCODE_SECONDS = Histogram("export_encode_seconds", "Time spent encoding export files.",
+                           ("endpoint", "format"), LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram("http_response_bytes", "Response body size.", ("endpoint",), BYTES_BUCKETS)
+METRICS = (REQUEST_SECONDS, SQL_SECONDS, SQL_STATEMENTS, ROWS_FETCHED, ENCODE_SECONDS, RESPONSE_BYTES)
+
+
+def _stats():
+    """The current request's counters, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get("request_stats")
+
+
+def add_rows(n, seconds=0.0):
+    """
+    Record `n` rows fetched by the current request from a server-side cursor
+    (whose rowcount is unknown at execute time), and the fetch round-trip time.
+    """
+    stats = _stats()
+    if stats is not None:
+        stats["rows"] += n
+        stats["sql_seconds"] += seconds
+        stats["fetch_seconds"] += seconds
+
+
+def fetch_seconds():
+    """Server-side cursor fetch time of the current request so far."""
+    stats = _stats()
+    return stats["fetch_seconds"] if stats is not None else 0.0
+
+
+def record_encode(fmt, seconds):
+    """Record time spent encoding an export file for the current request."""
+    stats = _stats()
+    if stats is not None:
+        with _lock:
+            ENCODE_SECONDS.observe((stats["endpoint"], fmt), seconds)
+
+
+def instrument_engine(engine):
+    """Time every cursor execution and count statements and SELECT rows for the current request."""
+    # the start time lives on the statement's execution context: after_cursor_execute
+    # never runs for a statement that raises, so nothing must be left to pop
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_start", None)
+        stats = _stats()
+        if start is None or stats is None:
+            return
+        elapsed = time.perf_counter() - start
+        stats["sql_seconds"] += elapsed
+        stats["sql_statements"] += 1
+        # server-side cursors report -1 here; query_rows counts those through add_rows
+        if cursor.rowcount > 0 and statement.lstrip()[:6].upper() in ("SELECT", "WITH"):
+            stats["rows"] += cursor.rowcount
+
+
+def _count_bytes(body, stats):
+    try:
+        for chunk in body:
+            stats["bytes"] += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+def _finish(stats, status):
+    elapsed = time.perf_counter() - stats["start"]
+    endpoint = (stats["endpoint"],)
+    with _lock:
+        REQUEST_SECONDS.observe((stats["endpoint"], stats["method"], status), elapsed)
+        SQL_SECONDS.observe(endpoint, stats["sql_seconds"])
+        SQL_STATEMENTS.inc(endpoint, stats["sql_statements"])
+        ROWS_FETCHED.inc(endpoint, stats["rows"])
+        RESPONSE_BYTES.observe(endpoint, stats["bytes"])
+
+
+def _before_request():
+    g.request_stats = {
+        "start": time.perf_counter(), "endpoint": request.endpoint or "unmatched", "method": request.method,
+        "sql_seconds": 0.0, "fetch_seconds": 0.0, "sql_statements": 0, "rows": 0, "bytes": 0,
+    }
+    if PROFILING_ENABLED and request.headers.get("X-Profile"):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    stats = g.get("request_stats")
+    if stats is None:
+        return response
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        return _profile_report(profiler, response, stats)
+
+    status = str(response.status_code)
+    if response.is_streamed or response.content_length is None:
+        # streamed bodies (CSV exports, temp-file xlsx) are produced after this hook returns
+        response.response = _count_bytes(response.response, stats)
+        response.direct_passthrough = False
+    else:
+        stats["bytes"] = response.content_length
+    response.call_on_close(lambda: _finish(stats, status))
+    return response
+
+
+def _profile_report(profiler, response, stats):
+    """Consume the response body under the profiler and return the profile instead."""
+    response.direct_passthrough = False
+    body_bytes = len(response.get_data())
+    profiler.disable()
+    out = io.StringIO()
+    out.write(f"{request.method} {request.full_path} -> {response.status_code}, {body_bytes} bytes, "
+              f"{(time.perf_counter() - stats['start']) * 1000:.1f}ms, "
+              f"{stats['sql_statements']} SQL statements in {stats['sql_seconds'] * 1000:.1f}ms, "
+              f"{stats['rows']} rows\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    response.close()
+    return Response(out.getvalue(), mimetype="text/plain")
+
+
+def render(engine):
+    """Prometheus text exposition of all metrics plus this worker's pool stats."""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    for name, value in db_pool.pool_stats(engine).items():
+        if isinstance(value, (int, float)) and name != "pid":
+            lines.append(f"# TYPE db_pool_{name} gauge")
+            lines.append(f"db_pool_{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app, db):
+    """Install the request hooks and the /metrics route on `app`."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    def metrics_view():
+        return Response(render(db.engine), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
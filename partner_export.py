@@ -0,0 +1,189 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Per-partner voice ratecards: one file per TADIG code, cut from the
+# precomputed voice_ratecard table. Zip exports hand batches of partners to a
+# process pool; every worker reads its batch under the same exported snapshot,
+# so all files in one zip come from the same voice_ratecard contents.
+PARTNER_WORKERS = int(os.getenv("PARTNER_WORKERS", min(4, os.cpu_count() or 1)))
+# partners per worker task
+PARTNER_BATCH = int(os.getenv("PARTNER_BATCH", 20))
+
+TARIFF_PREFIX = "CELC_IR_VOICE_TARIFF_"
+TADIG_RE = re.compile(r"^[A-Za-z0-9]{3,16}$")
+SNAPSHOT_RE = re.compile(r"^[0-9A-F-]+$")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def tariff_pattern(tadig):
+    """LIKE pattern matching the tariff_name of one partner, whatever its date suffix."""
+    return (TARIFF_PREFIX + tadig + "_").replace("_", "\\_") + "%"
+
+
+def tadig_of(tariff_name):
+    return tariff_name[len(TARIFF_PREFIX):].rsplit("_", 1)[0]
+
+
+def batch_sql(columns, table):
+    return f"""
+SELECT {", ".join(columns)}
+FROM {table}
+WHERE tariff_name LIKE ANY(:patterns)
+ORDER BY row_no;
+"""
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: workers must not inherit the web worker's DB connections
+            _executor = ProcessPoolExecutor(max_workers=PARTNER_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _reset_executor(broken):
+    """Drop a pool that lost a process (BrokenProcessPool); the next _get_executor starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is not broken:
+            return
+        _executor = None
+    logger.warning("Partner export pool is broken, starting a new one")
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_batches(tadigs, fmt, out_dir, snapshot):
+    """Submit one write_partner_batch per PARTNER_BATCH partners. Returns (executor, futures)."""
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            return executor, [
+                executor.submit(write_partner_batch, tadigs[i:i + PARTNER_BATCH], fmt, out_dir, snapshot)
+                for i in range(0, len(tadigs), PARTNER_BATCH)
+            ]
+        except BrokenProcessPool:
+            # a worker died during an earlier export; retry once on a fresh pool
+            _reset_executor(executor)
+            if attempt:
+                raise
+
+
+def write_partner_batch(tadigs, fmt, out_dir, snapshot=None):
+    """
+    Pool entry point: write one ratecard file per partner in `tadigs` into
+    out_dir, holding all its tariff periods in row_no order like the single
+    partner download. Returns [(tadig, path, rows)] for the partners that
+    have rows.
+    """
+    if snapshot and not SNAPSHOT_RE.match(snapshot):
+        raise ValueError(f"Invalid snapshot id: {snapshot!r}")
+    # import the app first so blueprint modules resolve their `from app import db`
+    app_module = importlib.import_module("app")
+    from app_download_ratecards import VOICE_COLUMNS, VOICE_RATECARD_TABLE
+    from ratecard_export import iter_csv, write_xlsx
+
+    written = []
+    with app_module.app.app_context():
+        with app_module.db.engine.connect() as conn:
+            if snapshot:
+                conn = conn.execution_options(isolation_level="REPEATABLE READ")
+            with conn.begin():
+                if snapshot:
+                    conn.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}';"))
+                result = conn.execution_options(stream_results=True).execute(
+                    text(batch_sql(VOICE_COLUMNS, VOICE_RATECARD_TABLE)),
+                    {"patterns": [tariff_pattern(t) for t in tadigs]},
+                )
+                tariff_col = VOICE_COLUMNS.index("tariff_name")
+                # a partner has a tariff_name per period, and its periods need
+                # not be adjacent in row_no order; one card is small (template
+                # rows x branches x periods)
+                partners = {}
+                for row in result:
+                    partners.setdefault(tadig_of(row[tariff_col]), []).append(row)
+                for tadig, rows in partners.items():
+                    path = os.path.join(out_dir, f"ratecard_{tadig}.{fmt}")
+                    if fmt == "csv":
+                        with open(path, "wb") as fh:
+                            for chunk in iter_csv(VOICE_COLUMNS, rows):
+                                fh.write(chunk)
+                    else:
+                        write_xlsx(path, VOICE_COLUMNS, rows, sheet_name="Ratecard")
+                    written.append((tadig, path, len(rows)))
+    return written
+
+
+class _ZipStream:
+    """Write-only, unseekable file object for ZipFile that hands out what was written so far."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_partner_zip(tadigs, fmt, snapshot=None, on_close=None):
+    """
+    Yield a zip archive of per-partner ratecards, chunk by chunk, as the
+    pool finishes each batch. Temp files are removed as soon as they are
+    zipped; pending batches are cancelled if the client goes away.
+    """
+    out_dir = tempfile.mkdtemp(prefix="partner-ratecards-")
+    executor, futures = None, []
+    try:
+        executor, futures = _submit_batches(tadigs, fmt, out_dir, snapshot)
+        stream = _ZipStream()
+        files = 0
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for future in as_completed(futures):
+                for tadig, path, _ in future.result():
+                    # xlsx is already deflated; store it as is
+                    archive.write(path, os.path.basename(path),
+                                  compress_type=zipfile.ZIP_STORED if fmt == "xlsx" else None)
+                    os.remove(path)
+                    files += 1
+                    yield stream.take()
+        yield stream.take()
+        logger.info(f"Partner ratecard zip: {files} files for {len(tadigs)} requested partners")
+    except BrokenProcessPool:
+        # this export is lost, but the next one gets a working pool
+        _reset_executor(executor)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if on_close:
+            on_close()
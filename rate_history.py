@@ -0,0 +1,153 @@
+import re
+from datetime import date
+
+from sqlalchemy import text
+
+from ratesheet_schema import COLUMN_MAPPING, INTERVAL_COLUMNS, sql_type
+from upload_hooks import before_commit
+
+# Every committed state of ratesheet_v2, kept as effective-dated rows. Each
+# commit that changes ratesheet_v2 appends the rows whose content differs from
+# the latest recorded version of the same (tadig_plmn_code, start_date)
+# period, so unchanged periods cost nothing, and a deleted row for every
+# period that is no longer in ratesheet_v2 (removed, or re-dated under another
+# start_date). The latest version of a period is its current one; deleted
+# periods are never in effect. A period is in effect from its start_date
+# (always, when NULL) to its end_date (open-ended when NULL); for one date the
+# latest period that has started wins.
+HISTORY_TABLE = "ratesheet_history"
+HISTORY_FIELDS = list(COLUMN_MAPPING.values()) + INTERVAL_COLUMNS
+# content_hash of the rows recording a deletion
+DELETED_HASH = "0" * 32
+
+_field_ddl = ",\n    ".join(f"{field} {sql_type(field)}" for field in HISTORY_FIELDS)
+CREATE_HISTORY = f"""
+CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+    history_id BIGSERIAL PRIMARY KEY,
+    recorded_version BIGINT NOT NULL,
+    recorded_at TIMESTAMP NOT NULL DEFAULT now(),
+    content_hash CHAR(32) NOT NULL,
+    deleted BOOLEAN NOT NULL DEFAULT false,
+    {_field_ddl}
+);
+"""
+# for histories created before deletions were recorded
+ADD_DELETED_COLUMN = f"ALTER TABLE {HISTORY_TABLE} ADD COLUMN IF NOT EXISTS deleted BOOLEAN NOT NULL DEFAULT false;"
+# (tadig, start_date, history_id): "TADIG X as of D" is one backward index
+# seek, and the latest version of every period is an ordered scan
+HISTORY_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS {HISTORY_TABLE}_as_of_idx "
+    f"ON {HISTORY_TABLE} (tadig_plmn_code, start_date, history_id);",
+]
+
+_fields = ", ".join(HISTORY_FIELDS)
+_LATEST = f"""
+    SELECT DISTINCT ON (tadig_plmn_code, start_date) tadig_plmn_code, start_date, content_hash, deleted
+    FROM {HISTORY_TABLE}
+    ORDER BY tadig_plmn_code, start_date, history_id DESC
+"""
+_VERSION = "COALESCE((SELECT version FROM table_versions WHERE table_name = 'ratesheet_v2'), 0)"
+
+RECORD_HISTORY_SQL = f"""
+WITH latest AS ({_LATEST}),
+current_rows AS (
+    SELECT md5(ROW({_fields})::text) AS content_hash, {_fields}
+    FROM ratesheet_v2
+)
+INSERT INTO {HISTORY_TABLE} (recorded_version, content_hash, {_fields})
+SELECT {_VERSION}, c.content_hash, {", ".join(f"c.{field}" for field in HISTORY_FIELDS)}
+FROM current_rows c
+LEFT JOIN latest l
+  ON l.tadig_plmn_code IS NOT DISTINCT FROM c.tadig_plmn_code
+ AND l.start_date IS NOT DISTINCT FROM c.start_date
+WHERE l.content_hash IS DISTINCT FROM c.content_hash
+ORDER BY c.tadig_plmn_code, c.start_date;
+"""
+
+RECORD_DELETIONS_SQL = f"""
+WITH latest AS ({_LATEST})
+INSERT INTO {HISTORY_TABLE} (recorded_version, content_hash, deleted, tadig_plmn_code, start_date)
+SELECT {_VERSION}, '{DELETED_HASH}', true, l.tadig_plmn_code, l.start_date
+FROM latest l
+WHERE NOT l.deleted AND NOT EXISTS (
+    SELECT 1 FROM ratesheet_v2 c
+    WHERE c.tadig_plmn_code IS NOT DISTINCT FROM l.tadig_plmn_code
+      AND c.start_date IS NOT DISTINCT FROM l.start_date
+)
+ORDER BY l.tadig_plmn_code, l.start_date;
+"""
+
+
+def current_periods_sql(condition="TRUE"):
+    """
+    The current version (history_id and HISTORY_FIELDS) of every period
+    whose rows match `condition`, leaving out deleted periods.
+    """
+    return f"""
+SELECT history_id, {_fields}
+FROM (
+    SELECT DISTINCT ON (tadig_plmn_code, start_date) history_id, deleted, {_fields}
+    FROM {HISTORY_TABLE}
+    WHERE {condition}
+    ORDER BY tadig_plmn_code, start_date, history_id DESC
+) periods
+WHERE NOT deleted
+"""
+
+
+_IN_EFFECT = "(start_date IS NULL OR start_date <= :as_of) AND (end_date IS NULL OR end_date >= :as_of)"
+
+# The rates in effect on :as_of, one row per partner, shaped like ratesheet_v2
+# (history_id stands in for id, so "ORDER BY id" keeps upload order).
+RATES_AS_OF_SQL = f"""
+SELECT DISTINCT ON (tadig_plmn_code) history_id AS id, {_fields}
+FROM ({current_periods_sql("start_date IS NULL OR start_date <= :as_of")}) current_periods
+WHERE {_IN_EFFECT}
+ORDER BY tadig_plmn_code, start_date DESC NULLS LAST, history_id DESC
+"""
+
+PARTNER_AS_OF_SQL = f"""
+SELECT history_id AS id, {_fields}
+FROM ({current_periods_sql("tadig_plmn_code = :tadig AND (start_date IS NULL OR start_date <= :as_of)")}) current_periods
+WHERE {_IN_EFFECT}
+ORDER BY start_date DESC NULLS LAST, history_id DESC
+LIMIT 1;
+"""
+
+AS_OF_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def parse_as_of(value):
+    """?as_of=YYYY-MM-DD as a date, None when absent. Raises ValueError otherwise."""
+    if not value:
+        return None
+    if not AS_OF_RE.match(value):
+        raise ValueError(f"as_of must be YYYY-MM-DD, got {value!r}")
+    return date.fromisoformat(value)
+
+
+def as_of_sql(sql):
+    """
+    Run a query written against ratesheet_v2 on the rates in effect on
+    :as_of instead: a CTE named ratesheet_v2 shadows the table everywhere in
+    the statement, subqueries included.
+    """
+    return f"WITH ratesheet_v2 AS ({RATES_AS_OF_SQL})\n{sql}"
+
+
+def record_history(session):
+    """Append the changed and deleted periods of ratesheet_v2 to the history. Returns rows recorded."""
+    return (session.execute(text(RECORD_DELETIONS_SQL)).rowcount
+            + session.execute(text(RECORD_HISTORY_SQL)).rowcount)
+
+
+@before_commit
+def _record_on_commit(session, tables):
+    if "ratesheet_v2" in tables and session.get_bind().dialect.name == "postgresql":
+        record_history(session)
+
+
+def partner_rates_as_of(session, tadig, as_of):
+    """The ratesheet row (as a mapping) in effect for one partner on `as_of`, or None."""
+    row = session.execute(text(PARTNER_AS_OF_SQL), {"tadig": tadig, "as_of": as_of}).mappings().first()
+    return dict(row) if row else None
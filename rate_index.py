@@ -0,0 +1,272 @@
+import logging
+import math
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+import reference_cache
+import voice_engine
+from charging_interval import SECONDS, parse
+from partner_export import TARIFF_PREFIX
+from rate_history import current_periods_sql
+from ratesheet_schema import interval_columns
+from table_versions import get_versions
+
+logger = logging.getLogger(__name__)
+
+# In-memory rate lookups for pricing single events. Partner rates are the
+# periods of ratesheet_history (every committed state of ratesheet_v2, see
+# rate_history) and the one in effect on a date is picked like
+# RATES_AS_OF_SQL; voice rates then go through the five branches of
+# voice_ratecard.SQL against template and country_v2 from
+# reference_cache. The index is rebuilt when any of the three tables changes
+# and is invalidated through reference_cache.watch, so while the listener is
+# up a lookup does no database work at all.
+INDEX_TABLES = ("ratesheet_v2", "template", "country_v2")
+SERVICES = ("voice", "sms", "gprs", "volte")
+
+# voice branches 1-4 take rate and charging interval from the partner: (source_order, rate, interval columns)
+PARTNER_BRANCHES = [
+    (source_order, rate, interval_columns(rule[:-len("_rounding_rule")] + "_charging_interval"))
+    for source_order, rate, rule in voice_engine.VOICE_BRANCHES[:4]
+]
+# service -> (rate column, interval columns, digits the export SQL rounds the rate to)
+DATA_SERVICES = {
+    "sms": ("mo_sms_rate_value", None, 8),
+    "gprs": ("gprs_rate_mb_rate_value", interval_columns("gprs_rate_mb_charging_interval"), None),
+    "volte": ("volte_rate_mb_rate_value", interval_columns("volte_rate_mb_charging_interval"), 8),
+}
+
+PERIOD_COLUMNS = ["history_id", "tadig_plmn_code", "start_date", "end_date"] + [
+    column for _, rate, intervals in PARTNER_BRANCHES for column in (rate, *intervals)
+] + [
+    column for rate, intervals, _ in DATA_SERVICES.values() for column in (rate, *(intervals or ()))
+]
+# the current version of every period (RATES_AS_OF_SQL); a period without a
+# start_date is in effect from the start (EARLIEST)
+PERIODS_SQL = f"""
+SELECT {", ".join(PERIOD_COLUMNS)}
+FROM ({current_periods_sql("tadig_plmn_code IS NOT NULL")}) current_periods;
+"""
+EARLIEST = date.min
+
+_lock = threading.Lock()
+_current = None
+_stale = True
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return float(value)
+
+
+def _rounded(value, digits):
+    value = _number(value)
+    return round(value, digits) if value is not None and digits else value
+
+
+class VoiceTemplate:
+    """
+    The template side of the voice branches, per reference version: template
+    rows by lookup key, branch flags and ORDER BY ranks as plain lists.
+    """
+
+    def __init__(self, reference):
+        data = voice_engine.for_reference(reference)
+        columns = data.columns
+        self.destination = columns["destination"].tolist()
+        self.area_code = columns["area_code"].tolist()
+        self.calls_type = columns["calls_type"].tolist()
+        self.rate = data.rate.tolist()
+        self.setup_rate = data.setup_rate.tolist()
+        self.rounding = data.rounding.tolist()
+        self.intervals = [parse(value, SECONDS) for value in self.rounding]
+        self.national = set(data.national.tolist())
+        self.mtc = set(data.mtc.tolist())
+        self.misc = set(data.misc.tolist())
+        self.row = set(data.is_row.nonzero()[0].tolist())
+        self.rank = {source_order: rank.tolist() for source_order, rank in data.rank.items()}
+        self.by_key, self.by_destination, self.by_calls_type = {}, {}, {}
+        for position, (destination, calls_type) in enumerate(zip(self.destination, self.calls_type)):
+            self.by_key.setdefault((destination, calls_type), []).append(position)
+            self.by_destination.setdefault(destination, []).append(position)
+            self.by_calls_type.setdefault(calls_type, []).append(position)
+
+    def _branches(self, position, custom_names):
+        """source_order of every branch that emits this template row for a partner."""
+        destination = self.destination[position]
+        if position in self.national:
+            yield 1
+        if isinstance(destination, str):
+            if any(destination == name for name in custom_names):
+                yield 2
+            if position in self.row and any(isinstance(name, str) and destination != name for name in custom_names):
+                yield 3
+        if position in self.mtc:
+            yield 4
+        if position in self.misc:
+            yield 5
+
+    def select(self, period, custom_names, destination=None, calls_type=None, area_code=None):
+        """
+        The first row of the partner's voice ratecard (VOICE_ORDER_BY) with
+        this destination / calls_type / area_code, as a dict, or None.
+        `custom_names` are the country_v2 names of the partner's prefix.
+        """
+        if destination is not None and calls_type is not None:
+            positions = self.by_key.get((destination, calls_type), ())
+        elif destination is not None:
+            positions = self.by_destination.get(destination, ())
+        else:
+            positions = self.by_calls_type.get(calls_type, ())
+        best = None
+        for position in positions:
+            if area_code is not None and self.area_code[position] != area_code:
+                continue
+            for source_order in self._branches(position, custom_names):
+                # within one partner and branch, the template rank decides (it includes the rate for branch 5)
+                key = (source_order, self.rank[source_order][position])
+                if best is None or key < best[0]:
+                    best = (key, position)
+        if best is None:
+            return None
+        (source_order, _), position = best
+        if source_order == 5:
+            rate, rule = self.rate[position], self.rounding[position]
+            initial, step = self.intervals[position] or (None, None)
+        else:
+            _, rate_column, (rule_column, initial_column, step_column) = PARTNER_BRANCHES[source_order - 1]
+            rate, rule = period[rate_column], period[rule_column]
+            initial, step = period[initial_column], period[step_column]
+        return {
+            "destination": self.destination[position],
+            "area_code": self.area_code[position],
+            "calls_type": self.calls_type[position],
+            "rate": _number(rate),
+            "setup_rate": _number(self.setup_rate[position]),
+            "rounding_rule": rule,
+            "interval_initial": initial,
+            "interval_step": step,
+            "source_order": source_order,
+        }
+
+
+class RateIndex:
+    """
+    Partner rate periods by TADIG code plus the voice template, for one
+    version of ratesheet_v2, template and country_v2. Shared by every request
+    of the worker: read-only once built.
+    """
+
+    def __init__(self, versions, periods, reference):
+        self.versions = versions
+        self.loaded_at = time.time()
+        self.custom_names = reference.custom_names
+        self.voice = reference.derived("rate_index", VoiceTemplate)
+        # tadig -> periods (dicts of PERIOD_COLUMNS), latest start_date first, then latest upload
+        self.periods = {}
+        for period in periods:
+            self.periods.setdefault(period["tadig_plmn_code"], []).append(period)
+        for partner in self.periods.values():
+            partner.sort(key=lambda period: (period["start_date"] or EARLIEST, period["history_id"]), reverse=True)
+        self.size = sum(len(partner) for partner in self.periods.values())
+
+    def period(self, tadig, as_of):
+        """The period of `tadig` in effect on `as_of`, or None."""
+        for period in self.periods.get(tadig, ()):
+            if ((period["start_date"] or EARLIEST) <= as_of
+                    and (period["end_date"] is None or period["end_date"] >= as_of)):
+                return period
+        return None
+
+    def lookup(self, tadig, service, as_of, destination=None, calls_type=None, area_code=None):
+        """
+        Rate, charging interval and tariff of one event as a dict. Raises
+        ValueError for an invalid request and LookupError when the partner has
+        no rates in effect on `as_of` or no ratecard row matches.
+        """
+        if service not in SERVICES:
+            raise ValueError(f"service must be one of {', '.join(SERVICES)}, got {service!r}")
+        if service == "voice" and destination is None and calls_type is None:
+            raise ValueError("voice lookups need a destination or a calls_type")
+        period = self.period(tadig, as_of)
+        if period is None:
+            raise LookupError(f"No rates for {tadig} in effect on {as_of}")
+        result = {
+            "tadig_plmn_code": tadig,
+            "service": service,
+            "as_of": as_of.isoformat(),
+            "valid_from": period["start_date"].isoformat() if period["start_date"] else None,
+            "tariff_name": None,
+        }
+        if service == "voice":
+            # the voice ratecard only has partners whose prefix is in country_v2
+            custom_names = self.custom_names.get(tadig[:3])
+            if custom_names is None:
+                raise LookupError(f"No voice ratecard for {tadig}: {tadig[:3]} is not in country_v2")
+            row = self.voice.select(period, custom_names, destination, calls_type, area_code)
+            if row is None:
+                raise LookupError(f"No voice rate for {tadig} to {destination or calls_type} on {as_of}")
+            tariff_date = (f"{period['start_date']:%Y%m%d}" if period["start_date"]
+                           else voice_engine.DEFAULT_TARIFF_DATE)
+            result.update(row, tariff_name=f"{TARIFF_PREFIX}{tadig}_{tariff_date}")
+            return result
+        rate_column, intervals, digits = DATA_SERVICES[service]
+        rule, initial, step = (period[column] for column in intervals) if intervals else (None, None, None)
+        # the SMS ratecard carries its price as the setup rate
+        rate = _rounded(period[rate_column], digits)
+        result.update(rate=0.0 if service == "sms" else rate, setup_rate=rate if service == "sms" else None,
+                      rounding_rule=rule, interval_initial=initial, interval_step=step)
+        return result
+
+
+def invalidate():
+    global _stale
+    with _lock:
+        _stale = True
+
+
+reference_cache.watch(INDEX_TABLES, invalidate)
+
+
+def read_periods(session):
+    return [dict(row) for row in session.execute(text(PERIODS_SQL)).mappings()]
+
+
+def get(session):
+    """The current RateIndex, rebuilt only when ratesheet_v2, template or country_v2 changed."""
+    global _current, _stale
+    with _lock:
+        current = _current
+        if current is not None and not _stale and reference_cache.listening():
+            return current
+        # cleared before reading versions, so a change from here on marks it stale again
+        _stale = False
+    reference = reference_cache.get(session)
+    versions = {**get_versions(session, ["ratesheet_v2"]), **reference.versions}
+    if current is not None and current.versions == versions:
+        return current
+    start = time.perf_counter()
+    index = RateIndex(versions, read_periods(session), reference)
+    logger.info(f"Built rate index {versions}: {index.size} periods of {len(index.periods)} partners "
+                f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+    with _lock:
+        if _current is None or _current.versions != versions:
+            _current = index
+        return _current
+
+
+def status():
+    """Index state of this worker, for /admin/rate-index."""
+    current = _current
+    return {
+        "versions": current.versions if current else None,
+        "loaded_at": current.loaded_at if current else None,
+        "partners": len(current.periods) if current else None,
+        "periods": current.size if current else None,
+        "stale": _stale,
+        "listening": reference_cache.listening(),
+    }
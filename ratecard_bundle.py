@@ -0,0 +1,179 @@
+import math
+import os
+import tempfile
+import zipfile
+from decimal import Decimal
+from functools import partial
+
+import pandas as pd
+import xlsxwriter
+
+import reference_cache
+import snapshots
+from rate_history import as_of_sql
+from ratecard_export import DATE_FORMAT, iter_csv, write_sheet
+from reference_cache import collation_ranks, read_frame
+from voice_engine import expand, for_reference
+
+# Every service ratecard derived from one read of ratesheet_v2 (plus the small
+# template and country_v2 tables, from reference_cache), instead of one full
+# scan per endpoint.
+# Each *_frame function reproduces the SQL of the matching download module;
+# the voice card is voice_engine.expand.
+
+# Columns of ratesheet_v2 the four ratecards need.
+RATESHEET_COLUMNS = [
+    "tadig_plmn_code", "start_date",
+    "mo_sms_rate_value",
+    "gprs_rate_mb_rate_value", "gprs_rate_mb_rounding_rule",
+    "volte_rate_mb_rate_value", "volte_rate_mb_rounding_rule",
+    "moc_call_local_call_rate_value", "moc_call_local_call_rounding_rule",
+    "moc_call_call_back_home_rate_value", "moc_call_call_back_home_rounding_rule",
+    "moc_call_rest_of_the_world_rate_value", "moc_call_rest_of_the_world_rounding_rule",
+    "mtc_call_rate_value", "mtc_call_rounding_rule",
+]
+RATESHEET_SQL = f"SELECT {', '.join(RATESHEET_COLUMNS)} FROM ratesheet_v2 ORDER BY id;"
+
+# (file name, sheet name, column formats) in bundle order
+SHEETS = [
+    ("ratecard_national", "Voice", None),
+    ("sms_ratecard", "SMS", None),
+    ("gprs_ratecard", "GPRS", None),
+    ("volte_ratecard", "VoLTE", {'Valid From': (15, 'dd-mmm-yy')}),
+]
+
+
+def read_sources(session, as_of=None):
+    """
+    The one scan of ratesheet_v2 (or its snapshot, or the rates in effect
+    on `as_of`) as a DataFrame, plus the cached template and country_v2 (a
+    reference_cache.Reference): (rs, reference). Rate columns are float64
+    even when every value is NULL.
+    """
+    if as_of:
+        rs = read_frame(session, as_of_sql(RATESHEET_SQL), {"as_of": as_of})
+    else:
+        rs = snapshots.current_frame(session, "ratesheet_v2", RATESHEET_COLUMNS)
+        if rs is None:
+            rs = read_frame(session, RATESHEET_SQL)
+    for column in rs.columns:
+        if column.endswith("_rate_value"):
+            rs[column] = rs[column].astype("float64")
+    return rs, reference_cache.get(session)
+
+
+def _suffixed(codes, suffix):
+    # NULL || suffix is NULL
+    return codes.str.cat(pd.Series(suffix, index=codes.index))
+
+
+def sms_frame(rs):
+    """SQL_SMS: a -NAT and an -INT row per ratesheet row."""
+    parts = []
+    for suffix in ("-NAT", "-INT"):
+        code = _suffixed(rs.tadig_plmn_code, suffix)
+        parts.append(pd.DataFrame({
+            "Destination": code,
+            "Area Code": code,
+            "Setup Rate": rs.mo_sms_rate_value.round(8),
+            "Valid From": rs.start_date,
+            "Rate": 0.0,
+        }))
+    return pd.concat(parts).sort_index(kind="stable").reset_index(drop=True)
+
+
+def _data_frame(rs, rate, rounding_rule, digits=None):
+    rates = rs[rate].round(digits) if digits else rs[rate]
+    return pd.DataFrame({
+        "Destination": rs.tadig_plmn_code,
+        "Area Code": rs.tadig_plmn_code,
+        "Rate": rates,
+        "Valid From": rs.start_date,
+        "rounding_rules": rs[rounding_rule],
+    }).reset_index(drop=True)
+
+
+def gprs_frame(rs):
+    """SQL_GPRS."""
+    return _data_frame(rs, "gprs_rate_mb_rate_value", "gprs_rate_mb_rounding_rule")
+
+
+def volte_frame(rs):
+    """SQL_VOLTE (rate as numeric(12,8))."""
+    return _data_frame(rs, "volte_rate_mb_rate_value", "volte_rate_mb_rounding_rule", digits=8)
+
+
+def voice_frame(rs, reference, collate=None):
+    """VOICE_ROWS_SQL ordered by VOICE_ORDER_BY, generated by voice_engine (see expand for `collate`)."""
+    return expand(rs, for_reference(reference), collate)
+
+
+def build_frames(rs, reference, collate=None):
+    """All four ratecards as {name: DataFrame}, in SHEETS order."""
+    return {
+        "ratecard_national": voice_frame(rs, reference, collate),
+        "sms_ratecard": sms_frame(rs),
+        "gprs_ratecard": gprs_frame(rs),
+        "volte_ratecard": volte_frame(rs),
+    }
+
+
+def read_frames(session, as_of=None):
+    """build_frames of read_sources, with the voice card in the database's string order."""
+    rs, reference = read_sources(session, as_of)
+    return build_frames(rs, reference, partial(collation_ranks, session))
+
+
+def frame_rows(frame):
+    """Row tuples with NaN/NaT turned into None."""
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+
+
+def write_workbook(path, frames):
+    """One workbook with a sheet per ratecard. Returns total rows written."""
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': DATE_FORMAT})
+    try:
+        return sum(
+            write_sheet(workbook, sheet_name, list(frames[name].columns), frame_rows(frames[name]), formats)
+            for name, sheet_name, formats in SHEETS
+        )
+    finally:
+        workbook.close()
+
+
+def write_zip(path, frames, fmt='xlsx'):
+    """A zip with one file per ratecard (xlsx or csv). Returns total rows written."""
+    total = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for name, sheet_name, formats in SHEETS:
+            frame = frames[name]
+            if fmt == 'csv':
+                with bundle.open(f'{name}.csv', 'w') as member:
+                    for chunk in iter_csv(list(frame.columns), frame_rows(frame)):
+                        member.write(chunk)
+                total += len(frame)
+                continue
+            # xlsx is already deflated; store it as is
+            fd, tmp = tempfile.mkstemp(suffix='.xlsx')
+            os.close(fd)
+            try:
+                workbook = xlsxwriter.Workbook(tmp, {'constant_memory': True, 'default_date_format': DATE_FORMAT})
+                try:
+                    total += write_sheet(workbook, sheet_name, list(frame.columns), frame_rows(frame), formats)
+                finally:
+                    workbook.close()
+                bundle.write(tmp, f'{name}.xlsx', compress_type=zipfile.ZIP_STORED)
+            finally:
+                os.remove(tmp)
+    return total
+
+
+def normalize(value):
+    """Comparable form of one cell from SQL or a frame (Decimal/float rounded, NaN as None)."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (Decimal, float)):
+        return round(float(value), 8)
+    if hasattr(value, "item"):
+        return normalize(value.item())
+    return value
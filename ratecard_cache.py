@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# Generated ratecard files, stored on local disk under a key derived from the
+# export settings and the versions of the tables it was built from.
+CACHE_DIR = os.getenv("RATECARD_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ratecard-cache"))
+CACHE_MAX_BYTES = int(os.getenv("RATECARD_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+_lock = threading.Lock()
+
+
+def make_key(export, fmt, versions, **options):
+    """
+    Content address for one generated file: a sha256 over the export name,
+    format, table versions and any options that change the output.
+    """
+    payload = json.dumps(
+        {"export": export, "format": fmt, "versions": versions, "options": options},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _path(key, fmt):
+    return os.path.join(CACHE_DIR, f"{key}.{fmt}")
+
+
+def get(key, fmt):
+    """
+    Return the path of a cached file, or None. A hit refreshes the file's
+    mtime, which is what LRU eviction orders by.
+    """
+    path = _path(key, fmt)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def new_temp_path(fmt):
+    """A temp file inside the cache dir, so put() can move it in atomically."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.part", dir=CACHE_DIR)
+    os.close(fd)
+    return path
+
+
+def put(key, fmt, src_path):
+    """Move a finished file into the cache under `key` and evict down to CACHE_MAX_BYTES."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _path(key, fmt)
+    os.replace(src_path, path)
+    evict()
+    return path
+
+
+def evict(max_bytes=None):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _lock:
+        entries = []
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith(".part"):
+                continue
+            try:
+                st = os.stat(os.path.join(CACHE_DIR, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,250 @@
+import csv
+import io
+import math
+import os
+import tempfile
+import time
+
+import xlsxwriter
+from flask import Response, request, send_file, stream_with_context
+from sqlalchemy import text
+
+import metrics
+import ratecard_cache
+from app import db
+from table_versions import get_versions
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv'
+ZIP_MIMETYPE = 'application/zip'
+MIMETYPES = {'xlsx': XLSX_MIMETYPE, 'csv': CSV_MIMETYPE, 'zip': ZIP_MIMETYPE}
+EXPORT_FORMATS = ('xlsx', 'csv')
+
+# Rows pulled from the server-side cursor per round trip.
+FETCH_ROWS = 2000
+# Bytes per chunk when streaming the finished workbook to the client.
+STREAM_CHUNK = 64 * 1024
+
+# Same look as the pandas/xlsxwriter output the handlers used to produce.
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+DATE_FORMAT = 'yyyy-mm-dd'
+
+
+def query_rows(sql, params=None):
+    """
+    Execute `sql` with a server-side cursor. Returns (column names, row
+    iterator); rows are fetched FETCH_ROWS at a time while iterating.
+    """
+    result = db.session.execute(text(sql), params or {}, execution_options={"stream_results": True})
+    return list(result.keys()), _iter_result(result)
+
+
+def _iter_result(result):
+    partitions = result.partitions(FETCH_ROWS)
+    while True:
+        start = time.perf_counter()
+        partition = next(partitions, None)
+        if partition is None:
+            return
+        metrics.add_rows(len(partition), time.perf_counter() - start)
+        yield from partition
+
+
+def write_xlsx(target, columns, rows, sheet_name='Sheet1', column_formats=None):
+    """
+    Write rows into a single-sheet workbook at `target` (path or binary file)
+    in xlsxwriter constant_memory mode, so each row is flushed as it is
+    written. `column_formats` maps a column name to (width, num_format).
+    Returns the number of data rows written.
+    """
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'default_date_format': DATE_FORMAT})
+    try:
+        return write_sheet(workbook, sheet_name, columns, rows, column_formats)
+    finally:
+        workbook.close()
+
+
+def write_sheet(workbook, sheet_name, columns, rows, column_formats=None):
+    """Add one sheet of rows to an open workbook. Returns the number of data rows."""
+    worksheet = workbook.add_worksheet(sheet_name)
+    header = workbook.add_format(HEADER_FORMAT)
+    cell_formats = {}
+    for name, (width, num_format) in (column_formats or {}).items():
+        if name in columns:
+            idx = columns.index(name)
+            cell_formats[idx] = workbook.add_format({'num_format': num_format})
+            worksheet.set_column(idx, idx, width, cell_formats[idx])
+
+    for col, name in enumerate(columns):
+        worksheet.write(0, col, name, header)
+
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        for col, value in enumerate(row):
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            worksheet.write(count, col, value, cell_formats.get(col))
+    return count
+
+
+def iter_csv(columns, rows):
+    """Yield UTF-8 encoded CSV chunks, one per FETCH_ROWS rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if i % FETCH_ROWS == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def _iter_file(path):
+    try:
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(STREAM_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def _tee_to_cache(chunks, key, fmt):
+    """Pass chunks through while also writing them to a cache entry, kept only if complete."""
+    tmp = ratecard_cache.new_temp_path(fmt)
+    complete = False
+    try:
+        with open(tmp, 'wb') as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            ratecard_cache.put(key, fmt, tmp)
+        else:
+            os.remove(tmp)
+
+
+def _send_cached(path, basename, fmt, key):
+    response = send_file(
+        path,
+        mimetype=MIMETYPES[fmt],
+        as_attachment=True,
+        download_name=f'{basename}.{fmt}',
+        etag=key,
+        conditional=True,
+    )
+    # let clients keep the file but revalidate with If-None-Match every time
+    response.cache_control.no_cache = True
+    return response
+
+
+def _cache_lookup(basename, fmt, cache_tables, logger, **key_options):
+    """
+    Cache key for an export plus a ready response when it can be answered
+    without building the file (304 or cached copy). Returns (key, response).
+    """
+    if not cache_tables:
+        return None, None
+    versions = get_versions(db.session, cache_tables)
+    key = ratecard_cache.make_key(basename, fmt, versions, **key_options)
+    if key in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(key)
+        return key, response
+    path = ratecard_cache.get(key, fmt)
+    if path:
+        if logger:
+            logger.debug(f"Serving {basename}.{fmt} from cache {key[:12]}")
+        return key, _send_cached(path, basename, fmt, key)
+    return key, None
+
+
+def _build_and_send(build, basename, fmt, key):
+    """Run build(path) into a temp (or cache) file and send it as a download."""
+    if key:
+        path = ratecard_cache.new_temp_path(fmt)
+    else:
+        fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+        os.close(fd)
+    try:
+        build(path)
+    except Exception:
+        os.remove(path)
+        raise
+    if key:
+        return _send_cached(ratecard_cache.put(key, fmt, path), basename, fmt, key)
+    return Response(
+        _iter_file(path),
+        mimetype=MIMETYPES[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{basename}.{fmt}"',
+            'Content-Length': str(os.path.getsize(path)),
+        },
+    )
+
+
+def file_export(build, basename, fmt, cache_tables=None, logger=None, **key_options):
+    """
+    Download response for a file written by build(path), e.g. a multi-sheet
+    workbook or a zip. Cached and ETagged like stream_export when
+    `cache_tables` is given; `key_options` must cover every input that
+    changes the output.
+    """
+    key, response = _cache_lookup(basename, fmt, cache_tables, logger, **key_options)
+    if response is not None:
+        return response
+    return _build_and_send(build, basename, fmt, key)
+
+
+def stream_export(sql, basename, fmt='xlsx', params=None, sheet_name='Sheet1', column_formats=None,
+                  cache_tables=None, logger=None):
+    """
+    Build a streaming download response for `sql`.
+
+    fmt='csv' streams rows straight from the server-side cursor, so the first
+    bytes go out as soon as the query starts returning. fmt='xlsx' encodes
+    the workbook into a temp file in constant_memory mode (xlsx is a zip and
+    can only be finished once every row is known), then streams that file.
+    Either way, no full result set, DataFrame or in-memory workbook is held.
+
+    With `cache_tables`, the generated file is stored in ratecard_cache under
+    a key built from the versions of those tables; the key doubles as the
+    ETag, so repeat downloads are answered from disk or with a 304.
+    """
+    if fmt not in EXPORT_FORMATS:
+        fmt = 'xlsx'
+    key, response = _cache_lookup(basename, fmt, cache_tables, logger, sql=sql, params=params,
+                                  sheet_name=sheet_name, column_formats=column_formats)
+    if response is not None:
+        return response
+
+    columns, rows = query_rows(sql, params)
+
+    if fmt == 'csv':
+        chunks = iter_csv(columns, rows)
+        if key:
+            chunks = _tee_to_cache(chunks, key, fmt)
+        response = Response(
+            stream_with_context(chunks),
+            mimetype=CSV_MIMETYPE,
+            headers={'Content-Disposition': f'attachment; filename="{basename}.csv"'},
+        )
+        if key:
+            response.set_etag(key)
+        return response
+
+    def build(path):
+        start, fetched = time.perf_counter(), metrics.fetch_seconds()
+        count = write_xlsx(path, columns, rows, sheet_name, column_formats)
+        # rows are pulled from the cursor while encoding; leave that time to the SQL metric
+        metrics.record_encode('xlsx', time.perf_counter() - start - (metrics.fetch_seconds() - fetched))
+        if logger:
+            logger.debug(f"Wrote {count} rows to {basename}.xlsx")
+
+    return _build_and_send(build, basename, fmt, key)
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+from charging_interval import BYTES, SECONDS, normalize
+
+# Mapping dictionary between Excel headers and DB model field names.
+COLUMN_MAPPING = {
+    "BU PLMN Code": "bu_plmn_code",
+    "TADIG PLMN Code": "tadig_plmn_code",
+    "Start date": "start_date",
+    "End date": "end_date",
+    "Currency": "currency",
+    "MOC Call Local Call Rate/Value": "moc_call_local_call_rate_value",
+    "MOC Call Local Call Charging interval": "moc_call_local_call_charging_interval",
+    "MOC Call Call Back Home Rate/Value": "moc_call_call_back_home_rate_value",
+    "MOC Call Call Back Home Charging interval": "moc_call_call_back_home_charging_interval",
+    "MOC Call Rest of the world Rate/Value": "moc_call_rest_of_the_world_rate_value",
+    "MOC Call Rest of the world Charging interval": "moc_call_rest_of_the_world_charging_interval",
+    "MOC Call Premium numbers Rate/Value": "moc_call_premium_numbers_rate_value",
+    "MOC Call Premium numbers Charging interval": "moc_call_premium_numbers_charging_interval",
+    "MOC Call Special numbers Rate/Value": "moc_call_special_numbers_rate_value",
+    "MOC Call Special numbers Charging interval": "moc_call_special_numbers_charging_interval",
+    "MOC Call Satellite Rate/Value": "moc_call_satellite_rate_value",
+    "MOC Call Satellite Charging interval": "moc_call_satellite_charging_interval",
+    "MTC Call Rate/Value": "mtc_call_rate_value",
+    "MTC Call Charging interval": "mtc_call_charging_interval",
+    "MO-SMS Rate/Value": "mo_sms_rate_value",
+    "GPRS Rate MB Rate/Value": "gprs_rate_mb_rate_value",
+    "GPRS Rate per KB Rate/Value": "gprs_rate_per_kb_rate_value",
+    "GPRS Rate MB Charging interval": "gprs_rate_mb_charging_interval",
+    "VoLTE Rate MB Rate/Value": "volte_rate_mb_rate_value",
+    "VoLTE Rate MB Charging interval": "volte_rate_mb_charging_interval",
+    "Tax applicable Yes/No": "tax_applicable_yes_no",
+    "Tax applicable Tax Value": "tax_applicable_tax_value",
+    "Tax included in the rate Yes/No": "tax_included_in_the_rate_yes_no",
+    "Bearer Service included in Special IOT Yes/No": "bearer_service_included_in_special_iot_yes_no"
+}
+
+DATE_FIELDS = frozenset(["start_date", "end_date"])
+
+NUMERIC_FIELDS = frozenset([
+    "moc_call_local_call_rate_value", "moc_call_call_back_home_rate_value",
+    "moc_call_rest_of_the_world_rate_value", "moc_call_premium_numbers_rate_value",
+    "moc_call_special_numbers_rate_value", "moc_call_satellite_rate_value",
+    "mtc_call_rate_value", "mo_sms_rate_value", "gprs_rate_mb_rate_value",
+    "gprs_rate_per_kb_rate_value", "volte_rate_mb_rate_value"
+])
+
+# Charging interval fields and the unit their intervals are counted in. Each
+# is stored as uploaded plus normalized into interval_columns(field).
+INTERVAL_FIELDS = {
+    "moc_call_local_call_charging_interval": SECONDS,
+    "moc_call_call_back_home_charging_interval": SECONDS,
+    "moc_call_rest_of_the_world_charging_interval": SECONDS,
+    "moc_call_premium_numbers_charging_interval": SECONDS,
+    "moc_call_special_numbers_charging_interval": SECONDS,
+    "moc_call_satellite_charging_interval": SECONDS,
+    "mtc_call_charging_interval": SECONDS,
+    "gprs_rate_mb_charging_interval": BYTES,
+    "volte_rate_mb_charging_interval": BYTES,
+}
+
+ERROR_COLUMNS = ["row", "field", "value", "error"]
+
+
+def interval_columns(field):
+    """(rounding rule, initial increment, subsequent increment) columns of a charging interval field."""
+    base = field[:-len("_charging_interval")]
+    return f"{base}_rounding_rule", f"{base}_interval_initial", f"{base}_interval_step"
+
+
+# derived columns, in INTERVAL_FIELDS order
+INTERVAL_COLUMNS = [column for field in INTERVAL_FIELDS for column in interval_columns(field)]
+INTEGER_FIELDS = frozenset(column for field in INTERVAL_FIELDS for column in interval_columns(field)[1:])
+
+
+def interval_values(field, values):
+    """{derived column: normalized values} for an array of raw `field` intervals."""
+    return dict(zip(interval_columns(field), normalize(values, INTERVAL_FIELDS[field])))
+
+
+def sql_type(field):
+    """PostgreSQL type of a ratesheet_v2 field, for casts in hand-written SQL."""
+    if field in NUMERIC_FIELDS:
+        return "DOUBLE PRECISION"
+    if field in INTEGER_FIELDS:
+        return "INTEGER"
+    if field in DATE_FIELDS:
+        return "DATE"
+    return "VARCHAR"
+
+
+def convert_frame(df, mapping=None):
+    """
+    Convert a sheet DataFrame (Excel headers) into typed column arrays keyed by
+    model field, in COLUMN_MAPPING order. Pass `mapping` ({column: field}) to
+    convert a frame with other headers, e.g. model field names.
+
+    Rate columns become float64 (NaN for missing), date columns an object array
+    of datetime.date/None, everything else an object array with None for
+    missing cells. Every charging interval field converted is followed, after
+    the mapped fields, by its normalized INTERVAL_COLUMNS (object arrays,
+    None where the interval could not be read). Cells that were present but
+    could not be converted are returned in a side table (row, field, value,
+    error) instead of being logged one by one; unreadable intervals are kept
+    as uploaded but listed there too.
+    """
+    n_rows = len(df)
+    columns = {}
+    errors = []
+    for excel_header, field in (mapping or COLUMN_MAPPING).items():
+        if excel_header not in df.columns:
+            columns[field] = np.full(n_rows, np.nan) if field in NUMERIC_FIELDS else np.full(n_rows, None, dtype=object)
+            continue
+        raw = df[excel_header]
+        present = raw.notna().to_numpy()
+
+        if field in NUMERIC_FIELDS:
+            converted = pd.to_numeric(raw, errors="coerce")
+            values = converted.to_numpy(dtype="float64")
+            bad = present & np.isnan(values)
+            reason = "not a number"
+        elif field in DATE_FIELDS:
+            converted = pd.to_datetime(raw, errors="coerce")
+            missing = converted.isna().to_numpy()
+            values = np.where(missing, None, converted.dt.date.to_numpy(dtype=object))
+            bad = present & missing
+            reason = "invalid date"
+        else:
+            values = np.where(present, raw.to_numpy(dtype=object), None)
+            bad = None
+
+        if bad is not None and bad.any():
+            positions = np.flatnonzero(bad)
+            errors.append(pd.DataFrame({
+                "row": df.index.to_numpy()[positions],
+                "field": field,
+                "value": raw.to_numpy(dtype=object)[positions],
+                "error": reason,
+            }))
+        columns[field] = values
+
+    for field in INTERVAL_FIELDS:
+        if field in columns:
+            derived = interval_values(field, columns[field])
+            columns.update(derived)
+            step = derived[interval_columns(field)[2]]
+            unreadable = np.flatnonzero(pd.notna(columns[field]) & pd.isna(step))
+            if len(unreadable):
+                errors.append(pd.DataFrame({
+                    "row": df.index.to_numpy()[unreadable],
+                    "field": field,
+                    "value": columns[field][unreadable],
+                    "error": "unreadable charging interval",
+                }))
+
+    error_table = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+    return columns, error_table
+
+
+def column_rows(columns):
+    """
+    Yield insert-ready row tuples (NaN → None) from the arrays returned by
+    convert_frame, in the same field order.
+    """
+    prepared = []
+    for field, values in columns.items():
+        if field in NUMERIC_FIELDS:
+            as_object = values.astype(object)
+            as_object[np.isnan(values)] = None
+            values = as_object
+        prepared.append(values.tolist())
+    return zip(*prepared)
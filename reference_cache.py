@@ -0,0 +1,230 @@
+import logging
+import os
+import select
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+import snapshots
+from table_versions import NOTIFY_CHANNEL, get_versions
+from upload_hooks import on_tables_changed
+
+logger = logging.getLogger(__name__)
+
+# template and country_v2 held in memory per worker process, with lookup
+# indexes, and replaced when their table_versions change. Uploads in this
+# worker invalidate through upload_hooks; uploads in other workers through
+# Postgres NOTIFY (sent by table_versions.bump_versions). Without a running
+# listener (SQLite, REFERENCE_LISTEN=0, lost connection) every get() checks
+# the versions instead, which is one indexed query. Other in-process caches
+# (rate_index) hook into the same invalidation with watch(). Reloads read
+# the snapshots of the new versions when there are any (snapshots.py).
+REFERENCE_TABLES = ("template", "country_v2")
+REFERENCE_LISTEN = os.getenv("REFERENCE_LISTEN", "1") == "1"
+# seconds between listener reconnect attempts
+LISTEN_RETRY = 5
+
+TEMPLATE_COLUMNS = ["destination", "area_code", "rate", "date", "rounding_rules",
+                    "destination_type", "setup_rate", "calls_type", "remarks"]
+TEMPLATE_SQL = """
+SELECT destination, area_code, rate, "date"::DATE AS date, rounding_rules,
+       destination_type, setup_rate, calls_type, remarks
+FROM "template"
+ORDER BY id;
+"""
+# alpha_3 is CHAR(3); the cast drops the padding like the SQL join does
+COUNTRY_SQL = "SELECT alpha_3::text AS alpha_3, custom_name FROM country_v2;"
+
+# distinct strings in ORDER BY order, i.e. the database's default collation
+COLLATION_SQL = "SELECT value FROM unnest(CAST(:values AS text[])) AS value ORDER BY value;"
+
+_lock = threading.Lock()
+_current = None
+_stale = True
+_listener = {"pid": None, "listening": False}
+# (tables, fn) pairs registered with watch()
+_watchers = []
+
+
+def read_frame(session, sql, params=None):
+    result = session.execute(text(sql), params or {})
+    return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()), coerce_float=True)
+
+
+def collation_ranks(session, values):
+    """
+    {string: rank} for the distinct strings of `values` in the order the
+    database's ORDER BY puts them. A locale-collated database does not
+    sort like Python's code point comparisons; without PostgreSQL this is
+    code point order.
+    """
+    distinct = sorted({value for value in values if isinstance(value, str)})
+    if distinct and session.get_bind().dialect.name == "postgresql":
+        distinct = session.execute(text(COLLATION_SQL), {"values": distinct}).scalars().all()
+    return {value: rank for rank, value in enumerate(distinct)}
+
+
+class Reference:
+    """
+    One version of template and country_v2 with lookup indexes. Shared by
+    every request of the worker: treat the frames and indexes as read-only.
+    """
+
+    def __init__(self, versions, template, country, collation=None):
+        self.versions = versions
+        self.loaded_at = time.time()
+        template[["rate", "setup_rate"]] = template[["rate", "setup_rate"]].astype("float64")
+        self.template = template
+        self.country = country
+        # collation_ranks of the template's sort keys (None: code point order)
+        self.collation = collation
+        known = country[country.alpha_3.notna()]
+        # alpha_3 -> custom names (a code may appear more than once in country_v2)
+        self.custom_names = {code: tuple(names) for code, names in known.groupby("alpha_3").custom_name}
+        # calls_type / destination -> positions of their template rows
+        self.template_rows = template.groupby("calls_type").indices
+        self.destination_rows = template.groupby("destination").indices
+        self._derived = {}
+        # reentrant: a build may use other derived structures
+        self._derived_lock = threading.RLock()
+
+    def derived(self, name, build):
+        """build(self), computed once per Reference, for structures other modules precompute from it."""
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = build(self)
+            return self._derived[name]
+
+
+def invalidate():
+    global _stale
+    with _lock:
+        _stale = True
+
+
+def watch(tables, fn):
+    """
+    Call fn() whenever one of `tables` changes, in this worker or another,
+    and whenever the listener (re)connects, so other in-process caches can
+    share the listener. Returns fn.
+    """
+    _watchers.append((frozenset(tables), fn))
+    return fn
+
+
+def _notify(tables=None):
+    # tables=None: anything may have changed (listener started or lost)
+    for watched, fn in _watchers:
+        if tables is None or watched & tables:
+            fn()
+
+
+watch(REFERENCE_TABLES, invalidate)
+
+
+@on_tables_changed
+def _on_upload(tables):
+    _notify(tables)
+
+
+def _listen(engine):
+    """Listener thread: LISTEN on NOTIFY_CHANNEL and invalidate the watchers of bumped tables."""
+    while True:
+        raw = None
+        try:
+            raw = engine.raw_connection()
+            # keep this connection out of the pool for good
+            raw.detach()
+            conn = raw.dbapi_connection
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL};")
+            # anything committed before LISTEN took effect is caught by this reload
+            _notify()
+            _listener["listening"] = True
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                _notify({n.payload for n in conn.notifies})
+                conn.notifies.clear()
+        except Exception:
+            logger.exception("Reference data listener failed, checking versions on every request")
+        finally:
+            _listener["listening"] = False
+            _notify()
+            if raw is not None:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+        time.sleep(LISTEN_RETRY)
+
+
+def _ensure_listener(engine):
+    if not REFERENCE_LISTEN or engine.dialect.name != "postgresql":
+        return
+    with _lock:
+        # threads do not survive a fork: start one per worker process
+        if _listener["pid"] == os.getpid():
+            return
+        _listener["pid"] = os.getpid()
+        _listener["listening"] = False
+    threading.Thread(target=_listen, args=(engine,), name="reference-listener", daemon=True).start()
+
+
+def listening():
+    """True while this worker's listener is connected, i.e. watchers hear about every change."""
+    return _listener["listening"]
+
+
+def _snapshot_frames(versions):
+    """(template, country) like TEMPLATE_SQL and COUNTRY_SQL from the snapshots of `versions`, or None."""
+    template = snapshots.frame("template", versions["template"], TEMPLATE_COLUMNS)
+    country = snapshots.frame("country_v2", versions["country_v2"], ["alpha_3", "custom_name"])
+    if template is None or country is None:
+        return None
+    # CHAR(3) values keep their padding in the snapshot
+    country["alpha_3"] = country.alpha_3.str.rstrip()
+    return template, country
+
+
+def get(session):
+    """The current Reference, reloaded from the database only when template or country_v2 changed."""
+    global _current, _stale
+    _ensure_listener(session.get_bind())
+    with _lock:
+        current = _current
+        if current is not None and not _stale and _listener["listening"]:
+            return current
+        # cleared before reading versions, so a NOTIFY from here on marks it stale again
+        _stale = False
+    versions = get_versions(session, REFERENCE_TABLES)
+    if current is not None and current.versions == versions:
+        return current
+    start = time.perf_counter()
+    frames = _snapshot_frames(versions)
+    source = "snapshots" if frames else "the database"
+    if frames is None:
+        frames = read_frame(session, TEMPLATE_SQL), read_frame(session, COUNTRY_SQL)
+    template = frames[0]
+    collation = collation_ranks(session, pd.concat([template.destination, template.area_code, template.calls_type]))
+    reference = Reference(versions, *frames, collation)
+    logger.info(f"Loaded reference data {versions} from {source}: {len(reference.template)} template rows, "
+                f"{len(reference.country)} countries in {(time.perf_counter() - start) * 1000:.1f}ms")
+    with _lock:
+        if _current is None or _current.versions != versions:
+            _current = reference
+        return _current
+
+
+def status():
+    """Cache state of this worker, for /admin/reference."""
+    current = _current
+    return {
+        "versions": current.versions if current else None,
+        "loaded_at": current.loaded_at if current else None,
+        "stale": _stale,
+        "listening": _listener["listening"],
+    }
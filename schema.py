@@ -0,0 +1,92 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from charging_interval import SECONDS, rule
+from rate_history import ADD_DELETED_COLUMN, CREATE_HISTORY, HISTORY_INDEXES, record_history
+from ratesheet_schema import INTERVAL_FIELDS, interval_columns, interval_values, sql_type
+from table_versions import CREATE_TABLE_VERSIONS
+from upload_hooks import commit_changes
+from upsert_load import ensure_natural_keys
+from voice_ratecard import VOICE_DDL
+
+# Idempotent DDL for columns and tables added after the original
+# create_tables.sql. Applied once per process before the first request.
+SCHEMA_DDL = [
+    # natural-key row hashes for diff-mode uploads (upsert_load.py)
+    "ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS row_hash VARCHAR(16);",
+    "ALTER TABLE country_v2 ADD COLUMN IF NOT EXISTS row_hash VARCHAR(16);",
+] + [
+    # normalized charging intervals (ratesheet_schema.interval_columns)
+    f"ALTER TABLE ratesheet_v2 ADD COLUMN IF NOT EXISTS {column} {sql_type(column)};"
+    for field in INTERVAL_FIELDS for column in interval_columns(field)
+] + [
+    # effective-dated rate history (rate_history.py)
+    CREATE_TABLE_VERSIONS,
+    CREATE_HISTORY,
+    ADD_DELETED_COLUMN,
+    *HISTORY_INDEXES,
+    # precomputed voice ratecard and the indexes its query uses (voice_ratecard.py)
+    *VOICE_DDL,
+]
+
+_applied = False
+
+
+def _backfill_intervals(conn):
+    """
+    Normalize charging intervals stored before their columns existed, and
+    template rounding rules stored before uploads normalized them, and
+    re-parse intervals stored with a zero increment (no longer accepted).
+    Works on distinct values, so it is cheap once done. Returns the tables
+    changed.
+    """
+    changed = set()
+    for field in INTERVAL_FIELDS:
+        rule_column, _, step_column = interval_columns(field)
+        pending = f"({rule_column} IS NULL OR {step_column} = 0)"
+        raw = [row[0] for row in conn.execute(text(
+            f"SELECT DISTINCT {field} FROM ratesheet_v2 WHERE {field} IS NOT NULL AND {pending};"
+        ))]
+        if not raw:
+            continue
+        derived = interval_values(field, raw)
+        assignments = ", ".join(f"{column} = :{column}" for column in derived)
+        conn.execute(
+            text(f"UPDATE ratesheet_v2 SET {assignments} WHERE {field} = :raw AND {pending};"),
+            [{"raw": value, **{column: values[i] for column, values in derived.items()}}
+             for i, value in enumerate(raw)],
+        )
+        changed.add("ratesheet_v2")
+    rules = conn.execute(text('SELECT DISTINCT rounding_rules FROM "template" WHERE rounding_rules IS NOT NULL;'))
+    rewrites = [{"raw": value, "rule": rule(value, SECONDS)} for (value,) in rules if rule(value, SECONDS) != value]
+    if rewrites:
+        conn.execute(text('UPDATE "template" SET rounding_rules = :rule WHERE rounding_rules = :raw;'), rewrites)
+        changed.add("template")
+    return changed
+
+
+def ensure_schema(engine):
+    """
+    Apply SCHEMA_DDL and backfills on their own connection, once per process.
+    Workers starting together take turns under an advisory lock: concurrent
+    CREATE ... IF NOT EXISTS can still collide on the catalogs, and the
+    backfills must not run twice at once.
+    """
+    global _applied
+    if _applied or engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name));"), {"name": "ensure_schema"})
+        for ddl in SCHEMA_DDL:
+            conn.execute(text(ddl))
+        # unique natural keys for diff uploads, unless existing rows repeat one
+        ensure_natural_keys(conn)
+        changed = _backfill_intervals(conn)
+        # seeds the history on first run; afterwards only catches up on
+        # commits made without commit_changes
+        record_history(conn)
+    if changed:
+        # cached exports and the precomputed voice ratecard were built from the old values
+        with Session(engine) as session:
+            commit_changes(session, *changed)
+    _applied = True
@@ -0,0 +1,108 @@
+import zipfile
+from xml.etree import ElementTree
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Rows handed to the ingestion code per chunk; bounds peak memory per upload.
+CHUNK_ROWS = 5000
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK"
+SPREADSHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def detect_format(stream, filename=None):
+    """
+    Return 'xlsx', 'csv.gz' or 'csv' for an uploaded file, going by its magic
+    bytes first and falling back to the file extension.
+    """
+    head = stream.read(2)
+    stream.seek(0)
+    if head == ZIP_MAGIC:
+        return "xlsx"
+    if head == GZIP_MAGIC:
+        return "csv.gz"
+    name = (filename or "").lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        return "xlsx"
+    if name.endswith(".gz"):
+        return "csv.gz"
+    return "csv"
+
+
+def iter_sheet_chunks(file, chunk_rows=CHUNK_ROWS, filename=None, sheet=0):
+    """
+    Yield DataFrames of at most `chunk_rows` rows from the first sheet (or
+    `sheet`, a position or name) of an uploaded workbook, or from a
+    (gzip-compressed) CSV. The first row is the header. `file` may be a
+    werkzeug FileStorage, an open binary file or a path.
+
+    The index of each chunk continues across chunks, so it is the row's
+    position in the whole sheet.
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as fh:
+            yield from iter_sheet_chunks(fh, chunk_rows, filename or file, sheet)
+        return
+
+    stream = getattr(file, "stream", file)
+    filename = filename or getattr(file, "filename", None)
+    kind = detect_format(stream, filename)
+
+    if kind == "xlsx":
+        yield from _iter_xlsx(stream, chunk_rows, sheet)
+    else:
+        compression = "gzip" if kind == "csv.gz" else None
+        yield from pd.read_csv(stream, chunksize=chunk_rows, compression=compression)
+
+
+def _iter_xlsx(stream, chunk_rows, sheet=0):
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from iter_worksheet_chunks(wb[sheet] if isinstance(sheet, str) else wb.worksheets[sheet], chunk_rows)
+    finally:
+        wb.close()
+
+
+def sheet_names(path, filename=None):
+    """
+    Worksheet names of a workbook at `path`, in tab order, read from its
+    workbook.xml without loading any cells; [None] for a CSV.
+    """
+    with open(path, "rb") as fh:
+        if detect_format(fh, filename or path) != "xlsx":
+            return [None]
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    return [sheet.get("name") for sheet in root.iter(f"{SPREADSHEET_NS}sheet")]
+
+
+def iter_worksheet_chunks(ws, chunk_rows=CHUNK_ROWS):
+    """Yield DataFrame chunks from a read-only openpyxl worksheet."""
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [h if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+
+    offset = 0
+    chunk = []
+    for values in rows:
+        # read-only sheets often report trailing rows with no values at all
+        if all(v is None for v in values):
+            continue
+        chunk.append(values)
+        if len(chunk) >= chunk_rows:
+            yield _frame(chunk, columns, offset)
+            offset += len(chunk)
+            chunk = []
+    if chunk:
+        yield _frame(chunk, columns, offset)
+
+
+def _frame(chunk, columns, offset):
+    width = len(columns)
+    # pad/trim ragged rows so every row matches the header
+    chunk = [tuple(v[:width]) + (None,) * (width - len(v)) for v in chunk]
+    return pd.DataFrame(chunk, columns=columns, index=range(offset, offset + len(chunk)))
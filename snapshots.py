@@ -0,0 +1,299 @@
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.ipc
+import sqlalchemy as sa
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from bulk_load import bulk_insert
+from staging_swap import create_staging, swap_in
+from table_versions import get_versions
+
+logger = logging.getLogger(__name__)
+
+# Every committed version of ratesheet_v2, template and country_v2 as an
+# Arrow IPC file on local disk, <SNAPSHOT_DIR>/<table>/<table>.v<version>.arrow,
+# written by a background thread shortly after the commit (app_snapshot
+# listens on upload_hooks and schedules the changed tables; a burst of
+# commits is written once, SNAPSHOT_DELAY after the last of them). Readers
+# that would scan one of these tables memory-map the snapshot of its current
+# version instead (zero-copy; one version query instead of a scan), and fall
+# back to the database when there is none. Snapshots hold every column but
+# id, in id order, so they also restore the table (flask snapshot restore).
+SNAPSHOT_TABLES = ("ratesheet_v2", "template", "country_v2")
+SNAPSHOTS = os.getenv("SNAPSHOTS", "1") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "ratesheet-snapshots"))
+# versions kept on disk per table
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 3))
+# rows fetched from the server-side cursor and written per record batch
+SNAPSHOT_BATCH_ROWS = int(os.getenv("SNAPSHOT_BATCH_ROWS", 50000))
+# seconds without a further commit before changed tables are written, and
+# the longest a steady stream of commits can hold a write back
+SNAPSHOT_DELAY = float(os.getenv("SNAPSHOT_DELAY", 2))
+SNAPSHOT_MAX_DELAY = float(os.getenv("SNAPSHOT_MAX_DELAY", 30))
+
+SNAPSHOT_RE = re.compile(r"^(?P<table>\w+)\.v(?P<version>\d+)\.arrow$")
+
+_lock = threading.Lock()
+# table -> (version, pyarrow.Table) of the snapshot last mapped by this process
+_mapped = {}
+
+_writer = {"pid": None}
+_pending_lock = threading.Lock()
+# tables committed since the writer thread last ran, and when the first and
+# latest of those commits happened
+_pending = {"tables": set(), "first": 0.0, "last": 0.0}
+_wake = threading.Event()
+
+
+def snapshot_path(table, version):
+    return os.path.join(SNAPSHOT_DIR, table, f"{table}.v{version}.arrow")
+
+
+def versions_on_disk(table):
+    """Versions of `table` with a snapshot on disk, oldest first."""
+    try:
+        names = os.listdir(os.path.join(SNAPSHOT_DIR, table))
+    except FileNotFoundError:
+        return []
+    matches = (SNAPSHOT_RE.match(name) for name in names)
+    return sorted(int(m["version"]) for m in matches if m and m["table"] == table)
+
+
+def arrow_type(sql_type):
+    """The Arrow type a snapshot stores a column of SQLAlchemy type `sql_type` as."""
+    if isinstance(sql_type, sa.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, sa.Integer):
+        return pa.int64()
+    if isinstance(sql_type, sa.Float):
+        return pa.float64()
+    if isinstance(sql_type, sa.Numeric):
+        # unconstrained NUMERIC has no decimal128 to fit every value
+        if sql_type.precision is None:
+            return pa.float64()
+        decimal = pa.decimal128 if sql_type.precision <= 38 else pa.decimal256
+        return decimal(sql_type.precision, sql_type.scale or 0)
+    if isinstance(sql_type, sa.DateTime):
+        return pa.timestamp("us", tz="UTC" if sql_type.timezone else None)
+    if isinstance(sql_type, sa.Date):
+        return pa.date32()
+    if isinstance(sql_type, sa.Time):
+        return pa.time64("us")
+    return pa.string()
+
+
+def table_schema(session, table):
+    """Arrow schema of every column of `table` but id, in table order."""
+    columns = inspect(session.connection()).get_columns(table)
+    return pa.schema([pa.field(c["name"], arrow_type(c["type"])) for c in columns if c["name"] != "id"])
+
+
+def _column(values, field):
+    if pa.types.is_floating(field.type):
+        values = [None if value is None else float(value) for value in values]
+    return pa.array(values, type=field.type)
+
+
+def read_batches(session, table, schema, batch_rows):
+    """`schema`'s columns of `table` in id order, as record batches of up to `batch_rows` rows from a server-side cursor."""
+    columns = ", ".join(f'"{name}"' for name in schema.names)
+    result = session.execute(text(f'SELECT {columns} FROM "{table}" ORDER BY id;'),
+                             execution_options={"stream_results": True})
+    for rows in result.partitions(batch_rows):
+        values = list(zip(*rows))
+        yield pa.record_batch([_column(values[i], field) for i, field in enumerate(schema)], schema=schema)
+
+
+def write(session, table):
+    """
+    Snapshot the committed contents of `table` at its current version.
+    Returns the version written, or None when that version is on disk
+    already or the table changed while it was read (the write scheduled by
+    that commit covers it).
+    """
+    version = get_versions(session, [table])[table]
+    path = snapshot_path(table, version)
+    if os.path.exists(path):
+        return None
+    start = time.perf_counter()
+    schema = table_schema(session, table).with_metadata({"table": table, "version": str(version)})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = f"{path}.{os.getpid()}.part"
+    rows = 0
+    try:
+        with pa.OSFile(part, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in read_batches(session, table, schema, SNAPSHOT_BATCH_ROWS):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        if get_versions(session, [table])[table] != version:
+            logger.info(f"{table} changed while it was read for snapshot v{version}, skipped")
+            os.remove(part)
+            return None
+        os.replace(part, path)
+    except BaseException:
+        try:
+            os.remove(part)
+        except FileNotFoundError:
+            pass
+        raise
+    prune(table)
+    logger.info(f"Wrote {table} snapshot v{version}: {rows} rows, {os.path.getsize(path)} bytes "
+                f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return version
+
+
+def schedule(engine, tables):
+    """Have this process's writer thread snapshot `tables` once commits to them pause for SNAPSHOT_DELAY."""
+    tables = set(tables) & set(SNAPSHOT_TABLES)
+    if not SNAPSHOTS or not tables:
+        return
+    now = time.monotonic()
+    with _pending_lock:
+        if not _pending["tables"]:
+            _pending["first"] = now
+        _pending["tables"] |= tables
+        _pending["last"] = now
+    _start_writer(engine)
+    _wake.set()
+
+
+def _start_writer(engine):
+    """Start this process's writer thread, once per process (threads do not survive a fork)."""
+    with _pending_lock:
+        if _writer["pid"] == os.getpid():
+            return
+        _writer["pid"] = os.getpid()
+    threading.Thread(target=_write_pending, args=(engine,), name="snapshot-writer", daemon=True).start()
+
+
+def _due():
+    """Seconds until the pending tables are due to be written (0: now), or None when nothing is pending."""
+    with _pending_lock:
+        if not _pending["tables"]:
+            return None
+        due = min(_pending["last"] + SNAPSHOT_DELAY, _pending["first"] + SNAPSHOT_MAX_DELAY)
+        return max(due - time.monotonic(), 0)
+
+
+def _take_pending():
+    with _pending_lock:
+        tables, _pending["tables"] = _pending["tables"], set()
+        return tables
+
+
+def _write_pending(engine):
+    """Writer thread: snapshot the scheduled tables whenever commits to them pause."""
+    while True:
+        _wake.wait()
+        _wake.clear()
+        wait = _due()
+        while wait:
+            # a commit in the meantime sets _wake and pushes the due time back
+            _wake.wait(wait)
+            _wake.clear()
+            wait = _due()
+        if wait is None:
+            continue
+        with Session(engine) as session:
+            for table in sorted(_take_pending()):
+                try:
+                    write(session, table)
+                except Exception:
+                    logger.exception(f"Snapshot of {table} failed")
+                finally:
+                    session.rollback()
+
+
+def prune(table, keep=SNAPSHOT_KEEP):
+    """Delete all but the newest `keep` snapshots of `table` (mapped copies stay readable until dropped)."""
+    for version in versions_on_disk(table)[:-keep or None]:
+        try:
+            os.remove(snapshot_path(table, version))
+        except FileNotFoundError:
+            pass
+
+
+def open_snapshot(table, version):
+    """The snapshot of `table` at `version` as a memory-mapped pyarrow Table, or None when there is none."""
+    with _lock:
+        mapped = _mapped.get(table)
+        if mapped is not None and mapped[0] == version:
+            return mapped[1]
+    path = snapshot_path(table, version)
+    try:
+        data = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    except FileNotFoundError:
+        return None
+    except (OSError, pa.ArrowInvalid):
+        logger.exception(f"Unreadable snapshot {path}, reading {table} from the database")
+        return None
+    with _lock:
+        _mapped[table] = (version, data)
+    return data
+
+
+def frame(table, version, columns=None):
+    """
+    open_snapshot as a DataFrame of `columns` (default all) typed like
+    reference_cache.read_frame (NUMERIC as float64), or None when there is
+    no snapshot or it lacks one of the columns.
+    """
+    data = open_snapshot(table, version) if SNAPSHOTS else None
+    if data is None:
+        return None
+    if columns is not None:
+        if any(column not in data.column_names for column in columns):
+            return None
+        data = data.select(columns)
+    casts = {field.name: pa.float64() for field in data.schema if pa.types.is_decimal(field.type)}
+    if casts:
+        data = data.cast(pa.schema([pa.field(f.name, casts.get(f.name, f.type)) for f in data.schema]))
+    return data.to_pandas()
+
+
+def current_frame(session, table, columns=None):
+    """`table` at its committed version from the snapshot (see frame), or None: read the database."""
+    if not SNAPSHOTS:
+        return None
+    return frame(table, get_versions(session, [table])[table], columns)
+
+
+def restore(session, table, version=None):
+    """
+    Replace `table` with its snapshot at `version` (default: the newest on
+    disk), bulk-loaded with COPY into a staging table and swapped in, in the
+    session's transaction; the caller commits with commit_changes. ids are
+    renumbered in snapshot order, as a full upload does. Returns (version,
+    rows).
+    """
+    if version is None:
+        versions = versions_on_disk(table)
+        if not versions:
+            raise LookupError(f"No snapshot of {table} in {SNAPSHOT_DIR}")
+        version = versions[-1]
+    path = snapshot_path(table, version)
+    if not os.path.exists(path):
+        raise LookupError(f"No snapshot of {table} at version {version} ({path})")
+    data = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    staging = create_staging(session, table)
+    rows = bulk_insert(session, staging, data.column_names,
+                       zip(*(column.to_pylist() for column in data.columns)))
+    swap_in(session, table)
+    return version, rows
+
+
+def status():
+    """Snapshots on disk and mapped in this process, for /admin/snapshots."""
+    return {
+        "enabled": SNAPSHOTS,
+        "dir": SNAPSHOT_DIR,
+        "on_disk": {table: versions_on_disk(table) for table in SNAPSHOT_TABLES},
+        "mapped": {table: version for table, (version, _) in _mapped.items()},
+    }
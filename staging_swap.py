@@ -0,0 +1,94 @@
+import logging
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Full uploads are loaded into <table>_staging and switched in by renaming it
+# over the live table at the end of the same transaction. Until that commit,
+# readers keep querying the old table without waiting on the load; the
+# ACCESS EXCLUSIVE lock taken by the swap is only held for the final renames.
+
+
+class EmptyUploadError(ValueError):
+    """The staging table has no rows; swapping it in would empty the live table."""
+
+
+def staging_name(table):
+    return f"{table}_staging"
+
+
+def _id_sequence(session, table):
+    """Name of the sequence owned by table.id (serial or identity), or None."""
+    return session.execute(text(
+        "SELECT pg_get_serial_sequence(c.table_name, c.column_name) FROM information_schema.columns c "
+        "WHERE c.table_schema = current_schema() AND c.table_name = :table AND c.column_name = 'id';"
+    ), {"table": table}).scalar()
+
+
+def create_staging(session, table):
+    """
+    Create an empty <table>_staging with the live table's columns, defaults
+    and check constraints, and with its own id sequence so ids restart at 1
+    as they did with TRUNCATE ... RESTART IDENTITY. Indexes are only built in
+    swap_in, after the bulk load. Returns the staging table name.
+    """
+    staging = staging_name(table)
+    # one full upload per table at a time
+    session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name));"), {"name": staging})
+    session.execute(text(f"DROP TABLE IF EXISTS {staging};"))
+    session.execute(text(
+        f"CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS);"
+    ))
+    if _id_sequence(session, table) and not _id_sequence(session, staging):
+        # a serial id: LIKE copied nextval() of the live table's sequence
+        session.execute(text(f"DROP SEQUENCE IF EXISTS {staging}_id_seq;"))
+        session.execute(text(f"CREATE SEQUENCE {staging}_id_seq OWNED BY {staging}.id;"))
+        session.execute(text(f"ALTER TABLE {staging} ALTER COLUMN id SET DEFAULT nextval('{staging}_id_seq');"))
+    return staging
+
+
+def swap_in(session, table):
+    """
+    Replace `table` with its loaded staging table inside the current
+    transaction: rebuild the live table's primary key, unique constraints and
+    indexes on the staging table, drop the live table, then give the staging
+    table, its id sequence and its indexes the live names. The caller commits.
+    Raises EmptyUploadError, leaving the live table alone, when nothing was
+    loaded; the caller rolls back.
+    """
+    staging = staging_name(table)
+    if not session.execute(text(f"SELECT EXISTS (SELECT 1 FROM {staging});")).scalar():
+        raise EmptyUploadError(f"The upload has no {table} rows to load; {table} was left unchanged")
+    constraints = session.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table AS regclass) AND contype IN ('p', 'u', 'x');"
+    ), {"table": table}).fetchall()
+    indexes = session.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = :table;"
+    ), {"table": table}).fetchall()
+    live_sequence = _id_sequence(session, table)
+
+    renames = []
+    for name, definition in constraints:
+        session.execute(text(f"ALTER TABLE {staging} ADD CONSTRAINT {name}_swap {definition};"))
+        renames.append(f"ALTER TABLE {table} RENAME CONSTRAINT {name}_swap TO {name};")
+    constraint_names = {name for name, _ in constraints}
+    for name, ddl in indexes:
+        if name in constraint_names:
+            continue
+        ddl = ddl.replace(f" INDEX {name} ON ", f" INDEX {name}_swap ON ", 1)
+        ddl = ddl.replace(f".{table} USING ", f".{staging} USING ", 1)
+        session.execute(text(ddl))
+        renames.append(f"ALTER INDEX {name}_swap RENAME TO {name};")
+
+    session.execute(text(f"DROP TABLE {table};"))
+    session.execute(text(f"ALTER TABLE {staging} RENAME TO {table};"))
+    staging_sequence = _id_sequence(session, table)
+    if live_sequence and staging_sequence:
+        short_name = live_sequence.split(".")[-1]
+        session.execute(text(f"ALTER SEQUENCE {staging_sequence} RENAME TO {short_name};"))
+    for statement in renames:
+        session.execute(text(statement))
+    logger.info("Swapped %s in as %s (%d indexes rebuilt)", staging, table, len(renames))
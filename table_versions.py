@@ -0,0 +1,58 @@
+from sqlalchemy import text
+
+# One row per data table; `version` increases every time an upload or edit
+# commits new contents. Caches key their entries on these numbers.
+CREATE_TABLE_VERSIONS = """
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+BUMP_VERSION = """
+INSERT INTO table_versions (table_name, version, updated_at)
+VALUES (:table_name, 1, now())
+ON CONFLICT (table_name)
+DO UPDATE SET version = table_versions.version + 1, updated_at = now();
+"""
+
+# Postgres channel a bump is announced on (payload: table name), delivered
+# on commit; reference_cache listens on it to drop stale in-process copies.
+NOTIFY_CHANNEL = "table_versions"
+NOTIFY_VERSION = "SELECT pg_notify(:channel, :table_name);"
+
+SELECT_VERSIONS = """
+SELECT table_name, version FROM table_versions WHERE table_name = ANY(:names);
+"""
+
+_ensured = False
+
+
+def _ensure_table(session):
+    # created on its own connection so a rolled-back caller can't undo it
+    global _ensured
+    if not _ensured:
+        with session.get_bind().begin() as conn:
+            conn.execute(text(CREATE_TABLE_VERSIONS))
+        _ensured = True
+
+
+def bump_versions(session, tables):
+    """
+    Increment the version of each table within the session's current
+    transaction and NOTIFY other workers when it commits.
+    """
+    _ensure_table(session)
+    for name in sorted(tables):
+        session.execute(text(BUMP_VERSION), {"table_name": name})
+        if session.get_bind().dialect.name == "postgresql":
+            session.execute(text(NOTIFY_VERSION), {"channel": NOTIFY_CHANNEL, "table_name": name})
+
+
+def get_versions(session, tables):
+    """Return {table_name: version} for `tables`; tables never bumped report 0."""
+    _ensure_table(session)
+    names = sorted(tables)
+    found = dict(session.execute(text(SELECT_VERSIONS), {"names": names}).fetchall())
+    return {name: found.get(name, 0) for name in names}
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import upload_hooks
+from upsert_load import ensure_natural_keys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tests that need PostgreSQL run against TEST_DATABASE_URL and are skipped
+# without it. Its public schema is dropped and recreated from
+# create_tables.sql for every test: never point it at a real database.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# template and country_v2 are created by hand (readme_v1.txt), not by create_tables.sql
+REFERENCE_DDL = [
+    """
+    CREATE TABLE "template" (
+        id SERIAL PRIMARY KEY,
+        destination VARCHAR(100),
+        area_code VARCHAR(20),
+        rate DOUBLE PRECISION,
+        tariff_name VARCHAR(100),
+        date DATE,
+        rounding_rules VARCHAR(20),
+        destination_type VARCHAR(50),
+        setup_rate DOUBLE PRECISION,
+        calls_type VARCHAR(100),
+        remarks TEXT
+    );
+    """,
+    """
+    CREATE TABLE country_v2 (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100),
+        alpha_2 CHAR(2),
+        alpha_3 CHAR(3),
+        country_code VARCHAR(10),
+        iso_3166_2 VARCHAR(20),
+        region VARCHAR(50),
+        sub_region VARCHAR(50),
+        intermediate_region VARCHAR(50),
+        region_code VARCHAR(10),
+        sub_region_code VARCHAR(10),
+        intermediate_region_code VARCHAR(10),
+        custom_name VARCHAR(100)
+    );
+    """,
+]
+
+
+def reset_database(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE; CREATE SCHEMA public;"))
+        for ddl in REFERENCE_DDL:
+            conn.execute(text(ddl))
+        with open(os.path.join(ROOT, "create_tables.sql")) as fh:
+            conn.exec_driver_sql(fh.read())
+
+
+@pytest.fixture
+def pg_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL)
+    reset_database(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def pg_session(pg_engine):
+    with Session(pg_engine) as session:
+        yield session
+
+
+@pytest.fixture
+def app_db(pg_engine, monkeypatch):
+    """app's db on TEST_DATABASE_URL; the listeners its blueprints register are dropped afterwards."""
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    monkeypatch.setattr(upload_hooks, "_listeners", [])
+    import app
+    with pg_engine.begin() as conn:
+        ensure_natural_keys(conn)
+    with app.app.app_context():
+        yield app
+        app.db.session.remove()
@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from sqlalchemy import text
+
+import batch_upload
+from ratesheet_schema import COLUMN_MAPPING
+from tests.test_voice_ratecard import insert
+from tests.voice_cases import PARTNERS
+
+HEADERS = {field: header for header, field in COLUMN_MAPPING.items()}
+
+
+def write_csv(path, tadigs):
+    pd.DataFrame({
+        HEADERS["tadig_plmn_code"]: tadigs,
+        HEADERS["start_date"]: "2025-07-01",
+        HEADERS["mtc_call_rate_value"]: 0.1,
+    }).to_csv(path, index=False)
+
+
+def test_parse_uploads_streams_rows_from_workdir(tmp_path):
+    write_csv(tmp_path / "a.csv", ["MYSAB", "MYSAC"])
+    write_csv(tmp_path / "b.csv", ["SGPXY"])
+    (tmp_path / "c.xlsx").write_text("not a workbook")
+    sources = [(str(tmp_path / name), name) for name in ("a.csv", "b.csv", "c.xlsx")]
+
+    results = batch_upload.parse_uploads(sources, str(tmp_path))
+    assert [(result["file"], result.get("rows")) for result in results] == [
+        ("a.csv", 2), ("b.csv", 1), ("c.xlsx", None)]
+    assert "error" in results[2]
+    chunks = batch_upload.iter_row_chunks([result["rows_path"] for result in results[:2]])
+    tadig = list(COLUMN_MAPPING.values()).index("tadig_plmn_code")
+    assert [row[tadig] for chunk in chunks for row in chunk] == ["MYSAB", "MYSAC", "SGPXY"]
+
+
+def test_dead_worker_fails_only_its_sheet():
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        future = pool.submit(os._exit, 1)
+        result = batch_upload._result(future, "x.xlsx", "rates.xlsx", "Rates")
+    assert result["file"] == "rates.xlsx" and result["sheet"] == "Rates"
+    assert result["error"].startswith("BrokenProcessPool")
+
+
+def test_failed_file_keeps_its_partners_in_full_mode(app_db, tmp_path):
+    insert(app_db.db.session, "ratesheet_v2", PARTNERS)
+    app_db.db.session.commit()
+    write_csv(tmp_path / "a.csv", ["MYSAB", "THAAA"])
+    (tmp_path / "b.xlsx").write_text("not a workbook")
+
+    summary, errors, report = app_db.ingest_ratesheet_batch(
+        [(str(tmp_path / "a.csv"), "a.csv"), (str(tmp_path / "b.xlsx"), "b.xlsx")], mode="full")
+    assert "error" in report[1]
+    assert summary["inserted"] == 1 and summary["updated"] == 1 and summary["deleted"] == 0
+    stored = app_db.db.session.execute(text("SELECT tadig_plmn_code FROM ratesheet_v2;")).scalars()
+    assert sorted(stored) == ["MYSAB", "SGPXY", "THAAA", "XXXAB"]
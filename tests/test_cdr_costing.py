@@ -0,0 +1,92 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cdr_costing import RATE_COLUMNS, RateTable, billed_units, price_file, price_frame, tax_rate
+
+
+def period(history_id, tadig, start_date, end_date=None, tax=("no", None, "no"), **rates):
+    row = dict.fromkeys(RATE_COLUMNS)
+    row.update(history_id=history_id, tadig_plmn_code=tadig, start_date=start_date, end_date=end_date,
+               tax_applicable_yes_no=tax[0], tax_applicable_tax_value=tax[1],
+               tax_included_in_the_rate_yes_no=tax[2], **rates)
+    return row
+
+
+# MYSAB: 30/6 with 10% tax added until June, then 60/60 with 15% tax included;
+# SGPXY: one period without a start_date, in effect on any day
+PERIODS = [
+    period(1, "MYSAB", date(2025, 1, 1), date(2025, 6, 30), tax=("yes", "10", "no"),
+           moc_call_local_call_rate_value=0.6, moc_call_local_call_interval_initial=30,
+           moc_call_local_call_interval_step=6),
+    period(2, "MYSAB", date(2025, 7, 1), tax=("yes", "15%", "yes"),
+           moc_call_local_call_rate_value=1.2, moc_call_local_call_interval_initial=60,
+           moc_call_local_call_interval_step=60),
+    period(3, "SGPXY", None, mo_sms_rate_value=0.05),
+]
+
+USAGE = pd.DataFrame([
+    ("MYSAB", "moc_local", 31, None, "2025-03-01 10:00"),
+    ("MYSAB", "moc_local", 61, None, "2025-07-02 10:00"),
+    ("MYSAB", "moc_local", 31, None, "2024-12-31 23:59"),
+    ("MYSAB", "moc_local", -5, None, "2025-03-01 10:00"),
+    ("QQQ01", "moc_local", 31, None, "2025-03-01 10:00"),
+    ("SGPXY", "sms", None, None, "2020-01-01 00:00"),
+    ("MYSAB", "fax", 31, None, "2025-03-01 10:00"),
+], columns=["tadig_plmn_code", "service", "duration", "bytes", "event_time"])
+
+
+def test_billed_units_round_up_to_interval():
+    usage = np.array([31.0, 30.0, 0.0, 61.0, 0.4, 61.0, -1.0])
+    initial = np.array([30.0, 30.0, 30.0, 60.0, 60.0, np.nan, 30.0])
+    step = np.array([6.0, 6.0, 6.0, 60.0, 60.0, np.nan, 6.0])
+    np.testing.assert_array_equal(billed_units(usage, initial, step), [36, 30, 0, 120, 60, 61, np.nan])
+
+
+def test_price_frame():
+    priced = price_frame(USAGE, RateTable(PERIODS))
+    assert priced.status.tolist() == [
+        "priced", "priced", "no rates in effect", "invalid usage", "no rates in effect", "priced",
+        "unknown service",
+    ]
+    assert priced.valid_from[0] == pd.Timestamp("2025-01-01")
+    assert priced.valid_from[1] == pd.Timestamp("2025-07-01")
+
+    # 31s at 30/6 bills 36s: 0.6 * 36 / 60, plus 10% tax
+    assert priced.billed[0] == 36
+    assert priced.charge[0] == pytest.approx(0.36)
+    assert priced.tax[0] == pytest.approx(0.036)
+    assert priced.total[0] == pytest.approx(0.396)
+
+    # 61s at 60/60 bills 120s; the 15% tax is part of the rate
+    assert priced.billed[1] == 120
+    assert priced.charge[1] == pytest.approx(2.4)
+    assert priced.tax[1] == pytest.approx(2.4 - 2.4 / 1.15)
+    assert priced.total[1] == pytest.approx(2.4)
+
+    assert priced.billed[5] == 1
+    assert priced.total[5] == pytest.approx(0.05)
+
+
+def test_price_file_in_process(tmp_path):
+    USAGE.to_csv(tmp_path / "usage.csv", index=False)
+    result = price_file(RateTable(PERIODS), str(tmp_path / "usage.csv"), str(tmp_path / "priced.csv"),
+                        workers=1, chunk_rows=3)
+    assert result["records"] == len(USAGE) and result["priced"] == 3
+    assert result["total"] == pytest.approx(0.396 + 2.4 + 0.05)
+    priced = pd.read_csv(tmp_path / "priced.csv")
+    assert priced.status.tolist() == price_frame(USAGE, RateTable(PERIODS)).status.tolist()
+    totals = pd.read_csv(result["totals"]).set_index(["tadig_plmn_code", "service"])
+    assert totals.loc[("MYSAB", "moc_local"), "records"] == 4
+    assert totals.loc[("MYSAB", "moc_local"), "priced"] == 2
+
+
+@pytest.mark.parametrize("value, rate", [
+    ("15%", 0.15), ("15", 0.15), ("0.15", 0.15), ("7,5 %", 0.075),
+    # a bare "1" is 1%, not 100%
+    ("1", 0.01), ("0", 0.0), ("n/a", 0.0), (None, 0.0),
+])
+def test_tax_rate(value, rate):
+    assert tax_rate(value) == pytest.approx(rate)
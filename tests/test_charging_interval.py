@@ -0,0 +1,17 @@
+from charging_interval import BYTES, SECONDS, normalize, parse
+
+
+def test_parse_intervals():
+    assert parse("60 seconds", SECONDS) == (60, 60)
+    assert parse("30/6 s", SECONDS) == (30, 6)
+    assert parse("1 min/1 s", SECONDS) == (60, 1)
+    assert parse("10 KB", BYTES) == (10240, 10240)
+    assert parse("1 KB", SECONDS) is None
+
+
+def test_zero_increment_is_unreadable():
+    assert parse("0 seconds", SECONDS) is None
+    assert parse("0/60", SECONDS) is None
+    rules, initial, step = normalize(["0 seconds", "60/60"], SECONDS)
+    assert list(rules) == ["0 seconds", "60/60"]
+    assert list(step) == [None, 60]
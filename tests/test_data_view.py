@@ -0,0 +1,22 @@
+import base64
+
+from tests.test_voice_ratecard import insert
+from tests.voice_cases import PARTNERS
+
+
+def test_pages_follow_cursor(app_db):
+    insert(app_db.db.session, "ratesheet_v2", PARTNERS)
+    app_db.db.session.commit()
+    client = app_db.app.test_client()
+    first = client.get("/api/ratesheet?sort=tadig_plmn_code&limit=2").get_json()
+    second = client.get(f"/api/ratesheet?sort=tadig_plmn_code&limit=2&after={first['next_cursor']}").get_json()
+    assert [r["tadig_plmn_code"] for r in first["records"] + second["records"]] == ["MYSAB", "SGPXY", "XXXAB"]
+    assert second["next_cursor"] is None
+
+
+def test_malformed_cursor_is_a_bad_request(app_db):
+    client = app_db.app.test_client()
+    for cursor in ["!!!", "e30=", base64.urlsafe_b64encode(b'["x", 1]').decode(),
+                   base64.urlsafe_b64encode(b'[1, null]').decode()]:
+        assert client.get(f"/api/ratesheet?sort=start_date&after={cursor}").status_code == 400
+        assert client.get(f"/data?sort=start_date&after={cursor}").status_code == 400
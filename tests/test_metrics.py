@@ -0,0 +1,21 @@
+import pytest
+from flask import Flask, g
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import metrics
+
+
+def test_failed_statements_leave_nothing_on_the_connection():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    with Flask(__name__).test_request_context(), engine.connect() as conn:
+        g.request_stats = {"sql_seconds": 0.0, "sql_statements": 0, "rows": 0}
+        info = dict(conn.info)
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table;"))
+            conn.rollback()
+        assert conn.execute(text("SELECT 1;")).scalar() == 1
+        assert conn.info == info
+        assert g.request_stats["sql_statements"] == 1
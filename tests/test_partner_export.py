@@ -0,0 +1,24 @@
+import csv
+from datetime import date
+
+import partner_export
+import voice_ratecard
+from tests.test_voice_ratecard import insert, load_voice_cases
+from tests.voice_cases import PARTNERS
+
+
+def test_partner_with_two_periods_gets_one_file(app_db, tmp_path):
+    session = app_db.db.session
+    load_voice_cases(session)
+    insert(session, "ratesheet_v2", [{**PARTNERS[0], "start_date": date(2025, 9, 1)}])
+    voice_ratecard.rebuild_voice_ratecard(session)
+    session.commit()
+
+    written = partner_export.write_partner_batch(["MYSAB", "SGPXY"], "csv", str(tmp_path))
+    assert [tadig for tadig, _, _ in written] == ["MYSAB", "SGPXY"]
+    tadig, path, rows = written[0]
+    with open(path, newline="") as fh:
+        tariffs = [row["tariff_name"] for row in csv.DictReader(fh)]
+    assert len(tariffs) == rows
+    assert tariffs == sorted(tariffs)
+    assert set(tariffs) == {"CELC_IR_VOICE_TARIFF_MYSAB_20250701", "CELC_IR_VOICE_TARIFF_MYSAB_20250901"}
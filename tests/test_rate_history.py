@@ -0,0 +1,49 @@
+from datetime import date
+
+from sqlalchemy import text
+
+import rate_history
+from tests.test_voice_ratecard import insert
+from tests.voice_cases import PARTNERS
+from upload_hooks import commit_changes
+
+COLUMNS = ["tadig_plmn_code", "start_date", "moc_call_local_call_rate_value", "mtc_call_rate_value"]
+
+
+def live_rates(session):
+    return sorted(session.execute(text(f"SELECT {', '.join(COLUMNS)} FROM ratesheet_v2;")).fetchall())
+
+
+def rates_as_of(session, as_of):
+    return sorted(session.execute(
+        text(f"SELECT {', '.join(COLUMNS)} FROM ({rate_history.RATES_AS_OF_SQL}) rates;"), {"as_of": as_of}
+    ).fetchall())
+
+
+def test_deleted_partner_is_not_in_effect(pg_session):
+    insert(pg_session, "ratesheet_v2", PARTNERS)
+    commit_changes(pg_session, "ratesheet_v2")
+    # SGPXY has no start_date and is in effect all the same
+    assert rates_as_of(pg_session, date.today()) == live_rates(pg_session)
+
+    pg_session.execute(text("DELETE FROM ratesheet_v2 WHERE tadig_plmn_code = 'MYSAB';"))
+    commit_changes(pg_session, "ratesheet_v2")
+    assert "MYSAB" not in [row[0] for row in live_rates(pg_session)]
+    assert rates_as_of(pg_session, date.today()) == live_rates(pg_session)
+    assert rate_history.partner_rates_as_of(pg_session, "MYSAB", date.today()) is None
+
+    # uploaded again, the partner is back in effect
+    insert(pg_session, "ratesheet_v2", [PARTNERS[0]])
+    commit_changes(pg_session, "ratesheet_v2")
+    assert rates_as_of(pg_session, date.today()) == live_rates(pg_session)
+
+
+def test_redated_period_replaces_the_old_one(pg_session):
+    insert(pg_session, "ratesheet_v2", [PARTNERS[0]])
+    commit_changes(pg_session, "ratesheet_v2")
+    assert rate_history.partner_rates_as_of(pg_session, "MYSAB", date(2025, 7, 15)) is not None
+
+    pg_session.execute(text("UPDATE ratesheet_v2 SET start_date = '2025-08-01' WHERE tadig_plmn_code = 'MYSAB';"))
+    commit_changes(pg_session, "ratesheet_v2")
+    assert rate_history.partner_rates_as_of(pg_session, "MYSAB", date(2025, 7, 15)) is None
+    assert rate_history.partner_rates_as_of(pg_session, "MYSAB", date(2025, 8, 15))["start_date"] == date(2025, 8, 1)
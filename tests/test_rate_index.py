@@ -0,0 +1,57 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import rate_index
+from reference_cache import Reference
+from tests.voice_cases import COUNTRIES, EXPECTED, PARTNERS, TEMPLATE
+
+AS_OF = date(2025, 8, 1)
+
+
+def build_index():
+    periods = [
+        {**dict.fromkeys(rate_index.PERIOD_COLUMNS), **partner, "history_id": history_id}
+        for history_id, partner in enumerate(PARTNERS, 1)
+    ]
+    # None, not NaN, for missing cells, as read from the database
+    template = pd.DataFrame(TEMPLATE).astype(object)
+    reference = Reference({}, template.where(template.notna(), None), pd.DataFrame(COUNTRIES))
+    return rate_index.RateIndex({}, periods, reference)
+
+
+def test_voice_lookups_match_expected_rows():
+    index = build_index()
+    seen = set()
+    for destination, area_code, rate, tariff_name, _, rule, _, setup_rate, calls_type, _, source_order in EXPECTED:
+        if (tariff_name, destination, calls_type) in seen:
+            continue
+        seen.add((tariff_name, destination, calls_type))
+        tadig = tariff_name.split("_")[-2]
+        result = index.lookup(tadig, "voice", AS_OF, destination=destination, calls_type=calls_type)
+        assert (result["tariff_name"], result["area_code"], result["rate"], result["setup_rate"],
+                result["rounding_rule"], result["source_order"]) == (
+                    tariff_name, area_code, rate, setup_rate, rule, source_order)
+
+
+def test_partner_without_country_has_no_voice_rates():
+    index = build_index()
+    with pytest.raises(LookupError):
+        index.lookup("XXXAB", "voice", AS_OF, destination="National", calls_type="National")
+    assert index.lookup("XXXAB", "gprs", AS_OF)["valid_from"] == "2025-07-01"
+
+
+def test_batch_item_with_non_string_field_fails_alone(app_db, monkeypatch):
+    monkeypatch.setattr(rate_index, "get", lambda session: build_index())
+    lookups = [
+        {"tadig_plmn_code": "MYSAB", "service": "gprs", "as_of": "2025-08-01"},
+        {"tadig_plmn_code": "MYSAB", "service": "gprs", "as_of": 20250801},
+        {"tadig_plmn_code": 123, "service": "gprs"},
+    ]
+    response = app_db.app.test_client().post("/rate/batch", json={"lookups": lookups})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert "error" not in results[0]
+    assert results[1] == {"error": "expected strings for as_of"}
+    assert results[2] == {"error": "expected strings for tadig_plmn_code"}
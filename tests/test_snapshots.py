@@ -0,0 +1,47 @@
+import time
+
+from sqlalchemy import text
+
+import snapshots
+from tests.test_voice_ratecard import insert
+from tests.voice_cases import PARTNERS
+from upload_hooks import commit_changes
+
+
+def stored_rates(session):
+    return [tuple(row)[1:] for row in session.execute(text("SELECT * FROM ratesheet_v2 ORDER BY id;"))]
+
+
+def test_snapshot_written_in_batches_restores_table(pg_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(snapshots, "SNAPSHOT_BATCH_ROWS", 1)
+    insert(pg_session, "ratesheet_v2", PARTNERS)
+    commit_changes(pg_session, "ratesheet_v2")
+    before = stored_rates(pg_session)
+
+    version = snapshots.write(pg_session, "ratesheet_v2")
+    data = snapshots.open_snapshot("ratesheet_v2", version)
+    assert data.num_rows == len(PARTNERS)
+    assert len(data.to_batches()) == len(PARTNERS)
+    assert snapshots.write(pg_session, "ratesheet_v2") is None
+
+    pg_session.execute(text("DELETE FROM ratesheet_v2;"))
+    commit_changes(pg_session, "ratesheet_v2")
+    assert snapshots.restore(pg_session, "ratesheet_v2") == (version, len(PARTNERS))
+    commit_changes(pg_session, "ratesheet_v2")
+    assert stored_rates(pg_session) == before
+
+
+def test_burst_of_commits_is_snapshotted_once(pg_engine, pg_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DELAY", 0.5)
+    for partner in PARTNERS:
+        insert(pg_session, "ratesheet_v2", [partner])
+        commit_changes(pg_session, "ratesheet_v2")
+        snapshots.schedule(pg_engine, {"ratesheet_v2"})
+    assert snapshots.versions_on_disk("ratesheet_v2") == []
+
+    deadline = time.monotonic() + 5
+    while not snapshots.versions_on_disk("ratesheet_v2") and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert snapshots.versions_on_disk("ratesheet_v2") == [len(PARTNERS)]
@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import text
+
+from bulk_load import bulk_insert
+from staging_swap import EmptyUploadError, create_staging, swap_in
+from tests.test_voice_ratecard import insert
+from tests.voice_cases import COUNTRIES
+from upsert_load import NATURAL_KEYS, DiffError, diff_load
+
+COUNTRY_COLUMNS = list(COUNTRIES[0])
+
+
+def stored_countries(session):
+    return sorted(alpha_3 for (alpha_3,) in session.execute(text("SELECT alpha_3 FROM country_v2;")))
+
+
+def test_full_upload_without_rows_keeps_live_table(pg_session):
+    insert(pg_session, "country_v2", COUNTRIES)
+    pg_session.commit()
+
+    create_staging(pg_session, "country_v2")
+    with pytest.raises(EmptyUploadError, match="left unchanged"):
+        swap_in(pg_session, "country_v2")
+    pg_session.rollback()
+    assert stored_countries(pg_session) == sorted(row["alpha_3"] for row in COUNTRIES)
+
+
+def test_full_upload_replaces_live_table(pg_session):
+    insert(pg_session, "country_v2", COUNTRIES)
+    pg_session.commit()
+
+    staging = create_staging(pg_session, "country_v2")
+    bulk_insert(pg_session, staging, COUNTRY_COLUMNS, [tuple(COUNTRIES[0].values())])
+    swap_in(pg_session, "country_v2")
+    pg_session.commit()
+    assert stored_countries(pg_session) == [COUNTRIES[0]["alpha_3"]]
+
+
+def test_diff_upload_without_rows_keeps_live_table(pg_session):
+    insert(pg_session, "country_v2", COUNTRIES)
+    pg_session.commit()
+
+    with pytest.raises(DiffError, match="no country_v2 rows"):
+        diff_load(pg_session, "country_v2", COUNTRY_COLUMNS, NATURAL_KEYS["country_v2"], [[]])
+    pg_session.rollback()
+    assert stored_countries(pg_session) == sorted(row["alpha_3"] for row in COUNTRIES)
@@ -0,0 +1,36 @@
+import pandas as pd
+
+import voice_engine
+from tests.voice_cases import COUNTRIES, EXPECTED, MYSAB, PARTNERS, TEMPLATE
+
+
+def case_insensitive(values):
+    """collation_ranks of a database that sorts strings ignoring case, like most locale collations."""
+    distinct = sorted({value for value in values if isinstance(value, str)}, key=lambda value: (value.lower(), value))
+    return {value: rank for rank, value in enumerate(distinct)}
+
+
+def expanded_rows(partners, collate=None):
+    template = pd.DataFrame(TEMPLATE)
+    collation = None
+    if collate:
+        collation = collate(pd.concat([template.destination, template.area_code, template.calls_type]))
+    reference = voice_engine.ReferenceData(template, pd.DataFrame(COUNTRIES), collation)
+    frame = voice_engine.expand(pd.DataFrame(partners), reference, collate)
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def test_expand_returns_expected_rows():
+    assert expanded_rows(PARTNERS) == EXPECTED
+
+
+def test_expand_without_country_match_is_empty():
+    assert expanded_rows([p for p in PARTNERS if p["tadig_plmn_code"].startswith("XXX")]) == []
+
+
+def test_expand_follows_database_collation():
+    rows = expanded_rows(PARTNERS, case_insensitive)
+    assert sorted(rows, key=repr) == sorted(EXPECTED, key=repr)
+    misc = [row[8] for row in rows if row[3] == MYSAB and row[10] == 5]
+    assert misc == sorted(misc, key=str.lower)
+    assert misc != [row[8] for row in EXPECTED if row[3] == MYSAB and row[10] == 5]
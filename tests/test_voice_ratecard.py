@@ -0,0 +1,33 @@
+from sqlalchemy import text
+
+import voice_ratecard
+from tests.voice_cases import COUNTRIES, EXPECTED, PARTNERS, TEMPLATE
+
+
+def insert(session, table, rows):
+    columns = list(rows[0])
+    session.execute(
+        text(f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join(":" + c for c in columns)});'),
+        rows,
+    )
+
+
+def load_voice_cases(session):
+    insert(session, "country_v2", COUNTRIES)
+    insert(session, "template", TEMPLATE)
+    insert(session, "ratesheet_v2", PARTNERS)
+    session.commit()
+
+
+def test_sql_returns_expected_rows(pg_session):
+    load_voice_cases(pg_session)
+    rows = [tuple(row) for row in pg_session.execute(text(voice_ratecard.SQL))]
+    assert rows == EXPECTED
+
+
+def test_precomputed_table_matches_sql(pg_session):
+    load_voice_cases(pg_session)
+    assert voice_ratecard.rebuild_voice_ratecard(pg_session) == len(EXPECTED)
+    assert voice_ratecard.is_current(pg_session)
+    rows = [tuple(row) for row in pg_session.execute(text(voice_ratecard.SQL_MATERIALIZED))]
+    assert rows == EXPECTED
@@ -0,0 +1,76 @@
+from datetime import date
+
+# Fixed inputs for the voice ratecard and the rows every generator must
+# return for them, in order (voice_ratecard.SQL, voice_engine.expand).
+# MYSAB and SGPXY take each other's country as a ROW destination; XXXAB has
+# no country_v2 row and gets no ratecard. "Data" matches no branch.
+# EXPECTED is in code point order, the order of a "C"-collated test
+# database; "directory calls" sorts before "Toll Free" under most locale
+# collations instead.
+COUNTRIES = [
+    {"alpha_3": "MYS", "custom_name": "Malaysia"},
+    {"alpha_3": "SGP", "custom_name": "Singapore"},
+]
+
+TEMPLATE = [
+    {"destination": "National", "area_code": "60", "rate": 0.0, "date": date(2025, 1, 1), "rounding_rules": None,
+     "destination_type": "Mobile", "setup_rate": 0.0, "calls_type": "National", "remarks": None},
+    {"destination": "Malaysia", "area_code": "60", "rate": 0.0, "date": date(2025, 1, 1), "rounding_rules": None,
+     "destination_type": "Fixed", "setup_rate": 0.0, "calls_type": "ROW", "remarks": None},
+    {"destination": "Singapore", "area_code": "65", "rate": 0.0, "date": date(2025, 1, 1), "rounding_rules": None,
+     "destination_type": "Fixed", "setup_rate": 0.0, "calls_type": "ROW", "remarks": "NaN"},
+    {"destination": "Incoming", "area_code": None, "rate": 0.0, "date": date(2025, 1, 1), "rounding_rules": None,
+     "destination_type": "Mobile", "setup_rate": 0.0, "calls_type": "MTC CALLS", "remarks": None},
+    {"destination": "Toll Free", "area_code": "1800", "rate": 0.05, "date": date(2025, 1, 1),
+     "rounding_rules": "60/60", "destination_type": "Special", "setup_rate": 0.1, "calls_type": "Toll Free",
+     "remarks": "free"},
+    {"destination": "Premium", "area_code": "1900", "rate": 1.5, "date": date(2025, 1, 1), "rounding_rules": "1/1",
+     "destination_type": "Premium", "setup_rate": 0.2, "calls_type": "Premium", "remarks": None},
+    {"destination": "Directory", "area_code": "103", "rate": 0.1, "date": date(2025, 1, 1), "rounding_rules": "60/60",
+     "destination_type": "Special", "setup_rate": 0.0, "calls_type": "directory calls", "remarks": None},
+    {"destination": "Data", "area_code": None, "rate": 1.0, "date": date(2025, 1, 1), "rounding_rules": None,
+     "destination_type": "Other", "setup_rate": 0.0, "calls_type": "GPRS", "remarks": None},
+]
+
+# voice rate and normalized rounding rule columns of ratesheet_v2
+PARTNERS = [
+    {"tadig_plmn_code": "MYSAB", "start_date": date(2025, 7, 1),
+     "moc_call_local_call_rate_value": 0.1, "moc_call_local_call_rounding_rule": "1/1",
+     "moc_call_call_back_home_rate_value": 0.2, "moc_call_call_back_home_rounding_rule": "60/60",
+     "moc_call_rest_of_the_world_rate_value": 0.3, "moc_call_rest_of_the_world_rounding_rule": "30/30",
+     "mtc_call_rate_value": 0.05, "mtc_call_rounding_rule": "1/1"},
+    # no start_date: the tariff name keeps the old fixed date
+    {"tadig_plmn_code": "SGPXY", "start_date": None,
+     "moc_call_local_call_rate_value": 0.4, "moc_call_local_call_rounding_rule": "60/60",
+     "moc_call_call_back_home_rate_value": 0.5, "moc_call_call_back_home_rounding_rule": "60/60",
+     "moc_call_rest_of_the_world_rate_value": 0.6, "moc_call_rest_of_the_world_rounding_rule": "60/60",
+     "mtc_call_rate_value": 0.0, "mtc_call_rounding_rule": "60/60"},
+    {"tadig_plmn_code": "XXXAB", "start_date": date(2025, 7, 1),
+     "moc_call_local_call_rate_value": 0.7, "moc_call_local_call_rounding_rule": "1/1",
+     "moc_call_call_back_home_rate_value": 0.7, "moc_call_call_back_home_rounding_rule": "1/1",
+     "moc_call_rest_of_the_world_rate_value": 0.7, "moc_call_rest_of_the_world_rounding_rule": "1/1",
+     "mtc_call_rate_value": 0.7, "mtc_call_rounding_rule": "1/1"},
+]
+
+MYSAB = "CELC_IR_VOICE_TARIFF_MYSAB_20250701"
+SGPXY = "CELC_IR_VOICE_TARIFF_SGPXY_20250701"
+D = date(2025, 1, 1)
+
+# destination, area_code, rate, tariff_name, date, rounding_rules, destination_type, setup_rate, calls_type,
+# remarks, source_order
+EXPECTED = [
+    ("National", "60", 0.1, MYSAB, D, "1/1", "Mobile", 0.0, "National", None, 1),
+    ("Malaysia", "60", 0.2, MYSAB, D, "60/60", "Fixed", 0.0, "ROW", None, 2),
+    ("Singapore", "65", 0.3, MYSAB, D, "30/30", "Fixed", 0.0, "ROW", None, 3),
+    ("Incoming", None, 0.05, MYSAB, D, "1/1", "Mobile", 0.0, "MTC CALLS", None, 4),
+    ("Premium", "1900", 1.5, MYSAB, D, "1/1", "Premium", 0.2, "Premium", None, 5),
+    ("Toll Free", "1800", 0.05, MYSAB, D, "60/60", "Special", 0.1, "Toll Free", "free", 5),
+    ("Directory", "103", 0.1, MYSAB, D, "60/60", "Special", 0.0, "directory calls", None, 5),
+    ("National", "60", 0.4, SGPXY, D, "60/60", "Mobile", 0.0, "National", None, 1),
+    ("Singapore", "65", 0.5, SGPXY, D, "60/60", "Fixed", 0.0, "ROW", None, 2),
+    ("Malaysia", "60", 0.6, SGPXY, D, "60/60", "Fixed", 0.0, "ROW", None, 3),
+    ("Incoming", None, 0.0, SGPXY, D, "60/60", "Mobile", 0.0, "MTC CALLS", None, 4),
+    ("Premium", "1900", 1.5, SGPXY, D, "1/1", "Premium", 0.2, "Premium", None, 5),
+    ("Toll Free", "1800", 0.05, SGPXY, D, "60/60", "Special", 0.1, "Toll Free", "free", 5),
+    ("Directory", "103", 0.1, SGPXY, D, "60/60", "Special", 0.0, "directory calls", None, 5),
+]
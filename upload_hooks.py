@@ -0,0 +1,57 @@
+import logging
+
+from table_versions import bump_versions
+
+logger = logging.getLogger(__name__)
+
+# Callables run after an upload has committed new data, in registration order.
+_listeners = []
+# Callables run inside the upload's transaction, just before it commits.
+_before_commit = []
+
+
+def on_tables_changed(fn):
+    """
+    Register `fn(tables)` to run after an upload commits. `tables` is the set
+    of table names that changed. Usable as a decorator.
+    """
+    _listeners.append(fn)
+    return fn
+
+
+def before_commit(fn):
+    """
+    Register `fn(session, tables)` to run in the transaction of
+    commit_changes, after the version bump and before the commit. Unlike
+    listeners, an exception here rolls the whole upload back. Usable as a
+    decorator.
+    """
+    _before_commit.append(fn)
+    return fn
+
+
+def tables_changed(*tables):
+    """
+    Notify listeners that `tables` were rewritten. Called by the upload
+    endpoints after their commit; a failing listener is logged and does not
+    affect the upload or the remaining listeners.
+    """
+    changed = frozenset(tables)
+    for fn in _listeners:
+        try:
+            fn(changed)
+        except Exception:
+            logger.exception(f"Listener {fn.__name__} failed for tables {sorted(changed)}")
+
+
+def commit_changes(session, *tables):
+    """
+    Bump the version of `tables` in the session's transaction, commit, then
+    notify listeners. Use this instead of a bare commit whenever an upload or
+    edit rewrites table data.
+    """
+    bump_versions(session, tables)
+    for fn in _before_commit:
+        fn(session, frozenset(tables))
+    session.commit()
+    tables_changed(*tables)
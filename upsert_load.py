@@ -0,0 +1,179 @@
+import hashlib
+import logging
+
+from sqlalchemy import text
+
+from bulk_load import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+
+def row_hash(row):
+    """Short, stable content hash of one insert-ready row tuple."""
+    return hashlib.blake2b(repr(tuple(row)).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def with_row_hash(rows):
+    """Append row_hash(row) to every row, for loads into tables with a row_hash column."""
+    for row in rows:
+        row = tuple(row)
+        yield row + (row_hash(row),)
+
+
+def _key(values):
+    # CHAR(n) columns come back space-padded
+    return tuple(v.rstrip() if isinstance(v, str) else v for v in values)
+
+
+# Natural key of each table loaded through this module. schema.ensure_schema
+# backs each with a unique index (natural_key_index), which diff_load's
+# ON CONFLICT needs and swap_in carries over to every full upload.
+NATURAL_KEYS = {
+    "ratesheet_v2": ["tadig_plmn_code", "start_date"],
+    "country_v2": ["alpha_3"],
+}
+
+
+def natural_key_index(table):
+    return f"{table}_natural_key_idx"
+
+
+class DiffError(ValueError):
+    """The sheet can't be applied as a diff (missing or duplicate natural keys)."""
+
+
+class DuplicateKeyError(ValueError):
+    """Rows share a natural key that the live table keeps unique."""
+
+
+def has_natural_key(conn, table):
+    """True when `table` has its unique natural key index."""
+    return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL;"),
+                        {"name": natural_key_index(table)}).scalar()
+
+
+def duplicate_keys(conn, table, key_columns, limit=5):
+    """Up to `limit` (key tuple, count) pairs for natural keys stored more than once in `table`."""
+    keys = ", ".join(key_columns)
+    not_null = " AND ".join(f"{k} IS NOT NULL" for k in key_columns)
+    rows = conn.execute(text(
+        f"SELECT {keys}, count(*) FROM {table} WHERE {not_null} "
+        f"GROUP BY {keys} HAVING count(*) > 1 ORDER BY count(*) DESC, {keys} LIMIT :limit;"
+    ), {"limit": limit}).fetchall()
+    return [(_key(row[:-1]), row[-1]) for row in rows]
+
+
+def _describe(duplicates):
+    return ", ".join(f"{'/'.join(str(v) for v in key)} ({count} rows)" for key, count in duplicates)
+
+
+def ensure_natural_keys(conn):
+    """
+    Create the unique natural key index of every NATURAL_KEYS table that has
+    none yet. A table that already stores duplicate keys is left without it
+    (and logged); diff uploads into it are refused until a full upload
+    without duplicates replaces its rows.
+    """
+    for table, key_columns in NATURAL_KEYS.items():
+        if has_natural_key(conn, table):
+            continue
+        duplicates = duplicate_keys(conn, table, key_columns)
+        if duplicates:
+            logger.warning("Not creating %s: %s has duplicate (%s) rows, e.g. %s",
+                           natural_key_index(table), table, ", ".join(key_columns), _describe(duplicates))
+            continue
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX {natural_key_index(table)} ON {table} ({', '.join(key_columns)});"
+        ))
+        logger.info("Created %s", natural_key_index(table))
+
+
+def check_unique_keys(session, table, source, key_columns):
+    """
+    Raise DuplicateKeyError naming the repeated natural keys in `source` (a
+    loaded staging copy of `table`) when `table` keeps them unique, before
+    swap_in would fail rebuilding the index with a bare unique violation.
+    """
+    if not has_natural_key(session, table):
+        return
+    duplicates = duplicate_keys(session, source, key_columns)
+    if duplicates:
+        raise DuplicateKeyError(
+            f"Duplicate ({', '.join(key_columns)}) in sheet: {_describe(duplicates)}; "
+            f"{table} allows one row per key"
+        )
+
+
+def diff_load(session, table, columns, key_columns, chunks, delete_missing=True):
+    """
+    Apply a full new sheet to `table` as a diff instead of TRUNCATE-and-reload.
+
+    `chunks` yields lists of row tuples ordered like `columns`. Each row is
+    hashed and matched to the stored row with the same natural key
+    (`key_columns`). New and changed rows are copied into a temp table and
+    merged with INSERT ... ON CONFLICT DO UPDATE. Stored rows whose key is no
+    longer in the sheet are deleted, unless delete_missing is False (the
+    sheet is known to be incomplete). Unchanged rows are not touched, so their
+    ids survive. Runs in the session's transaction; the caller commits.
+
+    Returns {"inserted", "updated", "deleted", "unchanged"} counts.
+    """
+    keys = ", ".join(key_columns)
+    key_pos = [columns.index(k) for k in key_columns]
+    incoming_table = f"{table}_incoming"
+
+    # ON CONFLICT needs the unique index; schema.ensure_natural_keys skips tables holding duplicates
+    if not has_natural_key(session, table):
+        raise DiffError(f"{table} has duplicate ({keys}) rows "
+                        f"({_describe(duplicate_keys(session, table, key_columns))}); do a full upload first")
+
+    stored = {
+        _key(row[:-2]): (row[-2], row[-1])
+        for row in session.execute(text(f"SELECT {keys}, id, row_hash FROM {table};"))
+    }
+    session.execute(text(
+        f"CREATE TEMP TABLE {incoming_table} ON COMMIT DROP AS "
+        f"SELECT {', '.join(columns)}, row_hash FROM {table} WITH NO DATA;"
+    ))
+
+    summary = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    seen = set()
+    for chunk in chunks:
+        changed = []
+        for row in chunk:
+            row = tuple(row)
+            key = _key(row[i] for i in key_pos)
+            if any(k is None for k in key):
+                raise DiffError(f"Row with empty ({keys}) can't be matched: {key}")
+            if key in seen:
+                raise DiffError(f"Duplicate ({keys}) in sheet: {key}")
+            seen.add(key)
+            digest = row_hash(row)
+            existing = stored.get(key)
+            if existing is None:
+                summary["inserted"] += 1
+            elif existing[1] != digest:
+                summary["updated"] += 1
+            else:
+                summary["unchanged"] += 1
+                continue
+            changed.append(row + (digest,))
+        if changed:
+            bulk_insert(session, incoming_table, list(columns) + ["row_hash"], changed)
+
+    if delete_missing and not seen and stored:
+        raise DiffError(f"The sheet has no {table} rows; refusing to delete all {len(stored)} stored rows")
+    gone = [record_id for key, (record_id, _) in stored.items() if key not in seen] if delete_missing else []
+    if gone:
+        session.execute(text(f"DELETE FROM {table} WHERE id = ANY(:ids);"), {"ids": gone})
+    summary["deleted"] = len(gone)
+
+    if summary["inserted"] or summary["updated"]:
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in list(columns) + ["row_hash"] if c not in key_columns)
+        session.execute(text(
+            f"INSERT INTO {table} ({', '.join(columns)}, row_hash) "
+            f"SELECT {', '.join(columns)}, row_hash FROM {incoming_table} "
+            f"ON CONFLICT ({keys}) DO UPDATE SET {updates};"
+        ))
+    logger.info("Diff load into %s: %s", table, summary)
+    return summary
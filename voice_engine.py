@@ -0,0 +1,198 @@
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import reference_cache
+import snapshots
+from partner_export import TARIFF_PREFIX
+from rate_history import as_of_sql
+from reference_cache import collation_ranks, read_frame
+
+# In-process voice ratecard generator. The five-branch SQL is a template
+# expansion: every partner times the template rows, with the rate picked per
+# branch. Here template and country_v2 come from reference_cache, with the
+# arrays below derived once per reference version; each request only reads
+# the partner columns of ratesheet_v2 and expands them with NumPy index
+# arithmetic. Rows and order match voice_ratecard.SQL: strings are ranked
+# in the database's collation (reference_cache.collation_ranks), which need
+# not be code point order.
+# ratecard_bundle and rate_index build on the same branches and ranks.
+
+MISC_CALL_TYPES = [
+    'Customer Care', 'directory calls', 'emergency calls', 'Satellite',
+    'Local Short Code', 'Premium', 'Toll Free',
+]
+# tariff date of rows without a start_date (the date every tariff used to carry)
+DEFAULT_TARIFF_DATE = "20250701"
+VOICE_COLUMNS = [
+    "destination", "area_code", "rate", "tariff_name", "date", "rounding_rules",
+    "destination_type", "setup_rate", "calls_type", "remarks", "source_order",
+]
+# (source_order, rate column, rounding rule column) per voice branch; the
+# rules were normalized at upload (ratesheet_schema.interval_columns)
+VOICE_BRANCHES = [
+    (1, "moc_call_local_call_rate_value", "moc_call_local_call_rounding_rule"),
+    (2, "moc_call_call_back_home_rate_value", "moc_call_call_back_home_rounding_rule"),
+    (3, "moc_call_rest_of_the_world_rate_value", "moc_call_rest_of_the_world_rounding_rule"),
+    (4, "mtc_call_rate_value", "mtc_call_rounding_rule"),
+    (5, "rate", "rounding_rules"),
+]
+
+PARTNER_COLUMNS = ["tadig_plmn_code", "start_date"] + [c for _, rate, rule in VOICE_BRANCHES[:4] for c in (rate, rule)]
+PARTNERS_SQL = f"SELECT {', '.join(PARTNER_COLUMNS)} FROM ratesheet_v2 ORDER BY id;"
+
+
+def tariff_names(partners):
+    """tariff_name per partner row: prefix, TADIG code and start_date as YYYYMMDD (like the SQL)."""
+    dates = pd.to_datetime(partners.start_date, errors="coerce").dt.strftime("%Y%m%d")
+    return TARIFF_PREFIX + partners.tadig_plmn_code + '_' + dates.fillna(DEFAULT_TARIFF_DATE)
+
+
+def _dense_rank(keys):
+    """Dense rank of each row of a key DataFrame under ORDER BY all columns, NULLs last."""
+    ranks = np.zeros(len(keys), dtype=np.int64)
+    if len(keys):
+        ordered = keys.sort_values(list(keys.columns), na_position="last")
+        ranks[ordered.index.to_numpy()] = (~ordered.duplicated()).cumsum().to_numpy()
+    return ranks
+
+
+class ReferenceData:
+    """Template and country arrays plus everything about them the expansion needs."""
+
+    def __init__(self, template, country, collation=None):
+        template = template.reset_index(drop=True)
+        template[["rate", "setup_rate"]] = template[["rate", "setup_rate"]].astype("float64")
+        self.country = country[country.alpha_3.notna()]
+        self.size = len(template)
+        self.columns = {
+            name: template[name].to_numpy(dtype=object)
+            for name in ("destination", "area_code", "date", "destination_type", "calls_type")
+        }
+        self.columns["remarks"] = template.remarks.where(template.remarks != 'NaN', None).to_numpy(dtype=object)
+        self.rate = template.rate.to_numpy(dtype="float64")
+        self.setup_rate = template.setup_rate.to_numpy(dtype="float64")
+        self.rounding = template.rounding_rules.to_numpy(dtype=object)
+
+        destination, calls_type = template.destination, template.calls_type
+        self.national = np.flatnonzero((destination == 'National').to_numpy())
+        self.mtc = np.flatnonzero((calls_type == 'MTC CALLS').to_numpy())
+        self.misc = np.flatnonzero(calls_type.isin(MISC_CALL_TYPES).to_numpy())
+        self.is_row = (calls_type == 'ROW').to_numpy()
+        # destinations as integer codes, so partner custom_name matching is an int compare
+        self.destination_codes = {value: code for code, value in enumerate(destination.dropna().unique())}
+        self.destination_code = destination.map(self.destination_codes).fillna(-1).to_numpy(dtype=np.int64)
+
+        # ORDER BY keys after tariff_name and source_order depend only on the
+        # template row (plus the rate), so rank template rows once per branch;
+        # strings by their `collation` rank (collation_ranks) when there is one
+        tail = {"destination": destination, "area_code": template.area_code, "calls_type": calls_type}
+        if collation is not None:
+            tail = {name: values.map(collation) for name, values in tail.items()}
+        home = pd.DataFrame({"k": tail["calls_type"], **tail})
+        by_destination = pd.DataFrame({"k": tail["destination"], **tail})
+        misc = pd.DataFrame({"k": tail["calls_type"], "k2": tail["destination"], **tail, "rate": template.rate})
+        home_rank, destination_rank = _dense_rank(home), _dense_rank(by_destination)
+        self.rank = {1: home_rank, 2: home_rank, 3: destination_rank, 4: destination_rank, 5: _dense_rank(misc)}
+
+
+def for_reference(reference):
+    """ReferenceData of a reference_cache.Reference, built once per reference version."""
+    return reference.derived("voice_engine", lambda r: ReferenceData(r.template, r.country, r.collation))
+
+
+def reference_data(session):
+    """ReferenceData for the current template/country_v2."""
+    return for_reference(reference_cache.get(session))
+
+
+def expand(partners, reference, collate=None):
+    """
+    Voice ratecard rows for a partners frame (PARTNER_COLUMNS) as a DataFrame
+    with VOICE_COLUMNS, ordered like VOICE_ORDER_BY. `collate(values)` ranks
+    tariff names like collation_ranks (default: by code point).
+    """
+    prefix = partners.tadig_plmn_code.str[:3]
+    partners = partners[prefix.notna()].assign(alpha_3=prefix[prefix.notna()])
+    partners = partners.merge(reference.country, on="alpha_3").reset_index(drop=True)
+    n_partners, n_template = len(partners), reference.size
+    if not n_partners or not n_template:
+        return pd.DataFrame(columns=VOICE_COLUMNS)
+
+    tariff = tariff_names(partners).to_numpy(dtype=object)
+    if collate is None:
+        _, tariff_rank = np.unique(tariff.astype(str), return_inverse=True)
+    else:
+        ranks = collate(tariff)
+        tariff_rank = np.array([ranks[name] for name in tariff], dtype=np.int64)
+    custom = partners.custom_name
+    has_custom = custom.notna().to_numpy()
+    # -2: a custom_name that is no template destination (never equal, still "<>")
+    custom_code = custom.map(reference.destination_codes).fillna(-2).to_numpy(dtype=np.int64)
+    destination_code = reference.destination_code
+
+    pairs = {}
+    for source_order, selected in ((1, reference.national), (4, reference.mtc), (5, reference.misc)):
+        pairs[source_order] = (np.repeat(np.arange(n_partners), len(selected)), np.tile(selected, n_partners))
+    pairs[2] = np.nonzero((destination_code[None, :] == custom_code[:, None]) & has_custom[:, None])
+    pairs[3] = np.nonzero(
+        reference.is_row[None, :] & (destination_code >= 0)[None, :] & has_custom[:, None]
+        & (destination_code[None, :] != custom_code[:, None])
+    )
+
+    p_idx, t_idx, branch, rate, rounding, rank = [], [], [], [], [], []
+    for source_order, rate_column, rule_column in VOICE_BRANCHES:
+        pi, ti = pairs[source_order]
+        p_idx.append(pi)
+        t_idx.append(ti)
+        branch.append(np.full(len(pi), source_order, dtype=np.int64))
+        rank.append(reference.rank[source_order][ti])
+        if source_order == 5:
+            rate.append(reference.rate[ti])
+            rounding.append(reference.rounding[ti])
+        else:
+            rate.append(partners[rate_column].to_numpy(dtype="float64")[pi])
+            rounding.append(partners[rule_column].to_numpy(dtype=object)[pi])
+    p_idx, t_idx, branch = np.concatenate(p_idx), np.concatenate(t_idx), np.concatenate(branch)
+    rate, rounding, rank = np.concatenate(rate), np.concatenate(rounding), np.concatenate(rank)
+
+    # ORDER BY tariff_name, source_order, <template keys>, rate (lexsort: last key is primary)
+    order = np.lexsort((rate, rank, branch, tariff_rank[p_idx]))
+    p_idx, t_idx = p_idx[order], t_idx[order]
+    columns = reference.columns
+    return pd.DataFrame({
+        "destination": columns["destination"][t_idx],
+        "area_code": columns["area_code"][t_idx],
+        "rate": rate[order],
+        "tariff_name": tariff[p_idx],
+        "date": columns["date"][t_idx],
+        "rounding_rules": rounding[order],
+        "destination_type": columns["destination_type"][t_idx],
+        "setup_rate": reference.setup_rate[t_idx],
+        "calls_type": columns["calls_type"][t_idx],
+        "remarks": columns["remarks"][t_idx],
+        "source_order": branch[order],
+    }, columns=VOICE_COLUMNS)
+
+
+def read_partners(session, as_of=None):
+    """
+    Partner columns of ratesheet_v2 (from its snapshot when there is one),
+    or of the rates in effect on `as_of` (rate_history).
+    """
+    if as_of:
+        partners = read_frame(session, as_of_sql(PARTNERS_SQL), {"as_of": as_of})
+    else:
+        partners = snapshots.current_frame(session, "ratesheet_v2", PARTNER_COLUMNS)
+        if partners is None:
+            partners = read_frame(session, PARTNERS_SQL)
+    for column in PARTNER_COLUMNS:
+        if column.endswith("_rate_value"):
+            partners[column] = partners[column].astype("float64")
+    return partners
+
+
+def voice_ratecard(session, as_of=None):
+    """The full voice ratecard for the current tables (or rates as of a date), generated in-process."""
+    return expand(read_partners(session, as_of), reference_data(session), partial(collation_ranks, session))
@@ -0,0 +1,227 @@
+from sqlalchemy import text
+
+from table_versions import bump_versions, get_versions
+
+# Single-pass voice generator: ratesheet_v2, country_v2 and template are each
+# scanned once. Every partner/template pair is fanned out over the five
+# branches with a LATERAL VALUES list and kept when the branch condition holds,
+# giving the rows and source_order of the original UNION ALL of five
+# CROSS JOINs. Rounding rules are read from the columns normalized at upload
+# (charging_interval.py). The join and filters are backed by the indexes in
+# VOICE_INDEXES; tests/test_voice_ratecard.py pins the output.
+VOICE_ROWS_SQL = """
+    WITH partners AS (
+        SELECT
+            a.tadig_plmn_code,
+            a.start_date,
+            b.custom_name,
+            a.moc_call_local_call_rate_value,
+            a.moc_call_local_call_rounding_rule,
+            a.moc_call_call_back_home_rate_value,
+            a.moc_call_call_back_home_rounding_rule,
+            a.moc_call_rest_of_the_world_rate_value,
+            a.moc_call_rest_of_the_world_rounding_rule,
+            a.mtc_call_rate_value,
+            a.mtc_call_rounding_rule
+        FROM ratesheet_v2 a
+        JOIN country_v2 b ON LEFT(a.tadig_plmn_code, 3) = b.alpha_3
+    ),
+    tpl AS (
+        SELECT
+            t.destination,
+            t.area_code,
+            t.rate,
+            t."date"::DATE AS date,
+            t.rounding_rules,
+            t.destination_type,
+            t.setup_rate,
+            t.calls_type,
+            CASE WHEN t.remarks = 'NaN' THEN NULL ELSE t.remarks END AS remarks,
+            t.destination = 'National' AS is_national,
+            t.calls_type = 'ROW' AS is_row,
+            t.calls_type = 'MTC CALLS' AS is_mtc,
+            t.calls_type IN (
+                'Customer Care',
+                'directory calls',
+                'emergency calls',
+                'Satellite',
+                'Local Short Code',
+                'Premium',
+                'Toll Free'
+            ) AS is_misc
+        FROM "template" t
+    )
+    SELECT 
+        t.destination,
+        t.area_code,
+        br.rate,
+        -- effective date of the rates; rows without a start_date keep the old fixed date
+        'CELC_IR_VOICE_TARIFF_' || p.tadig_plmn_code || '_' || COALESCE(to_char(p.start_date, 'YYYYMMDD'), '20250701')
+            AS tariff_name,
+        t.date,
+        br.rounding_rule AS rounding_rules,
+        t.destination_type,
+        t.setup_rate,
+        t.calls_type,
+        t.remarks,
+        br.source_order
+    FROM partners p
+    CROSS JOIN tpl t
+    CROSS JOIN LATERAL (VALUES
+        (1, p.moc_call_local_call_rate_value, p.moc_call_local_call_rounding_rule),
+        (2, p.moc_call_call_back_home_rate_value, p.moc_call_call_back_home_rounding_rule),
+        (3, p.moc_call_rest_of_the_world_rate_value, p.moc_call_rest_of_the_world_rounding_rule),
+        (4, p.mtc_call_rate_value, p.mtc_call_rounding_rule),
+        (5, t.rate, t.rounding_rules)
+    ) AS br(source_order, rate, rounding_rule)
+    WHERE CASE br.source_order
+        -- 1. Local Calls
+        WHEN 1 THEN t.is_national
+        -- 2. Call Back Home
+        WHEN 2 THEN t.destination = p.custom_name
+        -- 3. ROW
+        WHEN 3 THEN t.destination <> p.custom_name AND t.is_row
+        -- 4. MTC CALLS
+        WHEN 4 THEN t.is_mtc
+        -- 5. Special/Miscellaneous Calls from Template Table
+        WHEN 5 THEN t.is_misc
+    END
+"""
+
+VOICE_ORDER_BY = """
+ORDER BY 
+    tariff_name,
+    source_order,
+    -- For ROW block (source_order 3)
+    CASE WHEN source_order = 3 THEN destination ELSE NULL END,
+    -- For Local/Call-Back-Home (1 and 2)
+    CASE WHEN source_order IN (1, 2) THEN calls_type ELSE NULL END,
+    -- For MTC CALLS (4)
+    CASE WHEN source_order = 4 THEN destination ELSE NULL END,
+    -- For Misc block (5)
+    CASE WHEN source_order = 5 THEN calls_type ELSE NULL END,
+    CASE WHEN source_order = 5 THEN destination ELSE NULL END,
+    -- Tie-breakers: make the order total so two generators can be compared row by row
+    destination,
+    area_code,
+    calls_type,
+    rate
+"""
+
+# Indexes backing the voice generator's join and branch filters.
+# The prefix join compares LEFT(...) (text) with alpha_3 (char(3) cast to text).
+VOICE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ratesheet_v2_tadig_prefix_idx ON ratesheet_v2 ((LEFT(tadig_plmn_code, 3)));",
+    "CREATE INDEX IF NOT EXISTS country_v2_alpha_3_idx ON country_v2 ((alpha_3::text));",
+    "CREATE INDEX IF NOT EXISTS country_v2_custom_name_idx ON country_v2 (custom_name);",
+    "CREATE INDEX IF NOT EXISTS template_calls_type_idx ON \"template\" (calls_type);",
+    "CREATE INDEX IF NOT EXISTS template_destination_idx ON \"template\" (destination);",
+]
+
+SQL = f"""
+SELECT *
+FROM ({VOICE_ROWS_SQL}) final_output
+{VOICE_ORDER_BY};
+"""
+
+# Precomputed copy of the SQL output, rebuilt whenever an upload commits, so
+# downloads read it back in order instead of re-running the five CROSS JOINs.
+VOICE_RATECARD_TABLE = "voice_ratecard"
+
+VOICE_COLUMNS = [
+    "destination", "area_code", "rate", "tariff_name", "date", "rounding_rules",
+    "destination_type", "setup_rate", "calls_type", "remarks", "source_order",
+]
+
+CREATE_VOICE_RATECARD = f"""
+CREATE TABLE IF NOT EXISTS {VOICE_RATECARD_TABLE} (
+    row_no BIGINT PRIMARY KEY,
+    destination VARCHAR(100),
+    area_code VARCHAR(20),
+    rate DOUBLE PRECISION,
+    tariff_name VARCHAR(150),
+    date DATE,
+    rounding_rules VARCHAR(50),
+    destination_type VARCHAR(50),
+    setup_rate DOUBLE PRECISION,
+    calls_type VARCHAR(100),
+    remarks TEXT,
+    source_order INTEGER
+);
+"""
+
+REBUILD_VOICE_RATECARD = f"""
+INSERT INTO {VOICE_RATECARD_TABLE} (row_no, {", ".join(VOICE_COLUMNS)})
+SELECT ROW_NUMBER() OVER ({VOICE_ORDER_BY}), {", ".join(VOICE_COLUMNS)}
+FROM ({VOICE_ROWS_SQL}) final_output;
+"""
+
+SQL_MATERIALIZED = f"""
+SELECT {", ".join(VOICE_COLUMNS)}
+FROM {VOICE_RATECARD_TABLE}
+ORDER BY row_no;
+"""
+
+# per-partner lookups: tariff_name LIKE 'CELC_IR_VOICE_TARIFF_<tadig>_%', in row order
+VOICE_RATECARD_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS {VOICE_RATECARD_TABLE}_tariff_idx ON {VOICE_RATECARD_TABLE} "
+    f"(tariff_name text_pattern_ops, row_no);",
+]
+
+# uploads of any of these tables invalidate the precomputed ratecard
+VOICE_SOURCE_TABLES = frozenset(["ratesheet_v2", "template", "country_v2"])
+
+# The table_versions of the source tables voice_ratecard was last built
+# from, written in the rebuild's transaction. Readers compare them with the
+# committed versions, so a rebuild that failed or lost a race is noticed.
+VOICE_SOURCES_TABLE = "voice_ratecard_sources"
+CREATE_VOICE_SOURCES = f"""
+CREATE TABLE IF NOT EXISTS {VOICE_SOURCES_TABLE} (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+"""
+
+# applied by schema.ensure_schema
+VOICE_DDL = VOICE_INDEXES + [CREATE_VOICE_RATECARD, *VOICE_RATECARD_INDEXES, CREATE_VOICE_SOURCES]
+
+
+def built_from(session):
+    """{source table: version} voice_ratecard was last built from; empty when never built."""
+    return dict(session.execute(text(f"SELECT table_name, version FROM {VOICE_SOURCES_TABLE};")).fetchall())
+
+
+def is_current(session):
+    """True when voice_ratecard was built from the committed versions of all its source tables."""
+    return built_from(session) == get_versions(session, VOICE_SOURCE_TABLES)
+
+
+def rebuild_voice_ratecard(session, force=False):
+    """
+    Recompute voice_ratecard from the live tables in one transaction and
+    commit; readers keep seeing the previous contents until then. Rebuilds
+    are serialized by an advisory lock, and one that finds the table current
+    once it holds the lock does nothing unless `force`d. Returns the number
+    of rows written, or None when it was current.
+    """
+    session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name));"), {"name": VOICE_RATECARD_TABLE})
+    # read before the rows: a source committed in between makes the table look stale, not current
+    versions = get_versions(session, VOICE_SOURCE_TABLES)
+    if not force and built_from(session) == versions:
+        session.commit()
+        return None
+    session.execute(text(f"DELETE FROM {VOICE_RATECARD_TABLE};"))
+    written = session.execute(text(REBUILD_VOICE_RATECARD)).rowcount
+    session.execute(text(f"DELETE FROM {VOICE_SOURCES_TABLE};"))
+    session.execute(text(f"INSERT INTO {VOICE_SOURCES_TABLE} (table_name, version) VALUES (:table_name, :version);"),
+                    [{"table_name": name, "version": version} for name, version in versions.items()])
+    bump_versions(session, [VOICE_RATECARD_TABLE])
+    session.commit()
+    return written
+
+
+def ensure_current(session):
+    """Rebuild voice_ratecard when it is stale or was never built. Returns rows written, or None."""
+    if is_current(session):
+        return None
+    return rebuild_voice_ratecard(session)